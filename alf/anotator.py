@@ -1,6 +1,21 @@
+import asyncio
+import collections
+import datetime
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+import warnings
 from abc import ABC, abstractmethod
 import numpy as np
+import pandas as pd
 
+from . import context_manager
 from . import ip_flow
 
 
@@ -21,8 +36,8 @@ class Anotator(ABC):
             df (ip_flow.IPFlows): Flows to anotate.
 
         Returns:
-            ip_flow.IPFlows: Anotated data. Basically same as input with
-            class extension.
+            ip_flow.IPFlows: Anotated data. Either same as input with class
+            extension or only the "class" column with the index of input.
         """
 
 
@@ -44,54 +59,775 @@ class AnotatorMiners(Anotator):
         return flows
 
 
+class IPIntervalIndex:
+    """Set of IP addresses and CIDR prefixes for batched lookups. Plain IPv4
+    addresses are kept in a set of strings, so exact matches cost one hash
+    lookup per distinct IP like plain set of blacklisted addresses. Prefixes
+    and IPv6 entries are converted to address intervals which are merged
+    into sorted disjoint arrays, so longest prefix match reduces to one
+    binary search per address. IPv4 intervals are int64 arrays, IPv6
+    intervals are 16 byte big-endian strings, which keep numerical order.
+    """
+    def __init__(self, entries: list[str]) -> None:
+        """Build index from list of addresses or prefixes, for example
+        ``1.1.1.1``, ``104.16.0.0/12`` or ``2606:4700::/32``. Host bits of
+        prefixes are ignored.
+
+        Args:
+            entries (list[str]): IP addresses or CIDR prefixes.
+
+        Exception:
+            ValueError: If any entry is not an IP address or prefix.
+        """
+        entries = pd.Series(entries, dtype=object)
+        is_v6 = entries.str.contains(":", regex=False).to_numpy(dtype=bool)
+        is_prefix = entries.str.contains("/", regex=False).to_numpy(dtype=bool)
+        self._len = len(entries)
+        plain_v4 = entries[~is_v6 & ~is_prefix]
+        # plain addresses are only validated, lookups go through the set
+        self._parse_v4(plain_v4)
+        self._exact = set(plain_v4)
+        self._v4_starts, self._v4_ends = \
+            self._parse_v4(entries[~is_v6 & is_prefix])
+        self._v6_starts, self._v6_ends = \
+            self._parse_v6(entries[is_v6])
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "IPIntervalIndex":
+        """Load index from file with one address or prefix per line. Empty
+        lines and comments starting with # are skipped.
+
+        Args:
+            filepath (str): Path to file.
+
+        Returns:
+            IPIntervalIndex: Loaded index.
+        """
+        with open(filepath, mode='r', encoding='utf8') as file:
+            lines = [
+                line.split("#", 1)[0].strip()
+                for line in file.read().splitlines()]
+        return cls([line for line in lines if line])
+
+    def __len__(self) -> int:
+        """Number of entries the index was built from."""
+        return self._len
+
+    def contains(self, ips: pd.Series) -> np.ndarray:
+        """Match whole column of IPs against index. Every distinct IP is
+        looked up in the set of plain addresses first. Only IPs not found
+        there are packed to integer keys, and only when the index contains
+        prefixes or IPv6 entries.
+
+        Args:
+            ips (pd.Series): Column of IP addresses (strings or objects
+            convertible to string like pytrap.UnirecIPAddr).
+
+        Returns:
+            np.ndarray: Boolean mask, True if IP is covered by index.
+        """
+        codes, uniques = pd.factorize(ips)
+        strings = [ip if isinstance(ip, str) else str(ip) for ip in uniques]
+        found = np.zeros(len(strings) + 1, dtype=bool)
+        found[:-1] = np.fromiter(
+            (ip in self._exact for ip in strings),
+            dtype=bool, count=len(strings))
+        if len(self._v4_starts) or len(self._v6_starts):
+            rest = np.flatnonzero(~found[:-1])
+            pos_v4, keys_v4, pos_v6, keys_v6 = _pack_ips(
+                [strings[i] for i in rest],
+                v4=len(self._v4_starts) > 0, v6=len(self._v6_starts) > 0)
+            found[rest[pos_v4]] = _in_intervals(
+                self._v4_starts, self._v4_ends, keys_v4)
+            found[rest[pos_v6]] = _in_intervals(
+                self._v6_starts, self._v6_ends, keys_v6)
+        # code -1 (missing IP) points to the last element which is False
+        return found[codes]
+
+    def _parse_v4(self, entries: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized parsing of IPv4 prefixes into merged intervals. All
+        entries are parsed at once into flat array of five numbers per entry
+        (four octets and prefix length).
+        """
+        if len(entries) == 0:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        entries = [
+            entry if "/" in entry else f"{entry}/32" for entry in entries]
+        fields = None
+        if all(e.count(".") == 3 and e.count("/") == 1 for e in entries):
+            with warnings.catch_warnings():
+                # unparsable number is reported as warning by numpy
+                warnings.simplefilter("error")
+                try:
+                    fields = np.fromstring(
+                        ".".join(entries).replace("/", "."),
+                        dtype=np.int64, sep=".").reshape(-1, 5)
+                except (DeprecationWarning, ValueError):
+                    fields = None
+        if fields is None or len(fields) != len(entries):
+            invalid = np.array(
+                [not _is_ipv4_prefix(entry) for entry in entries])
+        else:
+            invalid = \
+                (fields < 0).any(axis=1) \
+                | (fields[:, :4] > 255).any(axis=1) | (fields[:, 4] > 32)
+        if invalid.any():
+            raise ValueError(
+                f"Invalid IP prefix: {entries[np.flatnonzero(invalid)[0]]}")
+        addresses = \
+            (fields[:, 0] << 24) | (fields[:, 1] << 16) \
+            | (fields[:, 2] << 8) | fields[:, 3]
+        host_mask = (1 << (32 - fields[:, 4])) - 1
+        starts = addresses & ~host_mask
+        return _merge_intervals(starts, starts | host_mask)
+
+    def _parse_v6(self, entries: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+        """Parsing of IPv6 prefixes into merged intervals. IPv6 entries are
+        rare in blacklists so ipaddress module is good enough here.
+        """
+        intervals = []
+        for entry in entries:
+            network = ipaddress.IPv6Network(entry, strict=False)
+            intervals.append((
+                int(network.network_address),
+                int(network.broadcast_address)))
+        intervals.sort()
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        starts = np.array(
+            [start.to_bytes(16, "big") for start, _ in merged], dtype="S16")
+        ends = np.array(
+            [end.to_bytes(16, "big") for _, end in merged], dtype="S16")
+        return starts, ends
+
+
 class AnotatorDoH(Anotator):
     """Anotator for DoH classifiaction problem. Passive anotator base on
-    blacklist.
+    blacklist. Blacklist may contain single IP addresses as well as CIDR
+    prefixes, see IPIntervalIndex.
+
+    Blacklist file could be watched for changes. Changed file is parsed in
+    background thread and new index is swapped in at the start of the next
+    anotation, so anotation is never done with half-built index.
     """
-    def __init__(self, blacklist_path: str) -> None:
+    def __init__(
+            self,
+            blacklist_path: str,
+            reload_interval: float = None) -> None:
         """Initialize DOH Anotator class. It is so called passive anotator
-        so we just need blacklist with IP list. It could be modified during
-        runtime since we only save path.
+        so we just need blacklist with IP list.
 
         Args:
             blacklist_path (str): Path to blacklist file.
+            reload_interval (float): If set, blacklist file modification
+            time is checked every reload_interval seconds and blacklist is
+            reloaded on change.
         """
         super().__init__()
+        self._blacklist_path = blacklist_path
+        self._blacklist_mtime = os.stat(blacklist_path).st_mtime_ns
         self._blacklist = self._parse_ip_list(blacklist_path)
+        self._pending = None
+        self._pending_lock = threading.Lock()
+        self._stop_watch = threading.Event()
+        if reload_interval:
+            threading.Thread(
+                target=self._watch, args=(reload_interval,),
+                name="blacklist-watch", daemon=True).start()
+
+    def reload(self) -> bool:
+        """Check blacklist file and reload it immediately if it changed.
+
+        Returns:
+            bool: True if new blacklist is in use.
+        """
+        self._check_blacklist()
+        return self._swap_blacklist()
+
+    def stop_watching(self) -> None:
+        """Stop background watching of blacklist file."""
+        self._stop_watch.set()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop_watch.wait(interval):
+            self._check_blacklist()
+
+    def _check_blacklist(self) -> None:
+        """Parse blacklist file if it was modified since last load. Parsed
+        index is kept as pending until next swap.
+        """
+        try:
+            mtime = os.stat(self._blacklist_path).st_mtime_ns
+        except FileNotFoundError:
+            # file is probably being replaced, try it next time
+            return
+        if mtime == self._blacklist_mtime:
+            return
+        t1 = datetime.datetime.now()
+        try:
+            blacklist = self._parse_ip_list(self._blacklist_path)
+        except (OSError, ValueError) as e:
+            logging.error("Blacklist reload failed, keeping old one: %s", e)
+            self._blacklist_mtime = mtime
+            return
+        reload_t = datetime.datetime.now() - t1
+        with self._pending_lock:
+            self._pending = (blacklist, reload_t.total_seconds())
+            self._blacklist_mtime = mtime
 
-    def _parse_ip_list(self, filepath: str) -> set[str]:
+    def _swap_blacklist(self) -> bool:
+        """Replace blacklist by pending one, if any, and report it.
+
+        Returns:
+            bool: True if blacklist was replaced.
+        """
+        with self._pending_lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return False
+        self._blacklist, reload_t = pending
+        logging.info(
+            "Blacklist reloaded, %s entries in %s s.",
+            len(self._blacklist), reload_t)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "blacklist_reload_t": reload_t,
+            "blacklist_size": len(self._blacklist)
+        })
+        return True
+
+    def _parse_ip_list(self, filepath: str) -> IPIntervalIndex:
         """Parse IP Blacklist from file.
 
         Args:
             filepath (str): filepath to blacklist file.
 
         Returns:
-            set[str]: set of IPs from blacklist file.
+            IPIntervalIndex: index of IPs and prefixes from blacklist file.
         """
-        with open(filepath, mode='r', encoding='utf8') as file:
-            return set(file.read().splitlines())
+        return IPIntervalIndex.from_file(filepath)
 
     def anotate(
             self,
             flows: ip_flow.IPFlowsDataFrame) -> ip_flow.IPFlowsDataFrame:
-        """DOH anotation. Load blacklist and check if any IP in flows DataFrame
-        is in blacklist. If so, we mark it as anotated into "class" column.
+        """DOH anotation. Check if any IP of the flow is in blacklist. If so,
+        we mark it as anotated into "class" column. Input flows are not
+        copied nor modified.
 
         Args:
             flows (ip_flow.IPFlowsDataFrame): IP flows
 
         Returns:
-            ip_flow.IPFlowsDataFrame: Anotated IP flows.
+            ip_flow.IPFlowsDataFrame: "class" column with index of flows.
         """
-        flows_new = flows.copy()
-        flows_new["class"] = np.vectorize(self._is_blacklisted)(
-            flows['SRC_IP'],
-            flows['DST_IP']
-        )
-        return flows_new
-
-    def _is_blacklisted(self, src_ip, dst_ip):
-        ip_blacklist = self._blacklist
+        self._swap_blacklist()
+        blacklist = self._blacklist
         on_blacklist = \
-            (str(src_ip) in ip_blacklist) or (str(dst_ip) in ip_blacklist)
-        return on_blacklist
+            blacklist.contains(flows['SRC_IP']) \
+            | blacklist.contains(flows['DST_IP'])
+        return ip_flow.IPFlowsDataFrame(
+            {"class": on_blacklist}, index=flows.index)
+
+
+class AnotatorRemote(Anotator):
+    """Base class for anotators which ask remote oracle, for example
+    reputation service. Flows are reduced to unique (SRC_IP, DST_IP) pairs,
+    pairs already known are taken from TTL/LRU cache and the rest is sent
+    in batches, at most max_connections batches at the same time. Subclass
+    implements only the query of one batch.
+    """
+    def __init__(
+            self,
+            batch_size: int = 100,
+            max_connections: int = 4,
+            timeout: float = 5.0,
+            cache_size: int = 100000,
+            cache_ttl: float = 3600.0,
+            unknown_ttl: float = 300.0,
+            default_label=False) -> None:
+        """Initialize remote anotator.
+
+        Args:
+            batch_size (int): Max number of IP pairs in one request.
+            max_connections (int): Max number of concurrent requests.
+            timeout (float): Timeout of one request in seconds.
+            cache_size (int): Max number of cached IP pairs.
+            cache_ttl (float): Time to live of cached label in seconds.
+            unknown_ttl (float): Time to live of cached None label (oracle
+            does not know the IP pair) in seconds.
+            default_label: Label of flows whose request failed. Such labels
+            are not cached.
+        """
+        super().__init__()
+        self._batch_size = batch_size
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._cache = _TTLCache(cache_size, cache_ttl)
+        self._unknown_ttl = unknown_ttl
+        self._default_label = default_label
+        self._loop = asyncio.new_event_loop()
+
+    @abstractmethod
+    async def _query_batch(self, batch: list[tuple[str, str]]) -> list:
+        """Query remote oracle for labels of IP pairs.
+
+        Args:
+            batch (list[tuple[str, str]]): List of (SRC_IP, DST_IP) pairs.
+
+        Returns:
+            list: Labels in the same order as batch.
+        """
+
+    async def _close(self) -> None:
+        """Release resources held by the event loop, e.g. connections."""
+
+    def close(self) -> None:
+        """Close connections and event loop of the anotator."""
+        self._loop.run_until_complete(self._close())
+        self._loop.close()
+
+    def anotate(
+            self,
+            flows: ip_flow.IPFlowsDataFrame) -> ip_flow.IPFlowsDataFrame:
+        """Anotate flows by remote oracle. Each unique IP pair not found in
+        cache is queried exactly once.
+
+        Args:
+            flows (ip_flow.IPFlowsDataFrame): IP flows
+
+        Returns:
+            ip_flow.IPFlowsDataFrame: "class" column with index of flows.
+        """
+        src_codes, src_uniques = pd.factorize(flows["SRC_IP"])
+        dst_codes, dst_uniques = pd.factorize(flows["DST_IP"])
+        # missing IP has code -1, so codes are shifted by one
+        src_ips = [None] + [str(ip) for ip in src_uniques]
+        dst_ips = [None] + [str(ip) for ip in dst_uniques]
+        pair_codes, pair_uniques = pd.factorize(
+            (src_codes.astype(np.int64) + 1) * len(dst_ips) + dst_codes + 1)
+        pairs = [
+            (src_ips[code // len(dst_ips)], dst_ips[code % len(dst_ips)])
+            for code in pair_uniques]
+        labels = [self._cache.get(pair, _MISSING) for pair in pairs]
+        missing = [i for i, label in enumerate(labels) if label is _MISSING]
+        batches = [
+            missing[i:i + self._batch_size]
+            for i in range(0, len(missing), self._batch_size)]
+        results = self._loop.run_until_complete(self._query_all(
+            [[pairs[i] for i in batch] for batch in batches]))
+        failed = 0
+        for batch, result in zip(batches, results):
+            if result is None:
+                failed += len(batch)
+                result = [self._default_label] * len(batch)
+            else:
+                for i, label in zip(batch, result):
+                    self._cache.put(
+                        pairs[i], label,
+                        self._unknown_ttl if label is None else None)
+            for i, label in zip(batch, result):
+                labels[i] = label
+        context_manager.ContextProvider.get_context().append_metrics({
+            "remote_cache_hits": len(pairs) - len(missing),
+            "remote_queried": len(missing),
+            "remote_failed": failed
+        })
+        return ip_flow.IPFlowsDataFrame(
+            {"class": np.array(labels, dtype=object)[pair_codes]},
+            index=flows.index)
+
+    async def _query_all(self, batches: list[list[tuple[str, str]]]) -> list:
+        """Query all batches concurrently, at most max_connections at once.
+
+        Returns:
+            list: Labels for each batch, None if query of batch failed.
+        """
+        semaphore = asyncio.Semaphore(self._max_connections)
+
+        async def query(batch):
+            async with semaphore:
+                try:
+                    result = await asyncio.wait_for(
+                        self._query_batch(batch), self._timeout)
+                except (asyncio.TimeoutError, OSError, EOFError,
+                        ValueError) as e:
+                    logging.warning("Remote anotation failed: %r", e)
+                    return None
+                if len(result) != len(batch):
+                    logging.warning("Remote anotation returned %s labels "
+                                    "for %s flows", len(result), len(batch))
+                    return None
+                return result
+        return await asyncio.gather(*(query(batch) for batch in batches))
+
+
+class AnotatorHTTP(AnotatorRemote):
+    """Remote anotator using JSON over HTTP. Batch is sent as POST request
+    with body ``{"flows": [{"src_ip": ..., "dst_ip": ...}, ...]}`` and
+    response body is expected as ``{"labels": [...]}`` in the same order.
+    Connections are kept alive and reused between requests.
+    """
+    def __init__(self, url: str, **options) -> None:
+        """Initialize HTTP anotator.
+
+        Args:
+            url (str): URL of the service, http or https.
+            options: See AnotatorRemote.
+        """
+        super().__init__(**options)
+        url = urllib.parse.urlsplit(url)
+        if url.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme: {url.scheme}")
+        self._ssl = url.scheme == "https"
+        self._host = url.hostname
+        self._port = url.port or (443 if self._ssl else 80)
+        self._path = url.path or "/"
+        if url.query:
+            self._path += f"?{url.query}"
+        self._idle = []
+
+    async def _query_batch(self, batch: list[tuple[str, str]]) -> list:
+        body = json.dumps({"flows": [
+            {"src_ip": src_ip, "dst_ip": dst_ip} for src_ip, dst_ip in batch
+        ]}).encode()
+        if self._idle:
+            try:
+                return await self._request(*self._idle.pop(), body)
+            except (OSError, EOFError):
+                # idle connection was probably closed by the server
+                pass
+        return await self._request(
+            *await asyncio.open_connection(
+                self._host, self._port, ssl=self._ssl or None),
+            body)
+
+    async def _request(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            body: bytes) -> list:
+        """Send one request over given connection and return the connection
+        to pool of idle connections if server keeps it alive.
+        """
+        try:
+            writer.write(
+                f"POST {self._path} HTTP/1.1\r\n"
+                f"Host: {self._host}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = (await reader.readline()).decode("latin-1").split()
+            if not status:
+                raise EOFError("Connection closed by server")
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if "content-length" not in headers:
+                raise ValueError("Response without Content-Length")
+            content = await reader.readexactly(
+                int(headers["content-length"]))
+        except BaseException:
+            writer.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+        if len(status) < 2 or status[1] != "200":
+            raise ValueError(f"Unexpected response: {' '.join(status)}")
+        labels = json.loads(content)
+        if not isinstance(labels, dict) \
+                or not isinstance(labels.get("labels"), list):
+            raise ValueError("Response without list of labels")
+        return labels["labels"]
+
+    async def _close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+class AnnotationQueue:
+    """Persistent queue of flows waiting for human anotation, stored in
+    SQLite database, so flows and labels survive restart and labels could
+    be written by another process (analyst tool) at any time. Each queued
+    flow gets unique ID which is used to resolve it.
+    """
+    def __init__(self, path: str) -> None:
+        """Open or create queue.
+
+        Args:
+            path (str): Path to SQLite database file.
+        """
+        self._connection = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS annotation_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    flow TEXT NOT NULL,
+                    label TEXT,
+                    enqueued REAL NOT NULL,
+                    resolved REAL,
+                    merged INTEGER NOT NULL DEFAULT 0)""")
+            self._connection.execute("""
+                CREATE INDEX IF NOT EXISTS annotation_queue_open
+                ON annotation_queue (merged, resolved)""")
+
+    def put(self, flows: ip_flow.IPFlowsDataFrame) -> np.ndarray:
+        """Put flows into the queue. Values which are not JSON serializable
+        (IP addresses, timestamps) are stored as strings.
+
+        Args:
+            flows (ip_flow.IPFlowsDataFrame): Flows to anotate.
+
+        Returns:
+            np.ndarray: IDs of queued flows in order of flows.
+        """
+        records = json.loads(flows.drop(columns=["class"], errors="ignore")
+                             .to_json(orient="records", default_handler=str))
+        now = time.time()
+        ids = []
+        with self._connection:
+            for record in records:
+                cursor = self._connection.execute(
+                    "INSERT INTO annotation_queue (flow, enqueued) "
+                    "VALUES (?, ?)",
+                    (json.dumps(record), now))
+                ids.append(cursor.lastrowid)
+        return np.array(ids, dtype=np.int64)
+
+    def get_pending(self, limit: int = 100) -> ip_flow.IPFlowsDataFrame:
+        """Get flows waiting for label, oldest first.
+
+        Args:
+            limit (int): Max number of flows.
+
+        Returns:
+            ip_flow.IPFlowsDataFrame: Flows indexed by queue ID.
+        """
+        rows = self._connection.execute(
+            "SELECT id, flow FROM annotation_queue WHERE resolved IS NULL "
+            "ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return ip_flow.IPFlowsDataFrame(
+            [json.loads(flow) for _, flow in rows],
+            index=pd.Index([i for i, _ in rows], name="id"))
+
+    def resolve(self, annotation_id: int, label) -> None:
+        """Set label of queued flow.
+
+        Args:
+            annotation_id (int): ID of the flow.
+            label: Class of the flow.
+
+        Exception:
+            KeyError: If flow with given ID is not waiting for label.
+        """
+        with self._connection:
+            cursor = self._connection.execute(
+                "UPDATE annotation_queue SET label = ?, resolved = ? "
+                "WHERE id = ? AND resolved IS NULL",
+                (json.dumps(label, default=_json_default), time.time(),
+                 int(annotation_id)))
+        if cursor.rowcount == 0:
+            raise KeyError(f"No pending flow with ID {annotation_id}")
+
+    def pending(self) -> int:
+        """Number of flows waiting for label."""
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM annotation_queue WHERE resolved IS NULL"
+        ).fetchone()[0]
+
+    def get_resolved(
+            self) -> tuple[np.ndarray, ip_flow.IPFlowsDataFrame, np.ndarray]:
+        """Get labeled flows which were not merged yet.
+
+        Returns:
+            tuple[np.ndarray, ip_flow.IPFlowsDataFrame, np.ndarray]: IDs,
+            flows with "class" column and label latencies in seconds.
+        """
+        rows = self._connection.execute(
+            "SELECT id, flow, label, resolved - enqueued "
+            "FROM annotation_queue WHERE merged = 0 AND resolved IS NOT NULL "
+            "ORDER BY id").fetchall()
+        flows = ip_flow.IPFlowsDataFrame([
+            json.loads(flow) | {"class": json.loads(label)}
+            for _, flow, label, _ in rows])
+        return \
+            np.array([row[0] for row in rows], dtype=np.int64), \
+            flows, \
+            np.array([row[3] for row in rows], dtype=float)
+
+    def mark_merged(self, ids: np.ndarray) -> None:
+        """Mark resolved flows as merged into database.
+
+        Args:
+            ids (np.ndarray): IDs of merged flows.
+        """
+        with self._connection:
+            self._connection.executemany(
+                "UPDATE annotation_queue SET merged = 1 WHERE id = ?",
+                [(int(i),) for i in ids])
+
+
+class AnotatorHumanQueue(Anotator):
+    """Human anotator which does not block. Flows are put into
+    AnnotationQueue and returned without label (None in "class" column).
+    Such flows are not appended to database, they are merged later when the
+    label arrives, see postprocess.PostprocessorAnnotationQueue.
+    """
+    def __init__(self, queue: AnnotationQueue) -> None:
+        """Initialize anotator.
+
+        Args:
+            queue (AnnotationQueue): Queue for flows to be anotated.
+        """
+        super().__init__()
+        self._queue = queue
+
+    def anotate(
+            self,
+            flows: ip_flow.IPFlowsDataFrame) -> ip_flow.IPFlowsDataFrame:
+        """Put flows into anotation queue.
+
+        Args:
+            flows (ip_flow.IPFlowsDataFrame): IP flows
+
+        Returns:
+            ip_flow.IPFlowsDataFrame: "class" column of None values and
+            "annotation_id" column with queue IDs.
+        """
+        ids = self._queue.put(flows)
+        return ip_flow.IPFlowsDataFrame(
+            {"class": None, "annotation_id": ids}, index=flows.index)
+
+
+# marks key missing in _TTLCache, None is valid cached label
+_MISSING = object()
+
+
+class _TTLCache:
+    """LRU cache with time to live of entries."""
+    def __init__(self, capacity: int, ttl: float) -> None:
+        self._capacity = capacity
+        self._ttl = ttl
+        self._data = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        """Get value of key or default if it is not cached or it expired."""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        value, expires = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value, ttl: float = None) -> None:
+        """Cache value of key for ttl seconds (ttl of cache by default),
+        least recently used entry is evicted if the cache is full."""
+        ttl = self._ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self._capacity:
+            self._data.popitem(last=False)
+
+
+def _json_default(value):
+    """Convert NumPy scalars and arrays (e.g. labels taken from DataFrame)
+    to JSON serializable values."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _pack_ips(
+        ips: list[str],
+        v4: bool = True,
+        v6: bool = True) -> tuple[np.ndarray, ...]:
+    """Pack IP strings into interval keys. Each address is converted by
+    single socket.inet_pton call and the IPv4 results are decoded by one
+    numpy call, which is much faster than ipaddress module. Invalid IPs
+    are skipped.
+
+    Args:
+        ips (list[str]): IP addresses.
+        v4 (bool, optional): Pack IPv4 addresses. Defaults to True.
+        v6 (bool, optional): Pack IPv6 addresses. Defaults to True.
+
+    Returns:
+        tuple[np.ndarray, ...]: Positions and int64 keys of IPv4 addresses,
+        positions and 16 byte keys of IPv6 addresses.
+    """
+    pos_v4, packed_v4, pos_v6, packed_v6 = [], [], [], []
+    for i, ip in enumerate(ips):
+        is_v6 = ":" in ip
+        if (v6 if is_v6 else v4):
+            try:
+                packed = socket.inet_pton(
+                    socket.AF_INET6 if is_v6 else socket.AF_INET, ip)
+            except OSError:
+                continue
+            (pos_v6 if is_v6 else pos_v4).append(i)
+            (packed_v6 if is_v6 else packed_v4).append(packed)
+    keys_v4 = np.frombuffer(b"".join(packed_v4), dtype=">u4")
+    return (
+        np.array(pos_v4, dtype=np.intp), keys_v4.astype(np.int64),
+        np.array(pos_v6, dtype=np.intp), np.array(packed_v6, dtype="S16"))
+
+
+def _is_ipv4_prefix(entry: str) -> bool:
+    """Check if string is valid IPv4 address with prefix length."""
+    try:
+        ipaddress.IPv4Network(entry, strict=False)
+    except ValueError:
+        return False
+    return True
+
+
+def _merge_intervals(
+        starts: np.ndarray,
+        ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Merge overlapping and adjacent intervals.
+
+    Args:
+        starts (np.ndarray): Interval starts.
+        ends (np.ndarray): Interval ends (inclusive).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Sorted disjoint intervals.
+    """
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    new_group = np.ones(len(starts), dtype=bool)
+    new_group[1:] = starts[1:] > reach[:-1] + 1
+    group_starts = np.flatnonzero(new_group)
+    return starts[group_starts], np.maximum.reduceat(ends, group_starts)
+
+
+def _in_intervals(
+        starts: np.ndarray,
+        ends: np.ndarray,
+        keys: np.ndarray) -> np.ndarray:
+    """Vectorized lookup of keys in sorted disjoint intervals.
+
+    Args:
+        starts (np.ndarray): Sorted interval starts.
+        ends (np.ndarray): Interval ends (inclusive).
+        keys (np.ndarray): Values to look up.
+
+    Returns:
+        np.ndarray: Boolean mask of keys covered by any interval.
+    """
+    if len(starts) == 0 or len(keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    idx = np.searchsorted(starts, keys, side="right") - 1
+    return (idx >= 0) & (keys <= ends[np.maximum(idx, 0)])
@@ -1,19 +1,70 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
 from abc import ABC, abstractmethod
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
 from . import ip_flow
 from . import provider
 from . import context_manager
+from . import shared_view
 
 flow = ip_flow.IPFlowsDataFrame
 
+# number of appended batches kept for DManager.get_added_since
+JOURNAL_SIZE = 64
+
+
+class DBSnapshot:
+    """Immutable version of database published by DManager after commit.
+    Readers (e.g. background training or evaluation) keep snapshot while
+    writer appends new flows, snapshot never changes. Flows are shared with
+    the writer, which never modifies them in place, so taking snapshot
+    does not copy database.
+    """
+    def __init__(self, version: int, flows: ip_flow.IPFlows) -> None:
+        """Initialize snapshot.
+
+        Args:
+            version (int): Version of database, increases with every commit.
+            flows (ip_flow.IPFlows): Flows of database in this version.
+        """
+        self._version = version
+        self._flows = flows
+
+    @property
+    def version(self) -> int:
+        """Version of database, increases with every commit."""
+        return self._version
+
+    @property
+    def flows(self) -> ip_flow.IPFlows:
+        """Flows of database. Every access returns new frame sharing values
+        of the snapshot, so adding or replacing columns does not change it
+        and values cannot be modified in place.
+        """
+        return _read_only(self._flows)
+
 
 class DManager(ABC):
     """
     Interface for D_i database
     """
     _db = None
+    _key_columns = None
+    _extra_columns = ()
+    _snapshot = None
+    _stale = False
+    _shared = None
+    _journal = None
+    _added = 0
+    _journal_floor = 0
 
     @abstractmethod
     def get_train_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
@@ -72,6 +123,261 @@ class DManager(ABC):
         Usually should be called after append_to_db() and in postprocessing.
         """
 
+    def get_cursor(self) -> int:
+        """Get cursor of appended flows, see get_added_since.
+
+        Returns:
+            int: Cursor, increases with every append_to_db or set_all.
+        """
+        return self._added
+
+    def get_added_since(
+            self,
+            cursor: int,
+            train_only: bool = False) -> tuple[ip_flow.IPFlows,
+                                               ip_flow.IPFlows]:
+        """Get flows appended since cursor was taken. Last JOURNAL_SIZE
+        appended batches are kept.
+
+        Args:
+            cursor (int): Cursor returned by get_cursor.
+            train_only (bool): Get only flows in current train set (see
+            get_train_set), so flows of test set never reach training.
+
+        Returns:
+            tuple[ip_flow.IPFlows, ip_flow.IPFlows]: Flows and their classes
+            or None if they are not known, because database was replaced
+            by set_all, journal is too short or train set membership is not
+            known.
+        """
+        if cursor < self._journal_floor:
+            return None
+        batches = [
+            (X, y, key) for added, X, y, key in self._journal or ()
+            if added > cursor]
+        if len(batches) < self._added - cursor:
+            return None
+        if not batches:
+            return ip_flow.IPFlowsDataFrame(), pd.Series(dtype=object)
+        X = pd.concat([X for X, _, _ in batches])
+        y = pd.concat([y for _, y, _ in batches])
+        if train_only:
+            in_train = self._in_train_set([key for _, _, key in batches])
+            if in_train is None:
+                return None
+            X, y = X[in_train], y[in_train]
+        return X, y
+
+    def _journal_append(
+            self,
+            X: ip_flow.IPFlows,
+            y: ip_flow.IPFlows,
+            key: np.ndarray = None) -> None:
+        """Record appended batch for get_added_since. Key of the batch is
+        passed to _in_train_set.
+        """
+        if self._journal is None:
+            self._journal = collections.deque(maxlen=JOURNAL_SIZE)
+        self._added += 1
+        self._journal.append((self._added, X, y, key))
+
+    def _in_train_set(self, keys: list[np.ndarray]) -> np.ndarray:
+        """Find flows of journal batches which are in current train set.
+        Not supported by default.
+
+        Args:
+            keys (list[np.ndarray]): Keys of batches given to
+            _journal_append.
+
+        Returns:
+            np.ndarray: Boolean mask of flows of the batches, None if it is
+            not known.
+        """
+        return None
+
+    def _journal_reset(self) -> None:
+        """Forget appended batches, database was replaced. Cursors taken
+        before are invalid.
+        """
+        self._journal = None
+        self._added += 1
+        self._journal_floor = self._added
+
+    def _storage_path(self, suffix: str) -> str:
+        """Get path of database storage in working directory.
+
+        Args:
+            suffix (str): Suffix of path, e.g. file extension.
+
+        Returns:
+            str: ``<working dir>/db.<experiment id><suffix>``
+
+        Exception:
+            ValueError: If working directory is not set.
+        """
+        ctx = context_manager.ContextProvider.get_context()
+        wd = ctx.get_working_dir()
+        if wd is None:
+            raise ValueError("Working directory is not set")
+        return f"{wd}/db.{ctx.get_experiment_id()}{suffix}"
+
+    def snapshot(self) -> DBSnapshot:
+        """Get last committed version of database. It is published on first
+        call after commit, so commits which nobody reads do not read the
+        database. Before the first commit, current database is published.
+
+        Returns:
+            DBSnapshot: Immutable version of database.
+        """
+        if self._stale:
+            self._set_snapshot(self._read_committed())
+        elif self._snapshot is None:
+            self._set_snapshot(self.get_all())
+        return self._snapshot
+
+    def _publish(self) -> None:
+        """Called by commit. With shared memory the new version is
+        published right away, otherwise by next snapshot call.
+        """
+        if self._shared is not None:
+            self._set_snapshot(self.get_all())
+        else:
+            self._stale = True
+
+    def _read_committed(self) -> ip_flow.IPFlows:
+        """Read last committed version of database, current one by default.
+        Returned flows must not be modified in place by the writer
+        afterwards.
+        """
+        return self.get_all()
+
+    def _set_snapshot(self, flows: ip_flow.IPFlows) -> None:
+        """Set new snapshot and publish it to shared memory if enabled."""
+        version = 1 if self._snapshot is None else self._snapshot.version + 1
+        self._snapshot = DBSnapshot(version, flows)
+        self._stale = False
+        if self._shared is not None:
+            self._shared.publish_frame(flows, version)
+
+    def _set_shared(self, **options) -> None:
+        """Create shared memory publisher if ``shared_memory`` option is
+        set. Numeric columns of every snapshot are published under that
+        name, see shared_view.attach_frame.
+        """
+        name = options.get("shared_memory")
+        if name is not None:
+            self._shared = shared_view.SharedPublisher(name)
+
+    def evict(self, positions: np.ndarray) -> None:
+        """Remove flows at given positions (in order of get_all) from
+        database. Default implementation replaces whole database by set_all.
+
+        Args:
+            positions (np.ndarray): Positions of flows to remove.
+        """
+        flows = self.get_all()
+        keep = np.ones(len(flows), dtype=bool)
+        keep[positions] = False
+        self.set_all(flows[keep])
+
+    def set_column(
+            self,
+            column: str,
+            values: np.ndarray,
+            positions: np.ndarray = None) -> None:
+        """Set values of column for flows at given positions (in order of
+        get_all), column is created if it does not exist and registered, see
+        register_column. Default implementation replaces whole database by
+        set_all.
+
+        Args:
+            column (str): Name of column.
+            values (np.ndarray): New values.
+            positions (np.ndarray): Positions of flows, all flows by default.
+        """
+        self.register_column(column)
+        flows = self.get_all().copy()
+        if positions is None:
+            flows[column] = values
+        else:
+            if column not in flows.columns:
+                flows[column] = np.nan
+            flows.iloc[positions, flows.columns.get_loc(column)] = values
+        self.set_all(flows)
+
+    def register_column(self, column: str) -> None:
+        """Keep column in database schema, see _project. Used by options
+        and postprocessors which store their own columns, e.g. "weight" of
+        deduplication or "generation" of retention.
+
+        Args:
+            column (str): Name of column.
+        """
+        if column not in self._extra_columns:
+            self._extra_columns = (*self._extra_columns, column)
+
+    def _set_schema(self, **options) -> None:
+        """Enable schema projection if ``schema`` option is set, see
+        _project.
+        """
+        if options.get("schema", False):
+            self._key_columns = list(options.get("key_columns", []))
+
+    def _project(self, flows: pd.DataFrame) -> pd.DataFrame:
+        """Project flows to database schema: key columns as strings,
+        features from context as float64, "class" and registered columns.
+        Other columns are dropped. Flows are returned unchanged without
+        schema.
+
+        Args:
+            flows (pd.DataFrame): Flows to project.
+
+        Returns:
+            pd.DataFrame: Projected flows.
+        """
+        if self._key_columns is None:
+            return flows
+        features = context_manager.ContextProvider.get_context().get_features()
+        projected = {}
+        for column in self._key_columns:
+            if column in flows.columns:
+                values = flows[column]
+                projected[column] = values.astype(str).where(values.notna())
+        for column in features:
+            projected[column] = flows[column].astype(np.float64)
+        projected["class"] = flows["class"]
+        for column in self._extra_columns:
+            if column in flows.columns:
+                projected[column] = flows[column]
+        return pd.DataFrame(projected, index=flows.index)
+
+    def class_counts(self) -> dict:
+        """Count flows of each class. Default implementation scans whole
+        database, implementations should keep counts up to date instead.
+
+        Returns:
+            dict: Number of flows for each class.
+        """
+        flows = self.get_all()
+        if "class" not in flows:
+            return {}
+        return _count_values(flows["class"])
+
+    def prevalence(self, label=1) -> float:
+        """Get prevalence of class in database.
+
+        Args:
+            label: Class, 1 (or True) by default.
+
+        Returns:
+            float: Ratio of flows of the class, 0 for empty database.
+        """
+        counts = self.class_counts()
+        total = sum(counts.values())
+        if total == 0:
+            return 0.0
+        return counts.get(label, 0) / total
+
 
 class DManagerFile(DManager):
     """DManager implementation for file storage in CSV format. Using pandas
@@ -80,6 +386,16 @@ class DManagerFile(DManager):
     _train_tuple = None
     _test_tuple = None
     _new_tuple = None
+    _split_mode = "random"
+    _class_counts = None
+    _dedup_mode = None
+    _dedup_index = None
+    _dedup_pending = None
+    _committed_size = None
+    _weight_deltas = None
+    _weights_changed = False
+    _committed_db = None
+    _split_test = None
 
     def __init__(self, d_0_path: str, **options) -> None:
         """Initialize DManagerFile. During initialization, it loads database
@@ -88,7 +404,23 @@ class DManagerFile(DManager):
 
         Args:
             d_0_path (str): Path to file with D_0 database (starting set)
+            split (str): ``random`` (default) shuffles flows into train and
+            test set on every fetch, ``hash`` assigns every flow to train or
+            test set by hash of its features, so the assignment is stable.
+            schema (bool): Store only features from context (as float64),
+            "class" and key columns, other columns of appended flows are
+            dropped. Disabled by default.
+            key_columns (list[str]): Columns kept (as strings) with schema,
+            e.g. flow identifiers.
+            dedup (str): ``skip`` does not append flows whose features and
+            class are already in database, ``weight`` also counts them in
+            "weight" column used as sample weight in training. Disabled by
+            default.
+            shared_memory (str): Name under which numeric columns of every
+            committed snapshot are published to shared memory for other
+            processes, see shared_view. Disabled by default.
         """
+        self._set_options(**options)
         ctx = context_manager.ContextProvider.get_context()
         wd = ctx.get_working_dir()
         exp_id = ctx.get_experiment_id()
@@ -98,7 +430,7 @@ class DManagerFile(DManager):
             pd.read_csv(self._db_path)
             return
         except FileNotFoundError:
-            db = pd.read_csv(d_0_path)
+            db = self._project(pd.read_csv(d_0_path))
             db.to_csv(self._db_path, index=False)
         return
 
@@ -110,15 +442,196 @@ class DManagerFile(DManager):
             train_size (float): Size of train set (0.0 - 1.0)
         """
         test_size = options.get("test_size", 0.3)
-        self._db = pd.read_csv(self._db_path)
+        db = self._project(pd.read_csv(self._db_path))
+        if self._db is not None and len(self._db) != len(db):
+            # uncommitted changes are dropped, journal positions are invalid
+            self._journal_reset()
+        self._db = db
+        self._class_counts = None
+        self._weight_deltas = None
+        if len(self._db) != self._committed_size:
+            self._dedup_index = None
+        elif self._dedup_index is not None:
+            # flows appended after last commit are not in the file
+            for row_hash in self._dedup_pending:
+                del self._dedup_index[row_hash]
+        self._dedup_pending = []
+        self._split(test_size)
+
+    def _set_options(self, **options) -> None:
+        """Set options shared by file based DManagers, see __init__."""
+        self._split_mode = options.get("split", "random")
+        if self._split_mode not in ("random", "hash"):
+            raise ValueError(f"Unknown split: {self._split_mode}")
+        self._dedup_mode = options.get("dedup")
+        if self._dedup_mode not in (None, "skip", "weight"):
+            raise ValueError(f"Unknown dedup: {self._dedup_mode}")
+        if self._dedup_mode == "weight":
+            self.register_column("weight")
+        self._set_schema(**options)
+        self._set_shared(**options)
+
+    def _row_hashes(self, flows: pd.DataFrame) -> np.ndarray:
+        """Hash features (as floats) and class of flows."""
+        features = context_manager.ContextProvider.get_context().get_features()
+        rows = flows[features].astype(float)
+        rows["class"] = flows["class"].to_numpy()
+        return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+    def _dedup(self, flows: pd.DataFrame) -> pd.DataFrame:
+        """Remove flows which are already in database or repeated in flows.
+        Index of hashes of stored flows is built on first use after database
+        is replaced and kept up to date on append. In ``weight`` mode weights
+        of duplicates are recorded as increments of the stored flow, see
+        _add_weights.
+
+        Args:
+            flows (pd.DataFrame): Flows to append.
+
+        Returns:
+            pd.DataFrame: Flows which are not in database yet.
+        """
+        if self._db is not None and self._dedup_mode == "weight" \
+                and "weight" not in self._db.columns:
+            self._db = self._db.assign(weight=1.0)
+            self._weights_changed = True
+        if self._dedup_index is None:
+            self._dedup_index = {}
+            self._dedup_pending = []
+            if self._db is not None and len(self._db) > 0:
+                for position, row_hash in enumerate(
+                        self._row_hashes(self._db)):
+                    self._dedup_index.setdefault(row_hash, position)
+        codes, uniques = pd.factorize(self._row_hashes(flows))
+        _, first = np.unique(codes, return_index=True)
+        known = np.fromiter(
+            (row_hash in self._dedup_index for row_hash in uniques),
+            dtype=bool, count=len(uniques))
+        added = flows.iloc[first[~known]]
+        if self._dedup_mode == "weight":
+            weights = np.bincount(
+                codes,
+                weights=flows["weight"].to_numpy(dtype=float)
+                if "weight" in flows.columns else None,
+                minlength=len(uniques))
+            if known.any():
+                positions = np.fromiter(
+                    (self._dedup_index[row_hash]
+                        for row_hash in uniques[known]),
+                    dtype=np.int64, count=np.count_nonzero(known))
+                self._add_weights(positions, weights[known])
+            added = added.assign(weight=weights[~known])
+        size = 0 if self._db is None else len(self._db)
+        for offset, row_hash in enumerate(uniques[~known]):
+            self._dedup_index[row_hash] = size + offset
+        self._dedup_pending.extend(uniques[~known])
+        return added
+
+    def _add_weights(
+            self,
+            positions: np.ndarray,
+            increments: np.ndarray) -> None:
+        """Record increments of "weight" column of stored flows. They are
+        added to the column in one pass when database is read next time, see
+        _apply_weights.
+
+        Args:
+            positions (np.ndarray): Positions of stored flows.
+            increments (np.ndarray): Added weights.
+        """
+        if self._weight_deltas is None:
+            self._weight_deltas = []
+        self._weight_deltas.append((positions, increments))
+
+    def _apply_weights(self) -> None:
+        """Add recorded weight increments to "weight" column."""
+        if not self._weight_deltas:
+            return
+        weight = self._db["weight"].to_numpy(dtype=float, copy=True)
+        for positions, increments in self._weight_deltas:
+            np.add.at(weight, positions, increments)
+        self._weight_deltas = None
+        # new column, published snapshot keeps the old one
+        self._db = self._db.assign(weight=weight)
+
+    def _split(self, test_size: float, is_test: np.ndarray = None) -> None:
+        """Split database into train and test sets.
+
+        Args:
+            test_size (float): Size of test set (0.0 - 1.0)
+            is_test (np.ndarray): Precomputed test set mask for hash split.
+        """
+        self._apply_weights()
         X = self._db.drop(columns=['class'])
         y = self._db['class']
-        X_train, X_test, y_train, y_test = train_test_split(
-                                                    X, y, test_size=test_size)
-        self._train_tuple = (X_train, y_train)
-        self._test_tuple = (X_test, y_test)
+        if self._split_mode == "hash":
+            if is_test is None:
+                is_test = self._hash_split(self._db, test_size)
+            self._train_tuple = (X[~is_test], y[~is_test])
+            self._test_tuple = (X[is_test], y[is_test])
+            self._split_test = is_test
+            return
+        train, test = train_test_split(
+            np.arange(len(self._db)), test_size=test_size)
+        self._train_tuple = (X.iloc[train], y.iloc[train])
+        self._test_tuple = (X.iloc[test], y.iloc[test])
+        self._split_test = np.ones(len(self._db), dtype=bool)
+        self._split_test[train] = False
         return
 
+    def _in_train_set(self, keys: list[np.ndarray]) -> np.ndarray:
+        """Find flows in train set by their positions in database. Flows
+        appended after the last split are not in train set.
+
+        Args:
+            keys (list[np.ndarray]): Positions of flows of journal batches.
+
+        Returns:
+            np.ndarray: Boolean mask of flows of the batches.
+        """
+        if self._split_test is None:
+            return None
+        positions = np.concatenate(keys)
+        split = positions < len(self._split_test)
+        in_train = np.zeros(len(positions), dtype=bool)
+        in_train[split] = ~self._split_test[positions[split]]
+        return in_train
+
+    def _journal_evict(self, keep: np.ndarray) -> None:
+        """Drop evicted flows from journal and shift positions of others.
+
+        Args:
+            keep (np.ndarray): Boolean mask of flows kept in database.
+        """
+        if not self._journal:
+            return
+        evicted_before = np.cumsum(~keep)
+        for i, (added, X, y, positions) in enumerate(self._journal):
+            kept = keep[positions]
+            positions = positions[kept]
+            self._journal[i] = (
+                added, X[kept], y[kept],
+                positions - evicted_before[positions])
+
+    def _hash_split(
+            self,
+            flows: pd.DataFrame,
+            test_size: float) -> np.ndarray:
+        """Assign flows to test set by hash of their features. Flow with the
+        same features is always assigned to the same set.
+
+        Args:
+            flows (pd.DataFrame): Flows to split.
+            test_size (float): Size of test set (0.0 - 1.0)
+
+        Returns:
+            np.ndarray: Boolean mask of flows in test set.
+        """
+        features = context_manager.ContextProvider.get_context().get_features()
+        hashes = pd.util.hash_pandas_object(
+            flows[features].astype(float), index=False).to_numpy()
+        return (hashes >> np.uint64(32)) < np.uint64(test_size * 2**32)
+
     def get_train_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
         """Get train set
 
@@ -144,13 +657,27 @@ class DManagerFile(DManager):
         """
         if not pd.Series(flows["class"]).notnull().all():
             raise ValueError("Flows to append must be all annotated")
-        self._db = pd.concat([self._db, flows])
+        flows = self._project(flows)
+        metrics = {}
+        if self._dedup_mode is not None:
+            size = len(flows)
+            flows = self._dedup(flows)
+            metrics["dedup_hits"] = size - len(flows)
+            metrics["dedup_rate"] = (size - len(flows)) / size if size else 0
+        stored = 0 if self._db is None else len(self._db)
+        self._db = pd.concat([self._db, flows], ignore_index=True)
+        if self._class_counts is not None:
+            for label, count in _count_values(flows["class"]).items():
+                self._class_counts[label] = \
+                    self._class_counts.get(label, 0) + count
         X = flows.drop(columns=['class'])
         y = flows['class']
         self._new_tuple = (X, y)
+        self._journal_append(X, y, np.arange(stored, len(self._db)))
         context_manager.ContextProvider.get_context().append_metrics({
             "new_flows": len(flows),
-            "d_size": len(self._db)
+            "d_size": len(self._db),
+            **metrics
         })
 
     def get_last_added(self) -> ip_flow.IPFlows:
@@ -162,23 +689,1049 @@ class DManagerFile(DManager):
         Returns:
             ip_flow.IPFlows: List of flows
         """
-        return ip_flow.IPFlowsDataFrame(self._db)
+        if self._db is None:
+            return ip_flow.IPFlowsDataFrame()
+        self._apply_weights()
+        return _read_only(self._db)
 
     def commit(self) -> None:
-        """Commit changes to database file.
+        """Commit changes to database file and publish new snapshot.
         """
+        self._apply_weights()
         self._db.to_csv(self._db_path, index=False)
+        self._committed_size = len(self._db)
+        self._dedup_pending = []
+        self._committed_db = self._db
+        self._publish()
         return
 
+    def _read_committed(self) -> ip_flow.IPFlows:
+        """Database as it was committed, writer replaces it by new frames
+        instead of modifying it in place.
+        """
+        if self._committed_db is None:
+            return self.get_all()
+        return ip_flow.IPFlowsDataFrame(self._committed_db.copy(deep=False))
+
     def set_all(self, flows: ip_flow.IPFlows) -> None:
         """Set all flows in database
 
         Args:
             flows (ip_flow.IPFlows): List of flows to set
         """
-        self._db = flows
+        self._db = self._project(flows)
+        self._class_counts = None
+        self._dedup_index = None
+        self._weight_deltas = None
+        self._split_test = None
+        self._journal_reset()
         return
 
+    def class_counts(self) -> dict:
+        """Count flows of each class. Counts are computed once after the
+        database is loaded or replaced and then updated on append.
+
+        Returns:
+            dict: Number of flows for each class.
+        """
+        if self._class_counts is None:
+            self._class_counts = super().class_counts()
+        return dict(self._class_counts)
+
+    def evict(self, positions: np.ndarray) -> None:
+        """Remove flows at given positions from database. Class counts are
+        updated, other rows are kept as they are.
+
+        Args:
+            positions (np.ndarray): Positions of flows to remove.
+        """
+        self._apply_weights()
+        keep = np.ones(len(self._db), dtype=bool)
+        keep[positions] = False
+        if self._class_counts is not None:
+            evicted = self._db["class"].iloc[np.flatnonzero(~keep)]
+            for label, count in _count_values(evicted).items():
+                self._class_counts[label] -= count
+        self._db = self._db[keep]
+        self._dedup_index = None
+        self._journal_evict(keep)
+        if self._split_test is not None:
+            self._split_test = self._split_test[keep[:len(self._split_test)]]
+
+    def set_column(
+            self,
+            column: str,
+            values: np.ndarray,
+            positions: np.ndarray = None) -> None:
+        """Set values of column for flows at given positions, column is
+        created if it does not exist and registered.
+
+        Args:
+            column (str): Name of column.
+            values (np.ndarray): New values.
+            positions (np.ndarray): Positions of flows, all flows by default.
+        """
+        self.register_column(column)
+        self._apply_weights()
+        if positions is not None:
+            if column in self._db.columns:
+                column_values = self._db[column].to_numpy(copy=True)
+            else:
+                column_values = np.full(len(self._db), np.nan)
+            column_values[positions] = values
+            values = column_values
+        # new column, published snapshot keeps the old one
+        self._db = self._db.assign(**{column: values})
+
+
+class DManagerMemory(DManagerFile):
+    """DManagerFile which keeps the database in memory. CSV file is read only
+    by the first fetch, later fetches only split database kept in memory
+    into train and test sets. Commit still writes the file so database
+    survives restart.
+    """
+
+    _is_test = None
+    _split_size = None
+    _modified = False
+
+    def fetch(self, **options) -> None:
+        """Loads data from CSV file if it is not loaded yet. Split into
+        train and test sets using train_test_split function from sklearn lib.
+        In ``hash`` split mode, train and test sets are not rebuilt if
+        database did not change since last fetch.
+
+        Args:
+            train_size (float): Size of train set (0.0 - 1.0)
+        """
+        test_size = options.get("test_size", 0.3)
+        if self._db is None:
+            self._db = self._load()
+            self._class_counts = None
+            self._dedup_index = None
+        if self._weight_deltas:
+            # weights of stored flows changed since last split
+            self._modified = True
+        if self._split_mode != "hash":
+            self._split(test_size)
+            return
+        if self._is_test is None or self._split_size != test_size:
+            self._is_test = self._hash_split(self._db, test_size)
+            self._split_size = test_size
+        elif self._train_tuple is not None and not self._modified \
+                and len(self._train_tuple[0]) + len(self._test_tuple[0]) \
+                == len(self._db):
+            return
+        self._modified = False
+        self._split(test_size, self._is_test)
+
+    def _load(self) -> pd.DataFrame:
+        """Read database from storage and project it to schema."""
+        return self._project(pd.read_csv(self._db_path))
+
+    def append_to_db(self, flows: ip_flow.IPFlows) -> None:
+        """Append flows to database. In ``hash`` split mode only new flows
+        are assigned to train or test set.
+
+        Args:
+            flows (ip_flow.IPFlows): Flows to append.
+        """
+        super().append_to_db(flows)
+        if self._is_test is not None:
+            self._is_test = np.concatenate([
+                self._is_test,
+                self._hash_split(
+                    self._db.iloc[len(self._is_test):], self._split_size)])
+
+    def set_all(self, flows: ip_flow.IPFlows) -> None:
+        """Set all flows in database
+
+        Args:
+            flows (ip_flow.IPFlows): List of flows to set
+        """
+        super().set_all(flows)
+        self._is_test = None
+
+    def evict(self, positions: np.ndarray) -> None:
+        """Remove flows at given positions from database. In ``hash`` split
+        mode assignment of other flows is kept.
+
+        Args:
+            positions (np.ndarray): Positions of flows to remove.
+        """
+        if self._is_test is not None:
+            keep = np.ones(len(self._is_test), dtype=bool)
+            keep[positions] = False
+            self._is_test = self._is_test[keep]
+        super().evict(positions)
+
+    def set_column(
+            self,
+            column: str,
+            values: np.ndarray,
+            positions: np.ndarray = None) -> None:
+        """Set values of column for flows at given positions. In ``hash``
+        split mode train and test sets are rebuilt by next fetch.
+
+        Args:
+            column (str): Name of column.
+            values (np.ndarray): New values.
+            positions (np.ndarray): Positions of flows, all flows by default.
+        """
+        super().set_column(column, values, positions)
+        self._modified = True
+
+
+class DManagerSegmented(DManagerMemory):
+    """In-memory DManager persisted as append-only storage. Every commit
+    writes only flows appended since previous commit as new immutable
+    Parquet segment and adds it to manifest, so commit cost depends on
+    number of new flows, not on size of database. After set_all, commit
+    writes one compacted snapshot instead. Background thread merges
+    segments when there are more than max_segments of them.
+
+    Storage is directory ``db.<experiment id>`` in working directory with
+    ``manifest.json`` listing segments in order and updates of stored flows
+    (e.g. weights of duplicates), which are applied to segments on load.
+    Requires pyarrow.
+    """
+
+    def __init__(self, d_0_path: str, **options) -> None:
+        """Initialize DManagerSegmented. If storage in working directory
+        does not exist, it is created with D_0 as the first segment.
+
+        Args:
+            d_0_path (str): Path to file with D_0 database (starting set)
+            max_segments (int): Number of segments which triggers
+            compaction, 16 by default.
+            split (str): See DManagerFile.
+            schema (bool): See DManagerFile.
+            key_columns (list[str]): See DManagerFile.
+            dedup (str): See DManagerFile. Weight increments of stored flows
+            are appended as update on commit.
+            shared_memory (str): See DManagerFile.
+        """
+        self._set_options(**options)
+        self._db_dir = self._storage_path("")
+        self._max_segments = options.get("max_segments", 16)
+        self._lock = threading.Lock()
+        self._compactor = None
+        self._uncommitted = []
+        self._uncommitted_updates = []
+        self._snapshot_needed = False
+        try:
+            with open(
+                    f"{self._db_dir}/manifest.json",
+                    encoding="utf8") as file:
+                self._manifest = json.load(file)
+            self._manifest.setdefault("updates", [])
+        except FileNotFoundError:
+            os.makedirs(self._db_dir, exist_ok=True)
+            self._manifest = {"segments": [], "updates": [], "next_id": 0}
+            self._manifest["segments"].append(
+                self._write_segment(self._project(pd.read_csv(d_0_path))))
+            self._write_manifest()
+
+    def _load(self) -> pd.DataFrame:
+        """Read database from segments listed in manifest and project it
+        to schema."""
+        with self._lock:
+            segments = list(self._manifest["segments"])
+            updates = list(self._manifest["updates"])
+        return self._project(
+            self._apply_updates(self._read_segments(segments), updates))
+
+    def _add_weights(
+            self,
+            positions: np.ndarray,
+            increments: np.ndarray) -> None:
+        """Record increments of "weight" column of stored flows, they are
+        written as update on commit.
+        """
+        super()._add_weights(positions, increments)
+        self._record_update("weight", positions, increments, add=True)
+
+    def append_to_db(self, flows: ip_flow.IPFlows) -> None:
+        """Append flows to database. They are written to storage on commit.
+
+        Args:
+            flows (ip_flow.IPFlows): Flows to append.
+        """
+        size = 0 if self._db is None else len(self._db)
+        super().append_to_db(flows)
+        if self._weights_changed:
+            # "weight" column was added to stored flows
+            self._weights_changed = False
+            self._uncommitted = []
+            self._snapshot_needed = True
+        elif len(self._db) > size:
+            self._uncommitted.append(self._db.iloc[size:])
+
+    def set_all(self, flows: ip_flow.IPFlows) -> None:
+        """Set all flows in database. Storage is replaced by one snapshot
+        segment on commit.
+
+        Args:
+            flows (ip_flow.IPFlows): List of flows to set
+        """
+        super().set_all(flows)
+        self._uncommitted = []
+        self._snapshot_needed = True
+
+    def evict(self, positions: np.ndarray) -> None:
+        """Remove flows at given positions from database. Storage is
+        replaced by one snapshot segment on commit.
+
+        Args:
+            positions (np.ndarray): Positions of flows to remove.
+        """
+        super().evict(positions)
+        self._uncommitted = []
+        self._snapshot_needed = True
+
+    def set_column(
+            self,
+            column: str,
+            values: np.ndarray,
+            positions: np.ndarray = None) -> None:
+        """Set values of column for flows at given positions. New values
+        are appended as update on commit.
+
+        Args:
+            column (str): Name of column.
+            values (np.ndarray): New values.
+            positions (np.ndarray): Positions of flows, all flows by default.
+        """
+        super().set_column(column, values, positions)
+        if positions is None:
+            positions = np.arange(len(self._db))
+        values = np.broadcast_to(values, len(positions))
+        self._record_update(column, positions, values)
+
+    def _record_update(
+            self,
+            column: str,
+            positions: np.ndarray,
+            values: np.ndarray,
+            add: bool = False) -> None:
+        """Record update of stored flows written on commit. Consecutive
+        increments of the same column are written as one update.
+        """
+        updates = self._uncommitted_updates
+        if add and updates and updates[-1][:2] == (column, add):
+            updates[-1][2].append((positions, values))
+        else:
+            updates.append((column, add, [(positions, values)]))
+
+    def commit(self) -> None:
+        """Write new flows as segment and changes of stored flows as
+        updates, or whole database as snapshot if it was replaced by set_all.
+        New DBSnapshot is published.
+        """
+        self._apply_weights()
+        if self._snapshot_needed:
+            snapshot = self._write_segment(self._db)
+            with self._lock:
+                obsolete = self._manifest["segments"] + [
+                    update["segment"] for update in self._manifest["updates"]]
+                self._manifest["segments"] = [snapshot]
+                self._manifest["updates"] = []
+                self._write_manifest()
+            self._remove_segments(obsolete)
+        elif self._uncommitted or self._uncommitted_updates:
+            segment = self._write_segment(
+                pd.concat(self._uncommitted, ignore_index=True)) \
+                if self._uncommitted else None
+            updates = [
+                self._write_update(column, changes, add)
+                for column, add, changes in self._uncommitted_updates]
+            # segment and updates referring to its flows are listed together
+            with self._lock:
+                if segment is not None:
+                    self._manifest["segments"].append(segment)
+                self._manifest["updates"].extend(updates)
+                self._write_manifest()
+        self._uncommitted = []
+        self._uncommitted_updates = []
+        self._snapshot_needed = False
+        self._committed_db = self._db
+        self._publish()
+        if len(self._manifest["segments"]) \
+                + len(self._manifest["updates"]) > self._max_segments \
+                and (self._compactor is None
+                     or not self._compactor.is_alive()):
+            self._compactor = threading.Thread(
+                target=self._compact, name="db-compactor", daemon=True)
+            self._compactor.start()
+
+    def _compact(self) -> None:
+        """Merge all current segments and updates into one segment.
+        Segments and updates added during compaction are kept after the
+        merged one, positions of flows do not change.
+        """
+        with self._lock:
+            segments = list(self._manifest["segments"])
+            updates = list(self._manifest["updates"])
+        try:
+            merged = self._write_segment(
+                self._apply_updates(self._read_segments(segments), updates))
+        except FileNotFoundError:
+            # segments were replaced by snapshot in the meantime
+            return
+        with self._lock:
+            current = self._manifest["segments"]
+            current_updates = self._manifest["updates"]
+            if current[:len(segments)] != segments \
+                    or current_updates[:len(updates)] != updates:
+                obsolete = [merged]
+            else:
+                self._manifest["segments"] = \
+                    [merged] + current[len(segments):]
+                self._manifest["updates"] = current_updates[len(updates):]
+                self._write_manifest()
+                obsolete = segments + [
+                    update["segment"] for update in updates]
+        self._remove_segments(obsolete)
+        logging.info("Compacted %s db segments.", len(segments))
+
+    def _write_update(
+            self,
+            column: str,
+            changes: list[tuple[np.ndarray, np.ndarray]],
+            add: bool = False) -> dict:
+        """Write values of column for stored flows to new segment file.
+
+        Args:
+            column (str): Name of column.
+            changes (list[tuple[np.ndarray, np.ndarray]]): Positions of flows
+            and their values, in order of application.
+            add (bool): Values are added to the column instead of set.
+
+        Returns:
+            dict: Manifest entry of the update.
+        """
+        segment = self._write_segment(pd.DataFrame({
+            "position": np.concatenate(
+                [positions for positions, _ in changes]).astype(np.int64),
+            "value": np.concatenate([values for _, values in changes])}))
+        return {"segment": segment, "column": column, "add": add}
+
+    def _apply_updates(
+            self,
+            flows: pd.DataFrame,
+            updates: list[dict]) -> pd.DataFrame:
+        """Apply updates listed in manifest to flows read from segments."""
+        for update in updates:
+            changes = pd.read_parquet(f"{self._db_dir}/{update['segment']}")
+            positions = changes["position"].to_numpy()
+            column = update["column"]
+            if update["add"]:
+                values = flows[column].to_numpy(dtype=float, copy=True)
+                np.add.at(values, positions, changes["value"].to_numpy())
+            else:
+                values = flows[column].to_numpy(copy=True) \
+                    if column in flows.columns else np.full(len(flows), np.nan)
+                values[positions] = changes["value"].to_numpy()
+            flows = flows.assign(**{column: values})
+        return flows
+
+    def _read_segments(self, segments: list[str]) -> pd.DataFrame:
+        return pd.concat(
+            [pd.read_parquet(f"{self._db_dir}/{segment}")
+                for segment in segments],
+            ignore_index=True)
+
+    def _write_segment(self, flows: pd.DataFrame) -> str:
+        """Write flows to new segment file.
+
+        Returns:
+            str: Name of the segment.
+        """
+        with self._lock:
+            name = f"segment-{self._manifest['next_id']:08d}.parquet"
+            self._manifest["next_id"] += 1
+        flows = flows.astype({
+            column: str for column in flows.columns[flows.dtypes == object]
+            if pd.api.types.infer_dtype(flows[column], skipna=True)
+            not in ("string", "boolean", "integer", "floating", "empty")})
+        flows.to_parquet(f"{self._db_dir}/{name}.tmp", index=False)
+        os.replace(f"{self._db_dir}/{name}.tmp", f"{self._db_dir}/{name}")
+        return name
+
+    def _write_manifest(self) -> None:
+        """Atomically replace manifest. Must be called with lock held."""
+        path = f"{self._db_dir}/manifest.json"
+        with open(f"{path}.tmp", "w", encoding="utf8") as file:
+            json.dump(self._manifest, file)
+        os.replace(f"{path}.tmp", path)
+
+    def _remove_segments(self, segments: list[str]) -> None:
+        for segment in segments:
+            try:
+                os.remove(f"{self._db_dir}/{segment}")
+            except FileNotFoundError:
+                pass
+
+
+class DManagerSQLite(DManager):
+    """DManager implementation on SQLite database in WAL mode. Flows are
+    appended in batches and become durable on commit, so crash during
+    generation never leaves database half written. Table has index on
+    "class" column and on insertion time (``_inserted`` column, UNIX
+    timestamp), so class counts and time-windowed or sampled training sets
+    are read without loading the whole database.
+    """
+    _train_tuple = None
+    _test_tuple = None
+    _new_tuple = None
+
+    def __init__(self, d_0_path: str, **options) -> None:
+        """Initialize DManagerSQLite. If database in working directory does
+        not exist, it is created from D_0 CSV file.
+
+        Args:
+            d_0_path (str): Path to file with D_0 database (starting set)
+            sample_size (int): Default number of randomly sampled flows
+            loaded by fetch, whole database by default.
+            window (float): Default age in seconds of the oldest flow loaded
+            by fetch, no limit by default.
+            schema (bool): See DManagerFile.
+            key_columns (list[str]): See DManagerFile.
+            shared_memory (str): See DManagerFile.
+        """
+        path = self._storage_path(".sqlite")
+        self._set_schema(**options)
+        self._set_shared(**options)
+        self._sample_size = options.get("sample_size")
+        self._window = options.get("window")
+        self._all = None
+        self._path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        exists = self._connection.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name = 'flows'").fetchone()
+        if exists is None:
+            db = self._project(pd.read_csv(d_0_path))
+            self._connection.execute(
+                "CREATE TABLE flows ("
+                "_id INTEGER PRIMARY KEY, _inserted REAL NOT NULL, "
+                + ", ".join(
+                    f"{_quote(column)} {_sqlite_type(db[column])}"
+                    for column in db.columns)
+                + ")")
+            self._connection.execute(
+                "CREATE INDEX flows_class ON flows (class)")
+            self._connection.execute(
+                "CREATE INDEX flows_inserted ON flows (_inserted)")
+            self._load_schema()
+            self._insert(db)
+            self._connection.commit()
+        self._load_schema()
+
+    def _load_schema(self) -> None:
+        """Load column names and types of the flows table."""
+        columns = self._connection.execute(
+            "PRAGMA table_info(flows)").fetchall()
+        self._columns = {
+            name: declared for _, name, declared, *_ in columns
+            if name != "_id"}
+
+    def _insert(self, flows: pd.DataFrame) -> None:
+        """Insert flows with executemany. Unknown columns are added to the
+        table. Missing insertion time is set to current time.
+        """
+        if "_inserted" not in flows.columns:
+            flows = flows.assign(_inserted=time.time())
+        new_columns = [
+            column for column in flows.columns
+            if column not in self._columns]
+        for column in new_columns:
+            self._connection.execute(
+                f"ALTER TABLE flows ADD COLUMN {_quote(column)} "
+                f"{_sqlite_type(flows[column])}")
+        if new_columns:
+            self._load_schema()
+        values = [
+            [_sqlite_value(value) for value in flows[column]]
+            for column in flows.columns]
+        self._connection.executemany(
+            f"INSERT INTO flows ({', '.join(map(_quote, flows.columns))}) "
+            f"VALUES ({', '.join('?' * len(flows.columns))})",
+            zip(*values))
+        self._all = None
+
+    def _read(
+            self,
+            query: str,
+            parameters: tuple = (),
+            connection: sqlite3.Connection = None) -> pd.DataFrame:
+        """Read flows by query, convert boolean columns back and project
+        them to schema. Insertion time is kept."""
+        db = pd.read_sql_query(
+            query, connection or self._connection, params=parameters)
+        for column, declared in self._columns.items():
+            if declared == "BOOLEAN" and column in db.columns:
+                db[column] = db[column].map({1: True, 0: False})
+        if self._key_columns is None:
+            return db
+        return self._project(db).assign(_inserted=db["_inserted"])
+
+    def fetch(self, **options) -> None:
+        """Load train and test set from database. Only flows inserted during
+        last window seconds are loaded and if sample_size is set, only random
+        sample of them.
+
+        Args:
+            test_size (float): Size of test set (0.0 - 1.0)
+            sample_size (int): Number of sampled flows.
+            window (float): Age in seconds of the oldest loaded flow.
+        """
+        test_size = options.get("test_size", 0.3)
+        sample_size = options.get("sample_size", self._sample_size)
+        window = options.get("window", self._window)
+        columns = ", ".join(map(_quote, self._columns))
+        query = f"SELECT {columns} FROM flows"
+        parameters = ()
+        if window is not None:
+            query += " WHERE _inserted >= ?"
+            parameters += (time.time() - window,)
+        if sample_size is not None:
+            query += " ORDER BY RANDOM() LIMIT ?"
+            parameters += (int(sample_size),)
+        db = self._read(query, parameters)
+        X = db.drop(columns=['class'])
+        y = db['class']
+        X_train, X_test, y_train, y_test = train_test_split(
+                                                    X, y, test_size=test_size)
+        self._train_tuple = (X_train, y_train)
+        self._test_tuple = (X_test, y_test)
+
+    def get_train_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
+        return self._train_tuple
+
+    def get_test_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
+        return self._test_tuple
+
+    def append_to_db(self, flows: ip_flow.IPFlows) -> None:
+        """Append flows to database. They are durable after commit.
+
+        Args:
+            flows (ip_flow.IPFlows): Flows to append.
+        """
+        if not pd.Series(flows["class"]).notnull().all():
+            raise ValueError("Flows to append must be all annotated")
+        flows = self._project(flows)
+        self._insert(flows)
+        X = flows.drop(columns=['class'])
+        y = flows['class']
+        self._new_tuple = (X, y)
+        self._journal_append(X, y)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "new_flows": len(flows),
+            "d_size": self._connection.execute(
+                "SELECT COUNT(*) FROM flows").fetchone()[0]
+        })
+
+    def get_last_added(self) -> ip_flow.IPFlows:
+        return self._new_tuple
+
+    def get_all(self) -> ip_flow.IPFlows:
+        """Get all flows from database. Result is cached until database
+        changes.
+
+        Returns:
+            ip_flow.IPFlows: List of flows
+        """
+        if self._all is None:
+            columns = ", ".join(map(_quote, self._columns))
+            self._all = ip_flow.IPFlowsDataFrame(
+                self._read(f"SELECT {columns} FROM flows ORDER BY _id"))
+        return _read_only(self._all)
+
+    def set_all(self, flows: ip_flow.IPFlows) -> None:
+        """Replace all flows in database. Insertion time is kept if flows
+        have ``_inserted`` column.
+
+        Args:
+            flows (ip_flow.IPFlows): List of flows to set
+        """
+        projected = self._project(flows)
+        if "_inserted" in flows.columns:
+            projected = projected.assign(_inserted=flows["_inserted"])
+        self._connection.execute("DELETE FROM flows")
+        self._insert(projected)
+        self._journal_reset()
+
+    def commit(self) -> None:
+        """Commit transaction to database and publish new snapshot.
+        """
+        self._connection.commit()
+        self._publish()
+
+    def _read_committed(self) -> ip_flow.IPFlows:
+        """Read database by new connection, which in WAL mode sees only
+        committed transactions.
+        """
+        connection = sqlite3.connect(self._path)
+        try:
+            db = self._read(
+                "SELECT * FROM flows ORDER BY _id", connection=connection)
+        finally:
+            connection.close()
+        return ip_flow.IPFlowsDataFrame(
+            db.drop(columns=["_id"], errors="ignore"))
+
+    def class_counts(self) -> dict:
+        """Count flows of each class using index on class column.
+
+        Returns:
+            dict: Number of flows for each class.
+        """
+        rows = self._connection.execute(
+            "SELECT class, COUNT(*) FROM flows GROUP BY class").fetchall()
+        if self._columns.get("class") == "BOOLEAN":
+            return {bool(label): count for label, count in rows}
+        return dict(rows)
+
+
+class DManagerRingBuffer(DManager):
+    """DManager with fixed capacity stored in preallocated NumPy arrays.
+    Only features from context and class are stored, features as one float
+    matrix. Every class has the same number of slots, split into train and
+    test ring. New flow is routed to train or test ring of its class and
+    when the ring is full, it replaces the oldest or random flow of the
+    ring. Append costs O(new flows) and memory never grows.
+
+    Train rings of all classes are stored first and test rings after them,
+    so once rings are full, train set is a slice of the arrays without any
+    copy. The train set view aliases the buffer and is valid only until the
+    next append, test set is copied by fetch, because it is used for
+    evaluation after new flows are appended.
+    """
+
+    def __init__(self, d_0_path: str, capacity: int, **options) -> None:
+        """Initialize ring buffer. If database file in working directory
+        exists it is loaded, otherwise buffer is filled with D_0.
+
+        Args:
+            d_0_path (str): Path to file with D_0 database (starting set)
+            capacity (int): Max number of flows in database.
+            classes (list): Classes of flows, classes of D_0 by default.
+            test_size (float): Part of slots reserved for test set, 0.3 by
+            default.
+            eviction (str): ``oldest`` or ``random`` flow is replaced
+            when ring is full, ``oldest`` by default.
+            shared_memory (str): See DManagerFile.
+        """
+        self._db_path = self._storage_path(".npz")
+        self._set_shared(**options)
+        self._features = \
+            context_manager.ContextProvider.get_context().get_features()
+        self._eviction = options.get("eviction", "oldest")
+        if self._eviction not in ("oldest", "random"):
+            raise ValueError(f"Unknown eviction: {self._eviction}")
+        self._test_size = options.get("test_size", 0.3)
+        self._rng = np.random.default_rng()
+        self._new_tuple = None
+        self._train_tuple = None
+        self._test_tuple = None
+        db = None
+        classes = options.get("classes")
+        if classes is None:
+            db = pd.read_csv(d_0_path)
+            classes = db["class"].unique()
+        self._classes = np.sort(np.asarray(classes))
+        per_class = capacity // len(self._classes)
+        n_test = int(round(per_class * self._test_size))
+        sizes = [per_class - n_test] * len(self._classes) \
+            + [n_test] * len(self._classes)
+        # rings are [train of class 0, ..., test of class 0, ...]
+        self._ring_start = np.cumsum([0] + sizes[:-1])
+        self._ring_size = np.array(sizes)
+        self._n_train = (per_class - n_test) * len(self._classes)
+        # head (next oldest slot), count of flows and number of seen flows
+        self._rings = np.zeros((len(sizes), 3), dtype=np.int64)
+        self._X = np.zeros((sum(sizes), len(self._features)))
+        self._y = np.repeat(
+            np.concatenate([self._classes, self._classes]), sizes)
+        self._filled = np.zeros(sum(sizes), dtype=bool)
+        try:
+            with np.load(self._db_path) as stored:
+                self._restore(stored)
+        except FileNotFoundError:
+            self._append(pd.read_csv(d_0_path) if db is None else db)
+
+    def _restore(self, stored) -> None:
+        """Load buffer saved by commit. If capacity, test_size or classes
+        changed, stored flows are rewritten to train or test ring of their
+        class in the new layout, oldest first, so they stay in the same set.
+
+        Args:
+            stored (NpzFile): Saved buffer.
+
+        Exception:
+            ValueError: If stored buffer has different features or classes
+            not in the buffer.
+        """
+        if list(stored["features"]) != list(self._features):
+            raise ValueError("Stored ring buffer has different features")
+        classes = list(stored["classes"])
+        positions = {
+            str(label): i for i, label in enumerate(self._classes)}
+        unknown = [label for label in classes if label not in positions]
+        if unknown:
+            raise ValueError(f"Stored ring buffer has unknown class: "
+                             f"{unknown[0]}")
+        sizes = stored["sizes"]
+        if classes == list(positions) \
+                and np.array_equal(sizes, self._ring_size):
+            self._X, self._filled = stored["X"], stored["filled"]
+            self._rings = stored["rings"]
+            return
+        starts = np.cumsum(np.concatenate([[0], sizes[:-1]]))
+        for ring, (start, size) in enumerate(zip(starts, sizes)):
+            head, count, seen = stored["rings"][ring]
+            # train rings of all classes first, test rings after them
+            target = positions[classes[ring % len(classes)]] \
+                + len(self._classes) * (ring // len(classes))
+            order = np.arange(count)
+            if count == size and size > 0:
+                order = (head + order) % size
+            self._write(target, stored["X"][start + order])
+            self._rings[target, 2] += seen - count
+        logging.info("Ring buffer rebuilt for new layout.")
+
+    def _append(self, flows: pd.DataFrame) -> np.ndarray:
+        """Write flows into rings of their classes.
+
+        Returns:
+            np.ndarray: Boolean mask of flows routed to train rings.
+        """
+        labels = flows["class"].to_numpy()
+        unknown = ~np.isin(labels, self._classes)
+        if unknown.any():
+            raise ValueError(f"Unknown class: {labels[unknown][0]}")
+        X = flows[self._features].to_numpy(dtype=float)
+        in_train = np.zeros(len(flows), dtype=bool)
+        for i, label in enumerate(self._classes):
+            rows = np.flatnonzero(labels == label)
+            if len(rows) == 0:
+                continue
+            # train/test routing keeps ratio of test_size for every class
+            seen = self._rings[i, 2] + self._rings[i + len(self._classes), 2]
+            k = seen + np.arange(len(rows))
+            is_test = \
+                np.floor((k + 1) * self._test_size) \
+                > np.floor(k * self._test_size)
+            self._write(i, X[rows[~is_test]])
+            self._write(i + len(self._classes), X[rows[is_test]])
+            in_train[rows[~is_test]] = True
+        return in_train
+
+    def _write(self, ring: int, X: np.ndarray) -> None:
+        """Write rows to ring, evicting flows if ring is full."""
+        start, size = self._ring_start[ring], self._ring_size[ring]
+        head, count, seen = self._rings[ring]
+        self._rings[ring, 2] = seen + len(X)
+        if size == 0 or len(X) == 0:
+            return
+        X = X[-size:]
+        free = size - count
+        slots = np.arange(count, count + min(free, len(X)))
+        if len(X) > free:
+            if self._eviction == "oldest":
+                evicted = (head + np.arange(len(X) - free)) % size
+                self._rings[ring, 0] = (head + len(X) - free) % size
+            else:
+                # only flows stored before, free slots are written above
+                evicted = self._rng.choice(
+                    count, len(X) - free, replace=False)
+            slots = np.concatenate([slots, evicted])
+        self._rings[ring, 1] = min(size, count + len(X))
+        self._X[start + slots] = X
+        self._filled[start + slots] = True
+
+    def _view(
+            self,
+            part: slice,
+            copy: bool = False) -> tuple[pd.DataFrame, pd.Series]:
+        """Flows of part of the buffer. Without copy if it is full and copy
+        is not requested."""
+        X, y, filled = self._X[part], self._y[part], self._filled[part]
+        if not filled.all():
+            X, y = X[filled], y[filled]
+        elif copy:
+            X, y = X.copy(), y.copy()
+        return \
+            pd.DataFrame(X, columns=self._features, copy=False), \
+            pd.Series(y, name="class", copy=False)
+
+    def fetch(self, **options) -> None:
+        """Create train and test set views. Size of test set is given by
+        layout of the buffer, test_size option is ignored.
+        """
+        self._train_tuple = self._view(slice(None, self._n_train))
+        self._test_tuple = self._view(slice(self._n_train, None), copy=True)
+
+    def get_train_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
+        return self._train_tuple
+
+    def get_test_set(self) -> tuple[ip_flow.IPFlows, ip_flow.IPFlows]:
+        return self._test_tuple
+
+    def append_to_db(self, flows: ip_flow.IPFlows) -> None:
+        """Append flows to database. Only features and class are stored.
+
+        Args:
+            flows (ip_flow.IPFlows): Flows to append.
+        """
+        if not pd.Series(flows["class"]).notnull().all():
+            raise ValueError("Flows to append must be all annotated")
+        in_train = self._append(flows)
+        self._new_tuple = (flows.drop(columns=['class']), flows['class'])
+        self._journal_append(*self._new_tuple, in_train)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "new_flows": len(flows),
+            "d_size": int(self._rings[:, 1].sum())
+        })
+
+    def get_last_added(self) -> ip_flow.IPFlows:
+        return self._new_tuple
+
+    def _in_train_set(self, keys: list[np.ndarray]) -> np.ndarray:
+        """Flows routed to train rings, keys are their masks."""
+        return np.concatenate(keys)
+
+    def get_all(self) -> ip_flow.IPFlows:
+        """Get all flows from database, features and class only.
+
+        Returns:
+            ip_flow.IPFlows: List of flows
+        """
+        db = ip_flow.IPFlowsDataFrame(
+            self._X[self._filled], columns=self._features)
+        db["class"] = self._y[self._filled]
+        return db
+
+    def set_all(self, flows: ip_flow.IPFlows) -> None:
+        """Replace all flows in database. If flows do not fit, they are
+        evicted as if they were appended.
+
+        Args:
+            flows (ip_flow.IPFlows): List of flows to set
+        """
+        self._rings[:] = 0
+        self._filled[:] = False
+        self._append(flows)
+        self._journal_reset()
+
+    def commit(self) -> None:
+        """Save buffer to file. Size of the file is given by capacity.
+        """
+        with open(f"{self._db_path}.tmp", "wb") as file:
+            np.savez(
+                file, X=self._X, filled=self._filled, rings=self._rings,
+                sizes=self._ring_size, classes=self._classes.astype(str),
+                features=np.array(self._features, dtype=str))
+        os.replace(f"{self._db_path}.tmp", self._db_path)
+        self._publish()
+
+    def _read_committed(self) -> ip_flow.IPFlows:
+        """Read buffer saved by commit, because buffers are overwritten in
+        place. Current buffer is used if its layout changed since then.
+        """
+        with np.load(self._db_path) as stored:
+            if not np.array_equal(stored["sizes"], self._ring_size) \
+                    or list(stored["classes"]) \
+                    != list(self._classes.astype(str)):
+                return self.get_all()
+            X, filled = stored["X"], stored["filled"]
+        db = ip_flow.IPFlowsDataFrame(X[filled], columns=self._features)
+        db["class"] = self._y[filled]
+        return db
+
+    def set_column(
+            self,
+            column: str,
+            values: np.ndarray,
+            positions: np.ndarray = None) -> None:
+        """Not supported, only features and class are stored.
+
+        Exception:
+            TypeError: Always.
+        """
+        raise TypeError("Ring buffer stores only features and class")
+
+    def class_counts(self) -> dict:
+        """Count flows of each class.
+
+        Returns:
+            dict: Number of flows for each class.
+        """
+        counts = self._rings[:len(self._classes), 1] \
+            + self._rings[len(self._classes):, 1]
+        return {
+            label.item() if hasattr(label, "item") else label: int(count)
+            for label, count in zip(self._classes, counts)}
+
+
+def _read_only(flows: pd.DataFrame) -> ip_flow.IPFlowsDataFrame:
+    """Get frame sharing values of flows, which cannot be modified in
+    place. Columns can still be added or replaced. Columns with extension
+    dtypes are shared as they are.
+    """
+    columns = {}
+    for column in flows.columns:
+        values = flows[column]
+        if isinstance(values.dtype, np.dtype):
+            values = values.to_numpy().view()
+            values.flags.writeable = False
+        columns[column] = values
+    return ip_flow.IPFlowsDataFrame(columns, index=flows.index, copy=False)
+
+
+def _count_values(column: pd.Series) -> dict:
+    """Count values of column, keys are Python scalars."""
+    return {
+        label.item() if hasattr(label, "item") else label: int(count)
+        for label, count in column.value_counts().items()}
+
+
+def _quote(column: str) -> str:
+    """Quote SQLite identifier."""
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _sqlite_value(value):
+    """Convert value to type supported by sqlite3 module. Unsupported
+    objects, like IP addresses, are stored as strings.
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, (str, int, float, bytes)):
+        return value
+    return str(value)
+
+
+def _sqlite_type(column: pd.Series) -> str:
+    """SQLite type of pandas column."""
+    if pd.api.types.is_bool_dtype(column):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(column):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(column):
+        return "REAL"
+    if pd.api.types.infer_dtype(column, skipna=True) == "boolean":
+        return "BOOLEAN"
+    return "TEXT"
+
+
 class DManagerDataFrame(DManagerFile):
     def __init__(self, d_0_path: pd.DataFrame, **options) -> None:
         """Initialize DManagerFile. During initialization, it loads database
@@ -188,6 +1741,7 @@ class DManagerDataFrame(DManagerFile):
         Args:
             d_0_path (DataFrame): DataFrame pandas table (starting set)
         """
+        self._set_options(**options)
         ctx = context_manager.ContextProvider.get_context()
         wd = ctx.get_working_dir()
         exp_id = ctx.get_experiment_id()
@@ -197,7 +1751,7 @@ class DManagerDataFrame(DManagerFile):
             pd.read_csv(self._db_path)
             return
         except FileNotFoundError:
-            db = d_0_path
+            db = self._project(d_0_path)
             db.to_csv(self._db_path, index=False)
         return
         
@@ -214,17 +1768,33 @@ class DbProvider(provider.Provider):
         """Create Di object.
 
         Args:
-            di_database (DManager): Di object
+            context_type (str): Database type. It can be ``file``,
+                ``memory``, ``segmented``, ``sqlite``, ``ring`` (needs
+                ``capacity``) or ``dataframe``.
+            d_0_path: Path to D_0 database or DataFrame for ``dataframe``.
 
         Returns:
             Di: Di object
         """
         if context_type == "file":
-            d_0_path = options.get("d_0_path")
-            DbProvider._db = DManagerFile(d_0_path)
+            d_0_path = options.pop("d_0_path", None)
+            DbProvider._db = DManagerFile(d_0_path, **options)
+        elif context_type == "memory":
+            d_0_path = options.pop("d_0_path", None)
+            DbProvider._db = DManagerMemory(d_0_path, **options)
+        elif context_type == "segmented":
+            d_0_path = options.pop("d_0_path", None)
+            DbProvider._db = DManagerSegmented(d_0_path, **options)
+        elif context_type == "sqlite":
+            d_0_path = options.pop("d_0_path", None)
+            DbProvider._db = DManagerSQLite(d_0_path, **options)
+        elif context_type == "ring":
+            d_0_path = options.pop("d_0_path", None)
+            capacity = options.pop("capacity")
+            DbProvider._db = DManagerRingBuffer(d_0_path, capacity, **options)
         elif context_type == "dataframe":
-            d_0_path = options.get("d_0_path")
-            DbProvider._db = DManagerDataFrame(d_0_path)
+            d_0_path = options.pop("d_0_path", None)
+            DbProvider._db = DManagerDataFrame(d_0_path, **options)
         else:
             raise ValueError("Unknown database type")
 
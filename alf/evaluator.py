@@ -74,9 +74,7 @@ class Evaluator(ABC):
 
         https://github.com/CiscoCTA/nci_eval
         """
-        db_ctx = d_manager.DbProvider.get_context()
-        db = db_ctx.get_all()
-        prevalence = len(db[db["class"] == 1]) / len(db)
+        prevalence = d_manager.DbProvider.get_context().prevalence()
         return \
             (prevalence * self._true_positive_rate(y_true, y_pred)) \
             / (prevalence * self._true_positive_rate(y_true, y_pred)
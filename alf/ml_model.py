@@ -1,21 +1,80 @@
+import json
 import logging
+import os
+import struct
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 
-import joblib
 import numpy as np
+import pandas as pd
+import sklearn.base
 
-from . import context_manager, d_manager, ip_flow
+from . import context_manager, d_manager, ip_flow, model_store, shared_view
 
 
 class MLModel(ABC):
     """Abstract class for machine learning model or models.
     """
-    def __init__(self, ml_model) -> None:
+    def __init__(self, ml_model, **options) -> None:
         """Initialize machine learning model with given model.
 
         Args:
             ml_model (sklearn model): ML model which meets sklearn API
+            shared_memory (str): Name under which every pickled model is
+            published to shared memory for other processes, see
+            shared_view.attach_model. Disabled by default.
+            compile (bool): Predict by CompiledForest, compiled from every
+            trained or loaded model. Model must be tree, forest or soft
+            VotingClassifier of them. Disabled by default.
+            compile_max_batch (int): Larger batches are predicted by
+            sklearn, which has lower cost per sample. Measured for every
+            compiled model by default, see _measure_max_batch.
+            name (str): Name of model, models with different names are
+            pickled to different files, so more models (e.g. in cascade)
+            can be used in one experiment.
+            compress (int | str): Compression of pickled model, see
+            joblib.dump. Disabled by default.
+            keep_versions (int): Number of pickled versions kept for
+            rollback, only the latest one by default.
+            persist_background (bool): Pickle model in background thread,
+            so training does not wait for it. Disabled by default.
+            mmap (bool): Save compiled model next to pickled classifier
+            and memory map it on load, sklearn classifier is unpickled only
+            when needed (e.g. for partial_fit or adding trees, full training
+            fits a new classifier). Loading is fast and processes share one
+            copy of model in page cache. Implies compile option. Disabled by
+            default.
+            prediction_cache (int): Number of feature vectors whose
+            predictions are cached, see PredictionCache. Disabled by
+            default.
         """
+        self._name = options.get("name")
+        # parameters of estimator, trainings fit its unfitted copy
+        self._estimator = None if ml_model is None \
+            else sklearn.base.clone(ml_model)
+        self._lazy = False
+        self._classes = None
+        self._shared = None
+        self._store = model_store.ModelStore(
+            self._path(),
+            compress=options.get("compress", 0),
+            keep=options.get("keep_versions", 0),
+            background=options.get("persist_background", False),
+            on_save=self._on_save)
+        # increased on every training, unchanged model is not pickled
+        self._version = self._store.latest()
+        self._mmap = options.get("mmap", False)
+        self._compile = options.get("compile", False) or self._mmap
+        self._max_batch_option = options.get("compile_max_batch")
+        self._compile_max_batch = self._max_batch_option
+        self._compiled = None
+        self._cache = None
+        if options.get("prediction_cache"):
+            self._cache = PredictionCache(options["prediction_cache"])
+        if options.get("shared_memory") is not None:
+            self._shared = shared_view.SharedPublisher(
+                options["shared_memory"])
         try:
             self.unpickle()
         except (FileNotFoundError, ValueError):
@@ -48,21 +107,154 @@ class MLModel(ABC):
         """Get list of classes.
         """
 
+    @property
+    def _clf(self):
+        """Classifier, unpickled on first use if only compiled model was
+        loaded.
+        """
+        if self._lazy:
+            self._clf = self._store.load()
+        return self._classifier
+
+    @_clf.setter
+    def _clf(self, clf) -> None:
+        self._lazy = False
+        self._classes = None
+        self._classifier = clf
+
     def unpickle(self) -> None:
         """Load classifier from file.
         """
-        ctx = context_manager.ContextProvider.get_context()
-        wd = ctx.get_working_dir()
-        exp_id = ctx.get_experiment_id()
-        self._clf = joblib.load(f"{wd}/classifier.{exp_id}.bin")
+        if self._mmap and self._load_compiled():
+            return
+        self._clf = self._store.load()
+        self._recompile()
 
     def pickle(self) -> None:
-        """Save classifier to file.
+        """Save classifier to file, unless it was not trained since the last
+        save.
+        """
+        # compiled model is saved after classifier, maybe in background
+        self._store.wait()
+        self._recompile()
+        self._store.save(self._clf, self._version)
+
+    def rollback(self, version: int = None) -> None:
+        """Restore older version of classifier, see ModelStore.rollback.
+
+        Args:
+            version (int): Version to restore, the previous one by default.
+        """
+        self._version, self._clf = self._store.rollback(version)
+        self._recompile()
+        with open(self._path(), "rb") as file:
+            self._on_save(file.read(), self._version)
+
+    def _on_save(self, data: bytes, version: int) -> None:
+        """Publish pickled classifier to shared memory and save compiled
+        model if enabled.
         """
+        if self._shared is not None:
+            self._shared.publish_bytes(data, version)
+        if self._mmap and self._compiled is not None:
+            committee = isinstance(self._compiled, list)
+            save_compiled(
+                self._compiled_path(),
+                self._compiled if committee else [self._compiled],
+                self.classes(),
+                committee=committee,
+                source=_file_signature(self._path()),
+                max_batch=self._compile_max_batch)
+
+    def _load_compiled(self) -> bool:
+        """Memory map compiled model, classifier is loaded lazily.
+
+        Returns:
+            bool: False if compiled model is missing or was not saved from
+            the current pickled classifier.
+        """
+        try:
+            header, forests = load_compiled(self._compiled_path())
+            source = _file_signature(self._path())
+        except FileNotFoundError:
+            return False
+        if header["source"] != source:
+            return False
+        self._clf = None
+        self._lazy = True
+        self._classes = np.asarray(header["classes"])
+        self._compiled = forests if header["committee"] else forests[0]
+        if self._max_batch_option is None:
+            self._compile_max_batch = header["max_batch"]
+        return True
+
+    def _compiled_path(self) -> str:
+        """Get path of saved compiled model."""
+        return f"{os.path.splitext(self._path())[0]}.forest"
+
+    def _path(self) -> str:
+        """Get path of pickled classifier in working directory."""
         ctx = context_manager.ContextProvider.get_context()
         wd = ctx.get_working_dir()
         exp_id = ctx.get_experiment_id()
-        joblib.dump(self._clf, f"{wd}/classifier.{exp_id}.bin")
+        name = "" if self._name is None else f".{self._name}"
+        return f"{wd}/classifier.{exp_id}{name}.bin"
+
+    def _recompile(self) -> None:
+        """Compile classifier if compile option is set."""
+        if self._compile:
+            self._compiled = CompiledForest(self._clf)
+            self._measure_max_batch()
+
+    def _measure_max_batch(self, size: int = 256) -> None:
+        """Set compile_max_batch to batch size from which sklearn is faster
+        than compiled model, unless the option is given. Compiled model has
+        lower fixed cost per batch, sklearn lower cost per flow, so both
+        are timed on 1 and size flows and the crossover of the two linear
+        costs is used. It depends on number and depth of trees, e.g. about
+        60 flows for forest of 10 trees and 300 for 100 trees.
+
+        Args:
+            size (int): Size of larger timed batch.
+        """
+        if self._max_batch_option is not None:
+            return
+        forests = self._compiled if isinstance(self._compiled, list) \
+            else [self._compiled]
+        X = _probe_flows(forests, size)
+        timings = []
+        # all flows are predicted by compiled model, then all by sklearn
+        for max_batch in (size, 0):
+            self._compile_max_batch = max_batch
+            timings.append([
+                _best_time(self._predict_proba, X.iloc[:n])
+                for n in (1, size)])
+        (compiled_1, compiled_n), (sklearn_1, sklearn_n) = timings
+        compiled_flow = (compiled_n - compiled_1) / (size - 1)
+        sklearn_flow = (sklearn_n - sklearn_1) / (size - 1)
+        fixed = (sklearn_1 - sklearn_flow) - (compiled_1 - compiled_flow)
+        if compiled_flow <= sklearn_flow:
+            self._compile_max_batch = np.iinfo(np.int64).max
+        else:
+            self._compile_max_batch = \
+                int(max(fixed, 0) / (compiled_flow - sklearn_flow))
+        logging.info(
+            "Compiled model predicts batches up to %d flows.",
+            self._compile_max_batch)
+
+    def _unfitted(self):
+        """Get unfitted copy of estimator given to constructor, or of
+        classifier if there was none.
+        """
+        return sklearn.base.clone(
+            self._clf if self._estimator is None else self._estimator)
+
+    def _use_compiled(self, to_predict: ip_flow.IPFlowsDataFrame) -> bool:
+        """Check if flows are predicted by compiled model. Lazily loaded
+        classifier is not unpickled for large batch, unpickling costs more.
+        """
+        return self._compiled is not None and (
+            self._lazy or len(to_predict) <= self._compile_max_batch)
 
 
 class SupervisedMLModel(MLModel):
@@ -70,6 +262,8 @@ class SupervisedMLModel(MLModel):
     is basically adapter class for sklearn models.
     """
     def classes(self) -> np.ndarray:
+        if self._classes is not None:
+            return self._classes
         return self._clf.classes_
 
     def predict(self, to_predict: ip_flow.IPFlowsDataFrame) -> np.ndarray:
@@ -81,11 +275,38 @@ class SupervisedMLModel(MLModel):
         Returns:
             ndarray: Same as predict_proba, (n_samples, n_classes).
         """
+        return self._predict(to_predict, stream=True)
+
+    def _predict(
+            self,
+            to_predict: ip_flow.IPFlowsDataFrame,
+            stream: bool) -> np.ndarray:
+        """Predict flows, only flows of the stream go through prediction
+        cache. Evaluation (e.g. of test set) neither fills the cache nor
+        changes its hit rate.
+        """
         features = context_manager.ContextProvider.get_context().get_features()
-        return self._clf.predict_proba(to_predict[features])
+        if self._cache is None or not stream:
+            return self._predict_proba(to_predict[features])
+        return self._cache.predict(
+            to_predict[features], self._predict_proba, self._version)
+
+    def _predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        """Predict features of flows by compiled or sklearn model.
+
+        Args:
+            X (pd.DataFrame): Features of flows.
+
+        Returns:
+            ndarray: Output of predict.
+        """
+        if self._use_compiled(X):
+            return self._compiled.predict_proba(X)
+        return self._clf.predict_proba(X)
 
     def predict_hard(self, to_predict: ip_flow.IPFlowsDataFrame):
-        """Predict class based on ML model, using predict function.
+        """Predict class based on ML model, using predict function. Used by
+        evaluation, so prediction cache is not used.
 
         Args:
             to_predict (pd.DataFrame): DataFrame with anotated data to predict.
@@ -94,6 +315,9 @@ class SupervisedMLModel(MLModel):
             ndarray: Same as predict, see sklearn documentation.
         """
         features = context_manager.ContextProvider.get_context().get_features()
+        if self._use_compiled(to_predict):
+            return self.classes()[
+                self._predict(to_predict, stream=False).argmax(axis=1)]
         return self._clf.predict(to_predict[features])
 
     def train(self) -> None:
@@ -102,22 +326,150 @@ class SupervisedMLModel(MLModel):
         logging.info("Train start.")
         features = context_manager.ContextProvider.get_context().get_features()
         X, y = d_manager.DbProvider.get_context().get_train_set()
-        self._clf.fit(X[features], y)
+        # lazily loaded classifier is not unpickled and the one pickled in
+        # background is not modified
+        clf = self._unfitted()
+        clf.fit(X[features], y, **_fit_params(X))
+        self._clf = clf
+        self._version += 1
         logging.info("Train finished.")
         self.pickle()
 
 
 class SupervisedMLModelIncremental(SupervisedMLModel):
     """Allows use "online" training of ML model. Underlaying model needs
-    implement `partial_fit` method.
+    implement `partial_fit` method. Only flows appended to database since
+    the last training which are in train set are passed to `partial_fit`,
+    so cost of training follows number of new flows, not size of database.
+    Model is fitted on the whole train set on the first training, every
+    refit_every trainings and when new flows are not known (e.g. database
+    was replaced or it cannot tell which of them are in train set).
     """
+    def __init__(self, ml_model, refit_every: int = None, **options) -> None:
+        """Initialize incremental model.
+
+        Args:
+            ml_model (sklearn model): ML model with partial_fit method.
+            refit_every (int): Number of incremental trainings between full
+            refits, never by default.
+            **options: See MLModel.
+        """
+        super().__init__(ml_model, **options)
+        self._refit_every = refit_every
+        self._cursor = None
+        self._updates = 0
+
     def train(self) -> None:
-        """Train ML model with trainset database defined in constants.
+        """Update ML model with flows appended since last training or
+        refit it on train set.
         """
         logging.info("Train start.")
         features = context_manager.ContextProvider.get_context().get_features()
-        X, y = d_manager.DbProvider.get_context().get_train_set()
-        self._clf.partial_fit(X[features], y)
+        db = d_manager.DbProvider.get_context()
+        delta = None
+        if self._cursor is not None and (
+                self._refit_every is None
+                or self._updates < self._refit_every):
+            delta = db.get_added_since(self._cursor, train_only=True)
+        self._cursor = db.get_cursor()
+        if delta is None:
+            X, y = db.get_train_set()
+            # fit clone, so the model is replaced only when it is trained
+            clf = self._unfitted()
+            clf.fit(X[features], y, **_fit_params(X))
+            self._clf = clf
+            self._updates = 0
+            self._version += 1
+        else:
+            X, y = delta
+            if len(X) > 0:
+                self._store.wait()
+                self._clf.partial_fit(X[features], y, **_fit_params(X))
+                # unchanged model keeps version, so it is not pickled
+                self._version += 1
+            self._updates += 1
+        context_manager.ContextProvider.get_context().append_metrics({
+            "train_flows": len(X),
+            "train_full": delta is None,
+        })
+        logging.info("Train finished.")
+        self.pickle()
+
+
+class SlidingForestMLModel(SupervisedMLModel):
+    """Random forest which adapts to drift by adding trees instead of
+    refitting. Every training fits n_new_trees trees on flows of train set
+    appended since the last training together with stratified sample of
+    the rest of train set and adds them to the forest, the oldest trees
+    over max_trees are removed. Cost of training does not depend on size of
+    database. Forest is fitted on the whole train set on the first training
+    and when new flows are not known.
+    """
+    def __init__(
+            self,
+            ml_model,
+            n_new_trees: int = 10,
+            max_trees: int = 100,
+            sample_size: int = 1000,
+            **options) -> None:
+        """Initialize sliding forest.
+
+        Args:
+            ml_model (sklearn model): RandomForestClassifier or another
+            forest with ``n_estimators`` parameter and ``estimators_``.
+            n_new_trees (int): Number of trees added by training.
+            max_trees (int): Max number of trees in forest.
+            sample_size (int): Number of flows sampled from train set
+            (evenly from classes) added to new flows.
+            **options: See MLModel.
+        """
+        super().__init__(ml_model, **options)
+        self._n_new_trees = n_new_trees
+        self._max_trees = max_trees
+        self._sample_size = sample_size
+        self._cursor = None
+
+    def train(self) -> None:
+        """Add trees trained on new flows or refit forest on train set.
+        """
+        logging.info("Train start.")
+        features = context_manager.ContextProvider.get_context().get_features()
+        db = d_manager.DbProvider.get_context()
+        delta = None
+        if self._cursor is not None and hasattr(self._clf, "estimators_"):
+            delta = db.get_added_since(self._cursor, train_only=True)
+        self._cursor = db.get_cursor()
+        X, y = db.get_train_set()
+        forest = self._unfitted().set_params(
+            n_estimators=self._n_new_trees)
+        if delta is not None:
+            X_new, y_new = delta
+            sample = _stratified_sample(y, self._sample_size)
+            if len(X_new) > 0:
+                # new flows are in train set too, they are not repeated
+                sample = sample[~np.isin(
+                    _flow_hashes(X.iloc[sample][features], y.iloc[sample]),
+                    _flow_hashes(X_new[features], y_new))]
+            X = pd.concat([X_new, X.iloc[sample]])
+            y = pd.concat([y_new, y.iloc[sample]])
+            forest.fit(X[features], y, **_fit_params(X))
+            if not np.array_equal(forest.classes_, self._clf.classes_):
+                # classes changed, new trees are not compatible
+                delta = None
+                X, y = db.get_train_set()
+        if delta is None:
+            forest.set_params(n_estimators=self._max_trees)
+            forest.fit(X[features], y, **_fit_params(X))
+        else:
+            forest.estimators_ = (
+                self._clf.estimators_ + forest.estimators_)[-self._max_trees:]
+            forest.n_estimators = len(forest.estimators_)
+        self._clf = forest
+        context_manager.ContextProvider.get_context().append_metrics({
+            "train_flows": len(X),
+            "train_full": delta is None,
+        })
+        self._version += 1
         logging.info("Train finished.")
         self.pickle()
 
@@ -136,12 +488,571 @@ class CommitteeMLModel(SupervisedMLModel):
         Returns:
             ndarray: (n_samples, n_models, n_classes)
         """
-        features = context_manager.ContextProvider.get_context().get_features()
+        return super().predict(to_predict)
+
+    def _predict_proba(self, X: pd.DataFrame) -> np.ndarray:
+        """Predict features of flows by every member of committee."""
+        if self._use_compiled(X):
+            return np.array([
+                member.predict_proba(X) for member in self._compiled
+            ]).transpose(1, 0, 2)
         decisions = []
         for member in self._clf.estimators_:
-            decisions.append(
-                member.predict_proba(to_predict[features])
-            )
+            decisions.append(member.predict_proba(X))
         # transpose because it is much useful to iterate over rows than
         # iterate over model decisions
         return np.array(decisions).transpose(1, 0, 2).astype(float)
+
+    def predict_hard(self, to_predict: ip_flow.IPFlowsDataFrame):
+        """Predict class based on ML model, using predict function.
+
+        Args:
+            to_predict (pd.DataFrame): DataFrame with anotated data to predict.
+
+        Returns:
+            ndarray: Same as predict, see sklearn documentation.
+        """
+        features = context_manager.ContextProvider.get_context().get_features()
+        return self._clf.predict(to_predict[features])
+
+    def members(self) -> int:
+        """Get number of members of committee."""
+        if self._compiled is not None:
+            return len(self._compiled)
+        return len(self._clf.estimators_)
+
+    def _recompile(self) -> None:
+        """Compile every member of committee if compile option is set."""
+        if self._compile:
+            self._compiled = [
+                CompiledForest(member) for member in self._clf.estimators_]
+            self._measure_max_batch()
+
+
+class PredictionCache:
+    """LRU cache of predictions keyed by hash of feature vector. Flows with
+    the same features (e.g. repeated connections to popular services) are
+    predicted once, only unique feature vectors not seen before are passed
+    to the model. Cache is cleared when version of model changes, i.e. on
+    every training. Equal 64-bit hashes are considered equal vectors.
+    """
+    def __init__(self, capacity: int) -> None:
+        """Initialize empty cache.
+
+        Args:
+            capacity (int): Maximal number of cached feature vectors.
+        """
+        self._capacity = capacity
+        self._rows = OrderedDict()
+        self._version = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def predict(self, X: pd.DataFrame, predict, version: int) -> np.ndarray:
+        """Get predictions of flows, missing ones are predicted and cached.
+        Hit rate (flows not passed to model / all flows) is appended to
+        metrics.
+
+        Args:
+            X (pd.DataFrame): Features of flows.
+            predict (callable): Predicts DataFrame of features.
+            version (int): Version of model.
+
+        Returns:
+            ndarray: Output of predict for all flows.
+        """
+        if version != self._version:
+            self._rows.clear()
+            self._version = version
+        if len(X) == 0:
+            return predict(X)
+        keys = pd.util.hash_pandas_object(X, index=False).to_numpy()
+        keys, first, inverse = np.unique(
+            keys, return_index=True, return_inverse=True)
+        keys = keys.tolist()
+        rows, missing = [], []
+        for i, key in enumerate(keys):
+            row = self._rows.get(key)
+            if row is None:
+                missing.append(i)
+            else:
+                self._rows.move_to_end(key)
+            rows.append(row)
+        if missing:
+            predicted = predict(X.iloc[first[missing]])
+            for i, row in zip(missing, predicted):
+                # copy, so cached row does not keep the whole batch
+                rows[i] = row.copy()
+                self._rows[keys[i]] = rows[i]
+            while len(self._rows) > self._capacity:
+                self._rows.popitem(last=False)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "prediction_cache_hit_rate": 1 - len(missing) / len(X),
+        })
+        return np.stack(rows)[inverse]
+
+
+class CascadeMLModel(MLModel):
+    """Cascade of cheap and expensive model. Cheap model predicts all
+    flows, only flows whose highest class probability is below threshold
+    are predicted by expensive model (e.g. committee). If expensive model
+    is committee, cheap prediction is repeated for every member, so the
+    output has the same shape as output of the expensive model. Both models
+    must be named (``name`` option), so they are pickled separately.
+    Cascade has no classifier of its own, persistence and versions are
+    delegated to both models.
+    """
+    def __init__(
+            self,
+            cheap: MLModel,
+            expensive: MLModel,
+            threshold: float = 0.9) -> None:
+        """Initialize cascade.
+
+        Args:
+            cheap (MLModel): Fast model predicting all flows.
+            expensive (MLModel): Model predicting uncertain flows.
+            threshold (float): Flows with the highest probability of cheap
+            prediction below threshold are escalated.
+        """
+        self._cheap = cheap
+        self._expensive = expensive
+        self._threshold = threshold
+        # expensive prediction time per flow, for estimate of saved time
+        self._flow_t = None
+
+    def train(self) -> None:
+        """Train both models."""
+        self._cheap.train()
+        self._expensive.train()
+
+    def classes(self) -> np.ndarray:
+        return self._expensive.classes()
+
+    @property
+    def _clf(self):
+        """Classifier of expensive model, which gives classes of cascade."""
+        return self._expensive._clf
+
+    def predict(self, to_predict: ip_flow.IPFlowsDataFrame) -> np.ndarray:
+        """Predict flows by cheap model and uncertain flows by expensive one.
+        Share of escalated flows and estimate of saved time are appended to
+        metrics, so only flows of the stream are predicted by this method,
+        evaluation uses predict_hard.
+
+        Args:
+            to_predict (pd.DataFrame): DataFrame with anotated data to predict.
+
+        Returns:
+            ndarray: (n_samples, n_classes) or (n_samples, n_models,
+            n_classes) if expensive model is committee.
+        """
+        return self._predict(to_predict, stream=True)
+
+    def _predict(
+            self,
+            to_predict: ip_flow.IPFlowsDataFrame,
+            stream: bool) -> np.ndarray:
+        """Predict flows by cascade, metrics are appended only for stream.
+        """
+        if not np.array_equal(self._cheap.classes(), self.classes()):
+            raise ValueError("Models of cascade have different classes")
+        proba = self._cheap._predict(to_predict, stream)
+        escalated = np.flatnonzero(proba.max(axis=1) < self._threshold)
+        if isinstance(self._expensive, CommitteeMLModel):
+            proba = np.repeat(
+                proba[:, np.newaxis, :], self._expensive.members(), axis=1)
+        if len(escalated):
+            start = time.perf_counter()
+            proba[escalated] = self._expensive._predict(
+                to_predict.iloc[escalated], stream)
+            if stream:
+                self._flow_t = \
+                    (time.perf_counter() - start) / len(escalated)
+        if not stream:
+            return proba
+        saved_t = 0.0
+        if self._flow_t is not None:
+            saved_t = self._flow_t * (len(proba) - len(escalated))
+        context_manager.ContextProvider.get_context().append_metrics({
+            "cascade_escalated":
+                len(escalated) / len(proba) if len(proba) else 0.0,
+            "cascade_saved_t": saved_t,
+        })
+        return proba
+
+    def predict_hard(self, to_predict: ip_flow.IPFlowsDataFrame):
+        """Predict class of flows by cascade. Used by evaluation, so metrics
+        of stream are not changed.
+
+        Args:
+            to_predict (pd.DataFrame): DataFrame with anotated data to predict.
+
+        Returns:
+            ndarray: Classes of flows.
+        """
+        proba = self._predict(to_predict, stream=False)
+        if proba.ndim == 3:
+            proba = proba.mean(axis=1)
+        return self.classes()[proba.argmax(axis=1)]
+
+    def pickle(self) -> None:
+        self._cheap.pickle()
+        self._expensive.pickle()
+
+    def rollback(self, version: int = None) -> None:
+        """Restore older version of both models, see MLModel.rollback.
+
+        Args:
+            version (int): Version to restore, the previous one by default.
+        """
+        self._cheap.rollback(version)
+        self._expensive.rollback(version)
+
+    def unpickle(self) -> None:
+        self._cheap.unpickle()
+        self._expensive.unpickle()
+
+
+class CompiledForest:
+    """Tree ensemble compiled into flat NumPy arrays of nodes of all trees
+    (feature, threshold, children and class probabilities in leaves). All
+    trees are evaluated at once by vectorized traversal, one step per tree
+    level for all (tree, sample) pairs, instead of sklearn dispatch per
+    estimator and tree, which dominates latency of small batches. Output
+    matches predict_proba of the source model.
+    """
+    def __init__(self, model, chunk_size: int = 4096) -> None:
+        """Compile decision tree, forest (``estimators_`` of trees) or soft
+        VotingClassifier of them.
+
+        Args:
+            model (sklearn model): Trained model.
+            chunk_size (int): Number of samples traversed at once.
+
+        Exception:
+            TypeError: If model cannot be compiled.
+        """
+        trees = _weighted_trees(model, 1.0)
+        self.classes_ = model.classes_
+        self._chunk_size = chunk_size
+        offsets = np.cumsum([0] + [tree.node_count for tree, _ in trees])
+        self.roots = offsets[:-1].astype(np.int32)
+        features, thresholds, children, missing, leaves, values = \
+            [], [], [], [], [], []
+        for (tree, weight), offset in zip(trees, offsets):
+            leaf = tree.children_left < 0
+            nodes = np.arange(tree.node_count)
+            # sklearn compares float32 features with float64 thresholds,
+            # float32 threshold rounded down gives the same decisions
+            threshold = tree.threshold.astype(np.float32)
+            threshold = np.where(
+                threshold > tree.threshold,
+                np.nextafter(threshold, np.float32(-np.inf)), threshold)
+            # leaves point to themselves, so finished pairs may be advanced
+            features.append(np.where(leaf, 0, tree.feature))
+            thresholds.append(np.where(leaf, np.inf, threshold))
+            children.append(np.stack([
+                np.where(leaf, nodes, tree.children_left),
+                np.where(leaf, nodes, tree.children_right)], axis=1) + offset)
+            missing.append(
+                np.asarray(getattr(
+                    tree, "missing_go_to_left",
+                    np.zeros(tree.node_count)), dtype=bool) & ~leaf)
+            leaves.append(leaf)
+            value = tree.value[:, 0, :]
+            total = value.sum(axis=1, keepdims=True)
+            total[total == 0] = 1
+            values.append(value / total * weight)
+        self.feature = np.concatenate(features).astype(np.int32)
+        self.threshold = np.concatenate(thresholds).astype(np.float32)
+        # children of node i are at 2 * i (left) and 2 * i + 1 (right)
+        self.children = np.concatenate(children).astype(np.int32).ravel()
+        self.missing_go_to_left = np.concatenate(missing)
+        self.leaf = np.concatenate(leaves)
+        self.value = np.concatenate(values)
+
+    @classmethod
+    def from_arrays(
+            cls,
+            classes: np.ndarray,
+            arrays: dict,
+            chunk_size: int = 4096) -> "CompiledForest":
+        """Create compiled forest from arrays of nodes, e.g. memory mapped
+        by load_compiled.
+
+        Args:
+            classes (np.ndarray): Classes of model.
+            arrays (dict): Arrays named as in FOREST_ARRAYS.
+            chunk_size (int): Number of samples traversed at once.
+
+        Returns:
+            CompiledForest: Forest using given arrays without copy.
+        """
+        forest = cls.__new__(cls)
+        forest.classes_ = classes
+        forest._chunk_size = chunk_size
+        for name in FOREST_ARRAYS:
+            setattr(forest, name, arrays[name])
+        return forest
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Predict class probabilities.
+
+        Args:
+            X (array-like): Samples, (n_samples, n_features).
+
+        Returns:
+            np.ndarray: Probabilities, (n_samples, n_classes).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        proba = np.empty((len(X), self.value.shape[1]))
+        for start in range(0, len(X), self._chunk_size):
+            chunk = X[start:start + self._chunk_size]
+            proba[start:start + len(chunk)] = self.value[
+                self._apply(chunk)].sum(axis=0)
+        return proba
+
+    def _apply(self, X: np.ndarray) -> np.ndarray:
+        """Find leaves of all trees for samples.
+
+        Args:
+            X (np.ndarray): Samples, float32 (n_samples, n_features).
+
+        Returns:
+            np.ndarray: Leaves, (n_trees, n_samples).
+        """
+        flat = X.ravel()
+        missing = np.isnan(flat).any()
+        # (tree, sample) pairs ordered by tree, so nodes of one tree are
+        # accessed together, finished pairs are dropped from time to time
+        current = np.repeat(self.roots, len(X))
+        row = np.tile(
+            np.arange(len(X), dtype=np.int32) * X.shape[1], len(self.roots))
+        node = current
+        pair = None
+        while len(current):
+            x = flat[row + self.feature[current]]
+            if missing:
+                right = ~((x <= self.threshold[current]) | (
+                    np.isnan(x) & self.missing_go_to_left[current]))
+            else:
+                right = ~(x <= self.threshold[current])
+            current = self.children[2 * current + right]
+            leaf = self.leaf[current]
+            finished = np.count_nonzero(leaf)
+            if finished == len(current) or finished > len(current) // 4:
+                if pair is None:
+                    node = current.copy()
+                    pair = np.arange(len(current))
+                else:
+                    node[pair] = current
+                inner = ~leaf
+                pair = pair[inner]
+                current = current[inner]
+                row = row[inner]
+        return node.reshape(len(self.roots), len(X))
+
+
+# arrays of CompiledForest stored by save_compiled
+FOREST_ARRAYS = (
+    "roots", "feature", "threshold", "children", "missing_go_to_left",
+    "leaf", "value")
+# alignment of arrays in file of compiled forests
+_ALIGN = 64
+
+
+def save_compiled(
+        path: str,
+        forests: list,
+        classes: np.ndarray,
+        committee: bool = False,
+        source=None,
+        max_batch: int = None) -> None:
+    """Save compiled forests, so they can be memory mapped by load_compiled.
+    File contains length of JSON header, header and arrays of all forests
+    aligned to 64 bytes. File is replaced atomically, processes which mapped
+    the old file keep using it.
+
+    Args:
+        path (str): Path of file.
+        forests (list[CompiledForest]): Forests to save.
+        classes (np.ndarray): Classes of the whole model.
+        committee (bool): Forests are members of committee.
+        source: JSON serializable identification of source classifier.
+        max_batch (int): Largest batch predicted by compiled forests, see
+        MLModel._measure_max_batch.
+    """
+    header = {
+        "classes": classes.tolist(), "committee": committee,
+        "source": source, "max_batch": max_batch, "forests": []}
+    offset = 0
+    for forest in forests:
+        arrays = {}
+        for name in FOREST_ARRAYS:
+            array = getattr(forest, name)
+            arrays[name] = {
+                "dtype": array.dtype.str, "shape": array.shape,
+                "offset": offset}
+            offset += -(-array.nbytes // _ALIGN) * _ALIGN
+        header["forests"].append({
+            "classes": forest.classes_.tolist(),
+            "chunk_size": forest._chunk_size, "arrays": arrays})
+    encoded = json.dumps(header).encode("utf8")
+    start = -(-(8 + len(encoded)) // _ALIGN) * _ALIGN
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(struct.pack("<Q", len(encoded)) + encoded)
+        for forest, description in zip(forests, header["forests"]):
+            for name in FOREST_ARRAYS:
+                file.seek(start + description["arrays"][name]["offset"])
+                file.write(np.ascontiguousarray(getattr(forest, name)).data)
+        file.truncate(start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def load_compiled(path: str) -> tuple:
+    """Memory map forests saved by save_compiled. Arrays are read-only views
+    of file, pages are shared with other processes mapping the same file.
+
+    Args:
+        path (str): Path of file.
+
+    Returns:
+        tuple[dict, list[CompiledForest]]: Header and forests.
+
+    Exception:
+        FileNotFoundError: If file does not exist.
+    """
+    with open(path, "rb") as file:
+        size, = struct.unpack("<Q", file.read(8))
+        header = json.loads(file.read(size))
+    start = -(-(8 + size) // _ALIGN) * _ALIGN
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    forests = []
+    for description in header["forests"]:
+        arrays = {
+            name: np.ndarray(
+                tuple(array["shape"]), dtype=np.dtype(array["dtype"]),
+                buffer=buffer, offset=start + array["offset"])
+            for name, array in description["arrays"].items()}
+        forests.append(CompiledForest.from_arrays(
+            np.asarray(description["classes"]), arrays,
+            description["chunk_size"]))
+    return header, forests
+
+
+def _file_signature(path: str) -> list:
+    """Identify version of file by inode, size and modification time."""
+    stat = os.stat(path)
+    return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+
+def _probe_flows(forests: list, size: int) -> pd.DataFrame:
+    """Synthetic flows for timing of prediction. Every feature lies between
+    two random split thresholds of the feature, so flows reach leaves of
+    typical depth.
+
+    Args:
+        forests (list[CompiledForest]): Compiled model.
+        size (int): Number of flows.
+
+    Returns:
+        pd.DataFrame: Flows with features from context.
+    """
+    features = context_manager.ContextProvider.get_context().get_features()
+    rng = np.random.default_rng(0)
+    feature = np.concatenate([
+        forest.feature[~forest.leaf] for forest in forests])
+    threshold = np.concatenate([
+        forest.threshold[~forest.leaf] for forest in forests])
+    X = np.zeros((size, len(features)))
+    for column in range(len(features)):
+        thresholds = threshold[feature == column]
+        if len(thresholds):
+            low, high = rng.choice(thresholds, (2, size))
+            X[:, column] = low + (high - low) * rng.random(size)
+    return pd.DataFrame(X, columns=features)
+
+
+def _best_time(func, *args, repeat: int = 3) -> float:
+    """Shortest time of repeated call of function in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _weighted_trees(model, weight: float) -> list:
+    """Collect (tree structure, weight) pairs of model, weights of trees sum
+    to weight.
+    """
+    if hasattr(model, "tree_"):
+        return [(model.tree_, weight)]
+    if hasattr(model, "voting"):
+        if model.voting != "soft":
+            raise TypeError("Only soft VotingClassifier can be compiled")
+        weights = np.ones(len(model.estimators_)) if model.weights is None \
+            else np.asarray(model.weights, dtype=float)
+        weights = weights / weights.sum() * weight
+        return [
+            tree for member, member_weight in zip(model.estimators_, weights)
+            for tree in _weighted_trees(member, member_weight)]
+    if hasattr(model, "estimators_"):
+        member_weight = weight / len(model.estimators_)
+        return [
+            tree for member in model.estimators_
+            for tree in _weighted_trees(member, member_weight)]
+    raise TypeError(f"Cannot compile {type(model).__name__}")
+
+
+def _fit_params(X: ip_flow.IPFlowsDataFrame) -> dict:
+    """Get sample weights for fit from "weight" (number of duplicates) and
+    "decay" (age of flow) columns of train set.
+
+    Args:
+        X (pd.DataFrame): Train set.
+
+    Returns:
+        dict: ``sample_weight`` if train set has weights, empty otherwise.
+    """
+    columns = [column for column in ("weight", "decay") if column in X]
+    if not columns:
+        return {}
+    weights = X[columns].fillna(1.0).to_numpy(dtype=float).prod(axis=1)
+    return {"sample_weight": weights}
+
+
+def _flow_hashes(X: pd.DataFrame, y: pd.Series) -> np.ndarray:
+    """Hash features (as floats) and class of flows."""
+    rows = X.astype(float)
+    rows["class"] = y.to_numpy()
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+
+def _stratified_sample(y: pd.Series, size: int) -> np.ndarray:
+    """Sample positions of at most size flows evenly from classes.
+
+    Args:
+        y (pd.Series): Classes of flows.
+        size (int): Number of sampled flows.
+
+    Returns:
+        np.ndarray: Positions of sampled flows.
+    """
+    labels = y.to_numpy()
+    classes = np.unique(labels)
+    if len(classes) == 0:
+        return np.array([], dtype=int)
+    per_class = max(size // len(classes), 1)
+    sample = []
+    for label in classes:
+        positions = np.flatnonzero(labels == label)
+        sample.append(np.random.choice(
+            positions, min(per_class, len(positions)), replace=False))
+    return np.concatenate(sample)
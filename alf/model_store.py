@@ -0,0 +1,189 @@
+"""Persistence of trained models. Models are serialized to temporary file
+which replaces the model file atomically, so crash during write never
+leaves corrupted model. Serialization can run in background thread and
+older versions can be kept for rollback.
+
+Kept versions are stored as ``<path>.v<version>`` and ``<path>`` is hard
+link of the latest one, so the model file is written only once.
+"""
+import glob
+import io
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+
+
+class ModelStore:
+    """Versioned storage of one model file.
+    """
+    def __init__(
+            self,
+            path: str,
+            compress=0,
+            keep: int = 0,
+            background: bool = False,
+            on_save=None) -> None:
+        """Initialize storage, versions already stored are kept.
+
+        Args:
+            path (str): Path of model file.
+            compress (int | str | tuple): Compression passed to joblib.dump,
+            disabled by default.
+            keep (int): Number of kept versions for rollback, only the
+            latest model is stored by default.
+            background (bool): Serialize models in background thread.
+            on_save (callable): Called with serialized model and version
+            after the model is stored, e.g. to publish it.
+        """
+        self._path = path
+        self._compress = compress
+        self._keep = keep
+        self._on_save = on_save
+        self._executor = ThreadPoolExecutor(max_workers=1) \
+            if background else None
+        self._pending = None
+        self._saved = self.latest()
+
+    def latest(self) -> int:
+        """Get the latest stored version.
+
+        Returns:
+            int: Version, 0 if no version is kept.
+        """
+        versions = self.versions()
+        return versions[-1] if versions else 0
+
+    def versions(self) -> list:
+        """Get kept versions in ascending order.
+
+        Returns:
+            list[int]: Kept versions.
+        """
+        pattern = re.compile(re.escape(self._path) + r"\.v(\d+)$")
+        versions = []
+        for path in glob.glob(glob.escape(self._path) + ".v*"):
+            match = pattern.match(path)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def save(self, model, version: int) -> bool:
+        """Store model unless the version is already stored. In background
+        mode, previous serialization is finished first and the model must
+        not be modified until wait is called.
+
+        Args:
+            model (sklearn model): Model to store.
+            version (int): Version of model, increased on every change.
+
+        Returns:
+            bool: False if the version was already stored.
+        """
+        if version == self._saved:
+            return False
+        self.wait()
+        self._saved = version
+        if self._executor is None:
+            self._save(model, version)
+        else:
+            self._pending = self._executor.submit(self._save, model, version)
+        return True
+
+    def wait(self) -> None:
+        """Wait for serialization running in background.
+
+        Exception:
+            Exception: Error raised during serialization.
+        """
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            pending.result()
+
+    def load(self, mmap_mode: str = None):
+        """Load the latest model.
+
+        Args:
+            mmap_mode (str): Memory map arrays of model, see joblib.load.
+
+        Returns:
+            sklearn model: Stored model.
+
+        Exception:
+            FileNotFoundError: If no model is stored.
+        """
+        self.wait()
+        return joblib.load(self._path, mmap_mode=mmap_mode)
+
+    def rollback(self, version: int = None):
+        """Make older kept version the latest one, newer versions are
+        removed.
+
+        Args:
+            version (int): Version to restore, the previous one by default.
+
+        Returns:
+            tuple[int, sklearn model]: Restored version and model.
+
+        Exception:
+            ValueError: If the version is not kept.
+        """
+        self.wait()
+        versions = self.versions()
+        if version is None:
+            if len(versions) < 2:
+                raise ValueError("No previous version to roll back to")
+            version = versions[-2]
+        if version not in versions:
+            raise ValueError(f"Version {version} is not kept")
+        self._link(self._version_path(version))
+        for newer in versions:
+            if newer > version:
+                os.remove(self._version_path(newer))
+        self._saved = version
+        return version, self.load()
+
+    def close(self) -> None:
+        """Finish background serialization and stop the thread."""
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _save(self, model, version: int) -> None:
+        """Serialize model and replace stored files."""
+        buffer = io.BytesIO()
+        joblib.dump(model, buffer, compress=self._compress)
+        data = buffer.getbuffer()
+        if self._keep > 0:
+            path = self._version_path(version)
+            self._write(path, data)
+            self._link(path)
+            for old in self.versions()[:-self._keep]:
+                os.remove(self._version_path(old))
+        else:
+            self._write(self._path, data)
+        logging.info(f"Model version {version} stored.")
+        if self._on_save is not None:
+            self._on_save(data, version)
+
+    def _write(self, path: str, data) -> None:
+        """Write data to temporary file and rename it to path."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, path)
+
+    def _link(self, path: str) -> None:
+        """Atomically make model file hard link of path."""
+        tmp = f"{self._path}.tmp"
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.link(path, tmp)
+        os.replace(tmp, self._path)
+
+    def _version_path(self, version: int) -> str:
+        return f"{self._path}.v{version}"
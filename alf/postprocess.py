@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
 import logging
+
+import numpy as np
 from imblearn.under_sampling import RandomUnderSampler
 
+from . import anotator
 from . import d_manager
 from . import context_manager
 
@@ -44,6 +47,13 @@ class PostprocessorUndersample(Postprocessor):
         """
         logging.info("Doing undersampling.")
         ctx = d_manager.DbProvider.get_context()
+        counts = ctx.class_counts()
+        if len(set(counts.values())) <= 1 \
+                and sum(counts.values()) <= self._maxsize:
+            # already balanced and small enough
+            self._commit()
+            logging.info("Finish undersampling.")
+            return
         flows = ctx.get_all()
         X = flows.drop(columns=['class'])
         y = flows['class']
@@ -59,6 +69,307 @@ class PostprocessorUndersample(Postprocessor):
         logging.info("Finish undersampling.")
 
 
+class PostprocessorReservoir(Postprocessor):
+    """Keeps database class-balanced and bounded by per-class reservoir
+    sampling of appended flows. Every class has reservoir of
+    maxsize / number of classes flows. New flow of class seen n times
+    replaces random flow of the reservoir with probability
+    capacity / n, so the reservoir is uniform sample of all flows of the
+    class. Old flows are only evicted, database is never resampled.
+    """
+    def __init__(self, maxsize: int) -> None:
+        """Initialize reservoir postprocessor with max size of db.
+
+        Args:
+            maxsize (int): Maximum number of flows in database.
+        """
+        super().__init__()
+        self._maxsize = maxsize
+        self._seen = None
+        self._size = 0
+
+    def postprocess(self) -> None:
+        """Evict flows to keep reservoirs of all classes within capacity.
+        """
+        ctx = d_manager.DbProvider.get_context()
+        counts = ctx.class_counts()
+        size = sum(counts.values())
+        if self._seen is None:
+            # flows stored before the first generation count as seen
+            self._seen = counts.copy()
+            self._size = size
+        # flows are appended to the end of database
+        new = min(max(size - self._size, 0), size)
+        capacity = self._maxsize // max(len(counts), 1)
+        labels = ctx.get_all()["class"].to_numpy()
+        evicted = []
+        for label, count in counts.items():
+            if count <= capacity:
+                self._seen[label] = self._seen.get(label, 0) + int(
+                    np.count_nonzero(labels[size - new:] == label))
+                continue
+            positions = np.flatnonzero(labels == label)
+            old = positions[positions < size - new]
+            members = list(old)
+            if len(members) > capacity:
+                # capacity decreased or database was too big at start
+                excess = np.random.choice(
+                    len(members), len(members) - capacity, replace=False)
+                evicted.extend(old[excess])
+                members = list(np.delete(old, excess))
+            seen = self._seen.get(label, 0)
+            for position in positions[positions >= size - new]:
+                seen += 1
+                if len(members) < capacity:
+                    members.append(position)
+                    continue
+                slot = np.random.randint(seen)
+                if slot < capacity:
+                    evicted.append(members[slot])
+                    members[slot] = position
+                else:
+                    evicted.append(position)
+            self._seen[label] = seen
+        if evicted:
+            ctx.evict(np.array(evicted, dtype=int))
+        self._size = size - len(evicted)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "reservoir_evicted": len(evicted),
+        })
+        self._commit()
+
+
+class PostprocessorRetention(Postprocessor):
+    """Keeps only flows from last window generations. Every flow gets
+    "generation" column with number of generation in which it was stored
+    (flows of D_0 get the first one). Flows older than window are evicted.
+    With half_life, "decay" column with weight halving every half_life
+    generations is set and models use it as sample weight in training.
+    """
+    def __init__(self, window: int, half_life: float = None) -> None:
+        """Initialize retention postprocessor. Its columns are registered
+        in database, so it must be created first and columns of stored flows
+        are kept by schema projection on load.
+
+        Args:
+            window (int): Number of generations flows are kept.
+            half_life (float): Number of generations after which flow weight
+            is halved, no decay by default.
+        """
+        super().__init__()
+        self._window = window
+        self._half_life = half_life
+        self._generation = None
+        db = d_manager.DbProvider.get_context()
+        db.register_column("generation")
+        if half_life is not None:
+            db.register_column("decay")
+
+    def postprocess(self) -> None:
+        """Stamp new flows by generation, evict old flows and update decay.
+        """
+        ctx = d_manager.DbProvider.get_context()
+        flows = ctx.get_all()
+        if "generation" in flows.columns:
+            generations = flows["generation"].to_numpy(dtype=float, copy=True)
+        else:
+            generations = np.full(len(flows), np.nan)
+        if self._generation is None:
+            # continue numbering of stored database
+            stamped = generations[~np.isnan(generations)]
+            self._generation = int(stamped.max()) + 1 if len(stamped) else 0
+        new = np.flatnonzero(np.isnan(generations))
+        if len(new):
+            ctx.set_column("generation", float(self._generation), new)
+            generations[new] = self._generation
+        age = self._generation - generations
+        expired = np.flatnonzero(age >= self._window)
+        if len(expired):
+            ctx.evict(expired)
+            age = np.delete(age, expired)
+        if self._half_life is not None:
+            ctx.set_column("decay", 0.5 ** (age / self._half_life))
+        context_manager.ContextProvider.get_context().append_metrics({
+            "retention_evicted": len(expired),
+        })
+        self._generation += 1
+        self._commit()
+
+
+class PostprocessorCondense(Postprocessor):
+    """Condenses database to maxsize flows by greedy k-center selection per
+    class on standardized features from context. The first center of a
+    class is its flow nearest to mean of other classes, every next one is
+    the flow farthest from already selected centers. Selected flows cover
+    feature space of the class including the decision boundary, unlike
+    random undersampling. Size is split among classes evenly, smaller
+    classes are kept whole.
+
+    Selection is warm started from centers kept by the previous run. Their
+    radii (squared distance to earlier centers when they were selected) are
+    stored in "condense_radius" column, so only distances between new flows
+    and kept centers are computed, O(new flows * maxsize) instead of
+    O(maxsize^2) for selection from scratch. Ring buffer does not store
+    radii, so every run there starts from scratch.
+    """
+    def __init__(self, maxsize: int) -> None:
+        """Initialize condensing postprocessor with max size of db. Its
+        column is registered in database, so it must be created after the
+        database.
+
+        Args:
+            maxsize (int): Maximum number of flows in database.
+        """
+        super().__init__()
+        self._maxsize = maxsize
+        d_manager.DbProvider.get_context().register_column("condense_radius")
+
+    def postprocess(self) -> None:
+        """Evict flows not selected as centers if database is too big.
+        """
+        ctx = d_manager.DbProvider.get_context()
+        counts = ctx.class_counts()
+        if sum(counts.values()) > self._maxsize:
+            flows = ctx.get_all()
+            features = \
+                context_manager.ContextProvider.get_context().get_features()
+            X = flows[features].to_numpy(dtype=float)
+            X = np.nan_to_num(X)
+            std = X.std(axis=0)
+            std[std == 0] = 1
+            X = (X - X.mean(axis=0)) / std
+            labels = flows["class"].to_numpy()
+            # flows appended since the last run have no radius
+            if "condense_radius" in flows.columns:
+                stored = flows["condense_radius"].to_numpy(
+                    dtype=float, copy=True)
+            else:
+                stored = np.full(len(flows), np.nan)
+            radii = np.full(len(flows), np.nan)
+            keep = np.zeros(len(flows), dtype=bool)
+            remaining = self._maxsize
+            by_size = sorted(counts, key=counts.get)
+            for i, label in enumerate(by_size):
+                quota = min(counts[label], remaining // (len(by_size) - i))
+                remaining -= quota
+                positions = np.flatnonzero(labels == label)
+                others = X[labels != label]
+                selected, selected_radii = _k_center(
+                    X[positions],
+                    others.mean(axis=0) if len(others) else None,
+                    quota, stored[positions])
+                keep[positions[selected]] = True
+                radii[positions[selected]] = selected_radii
+            ctx.evict(np.flatnonzero(~keep))
+            try:
+                ctx.set_column("condense_radius", radii[keep])
+            except TypeError:
+                # ring buffer stores only features and class
+                pass
+            context_manager.ContextProvider.get_context().append_metrics({
+                "condense_evicted": int(np.count_nonzero(~keep)),
+            })
+        self._commit()
+
+
+def _k_center(
+        X: np.ndarray,
+        start: np.ndarray,
+        k: int,
+        radii: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    """Greedy k-center (farthest point) selection. Distances are computed
+    as |x|^2 - 2 x.c + |c|^2, so no (n, features) temporary is created
+    per center.
+
+    Points with radius are centers selected before. They are taken in
+    order of their radii, interleaved with new points farther from all of
+    them, so distances are computed only for new points.
+
+    Args:
+        X (np.ndarray): Points, shape (n, features).
+        start (np.ndarray): First center is point nearest to start, the
+        first point if None. Not used if there are centers selected before.
+        k (int): Number of centers.
+        radii (np.ndarray, optional): Squared distance of centers selected
+        before to earlier centers, NaN for new points. All points are new
+        by default.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Positions of selected points and
+        their radii (NaN for points kept without selection).
+    """
+    if radii is None:
+        radii = np.full(len(X), np.nan)
+    if k >= len(X):
+        return np.arange(len(X)), radii
+    norms = np.einsum("ij,ij->i", X, X)
+    old = np.flatnonzero(~np.isnan(radii))
+    if len(old):
+        return _k_center_warm(X, norms, k, old, radii[old])
+    if start is None:
+        center = 0
+    else:
+        center = int(np.argmin(norms - 2 * X @ start))
+    selected = np.empty(k, dtype=int)
+    selected_radii = np.empty(k)
+    distances = np.full(len(X), np.inf)
+    for i in range(k):
+        selected[i] = center
+        selected_radii[i] = distances[center]
+        np.minimum(
+            distances, norms - 2 * X @ X[center] + norms[center],
+            out=distances)
+        distances[center] = -1
+        center = int(np.argmax(distances))
+    return selected, selected_radii
+
+
+def _k_center_warm(
+        X: np.ndarray,
+        norms: np.ndarray,
+        k: int,
+        old: np.ndarray,
+        old_radii: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Greedy k-center selection continuing from centers selected before,
+    see _k_center. Centers selected before keep their radii.
+    """
+    order = np.argsort(-old_radii, kind="stable")
+    old, old_radii = old[order], old_radii[order]
+    order_radii = -old_radii
+    new = np.setdiff1d(np.arange(len(X)), old, assume_unique=True)
+    # squared distance of new points to nearest center selected before
+    distances = np.empty(len(new))
+    chunk = max(1, 2 ** 20 // len(old))
+    for i in range(0, len(new), chunk):
+        part = new[i:i + chunk]
+        distances[i:i + chunk] = (
+            norms[part, None] - 2 * X[part] @ X[old].T + norms[old]
+        ).min(axis=1)
+    X_new, norms_new = X[new], norms[new]
+    selected, selected_radii = [], []
+    taken = 0
+    while len(selected) < k:
+        best = int(np.argmax(distances)) if len(new) else 0
+        threshold = distances[best] if len(new) else -np.inf
+        # centers selected before which are farther than best new point
+        count = min(
+            np.searchsorted(order_radii, -threshold, side="right") - taken,
+            k - len(selected))
+        selected.extend(old[taken:taken + count])
+        selected_radii.extend(old_radii[taken:taken + count])
+        taken += count
+        if len(selected) == k:
+            break
+        center = new[best]
+        selected.append(center)
+        selected_radii.append(threshold)
+        np.minimum(
+            distances, norms_new - 2 * X_new @ X[center] + norms[center],
+            out=distances)
+        distances[best] = -np.inf
+    return np.array(selected, dtype=int), np.array(selected_radii)
+
+
 class PostprocessorHumanAnotate(Postprocessor):
     """Human anotator.
     """
@@ -68,7 +379,44 @@ class PostprocessorHumanAnotate(Postprocessor):
         """
         ctx = d_manager.DbProvider.get_context()
         flows = ctx.get_all()
-        flows["history"] = flows["class"]
-        flows["class"] = flows["human"]
-        ctx.set_all(flows)
+        ctx.set_all(flows.assign(history=flows["class"], **{
+            "class": flows["human"]}))
         self._commit()
+
+
+class PostprocessorAnnotationQueue(Postprocessor):
+    """Merge flows labeled in anotation queue since last generation into
+    database, then run given postprocessor. Used together with
+    anotator.AnotatorHumanQueue, so the stream is not blocked by analyst.
+    """
+    def __init__(
+            self,
+            queue: anotator.AnnotationQueue,
+            postprocessor: Postprocessor = None) -> None:
+        """Initialize postprocessor.
+
+        Args:
+            queue (anotator.AnnotationQueue): Anotation queue.
+            postprocessor (Postprocessor): Postprocessor run after merge,
+            PostprocessorIdentity by default.
+        """
+        super().__init__()
+        self._queue = queue
+        self._postprocessor = postprocessor or PostprocessorIdentity()
+
+    def postprocess(self) -> None:
+        """Merge resolved labels into database.
+        """
+        ids, flows, latency = self._queue.get_resolved()
+        if len(flows) > 0:
+            d_manager.DbProvider.get_context().append_to_db(flows)
+        context_manager.ContextProvider.get_context().append_metrics({
+            "annotation_pending": self._queue.pending(),
+            "annotation_merged": len(flows),
+            "annotation_latency_mean":
+                float(latency.mean()) if len(latency) > 0 else None,
+            "annotation_latency_max":
+                float(latency.max()) if len(latency) > 0 else None
+        })
+        self._postprocessor.postprocess()
+        self._queue.mark_merged(ids)
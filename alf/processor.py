@@ -1,5 +1,7 @@
 import datetime
 
+import numpy as np
+
 from . import ip_flow
 from . import ml_model
 from . import query_strategy
@@ -53,6 +55,8 @@ class Processor:
         t2 = datetime.datetime.now()
         query_t_d = t2 - t1
 
+        # flows anotated asynchronously have no label yet
+        mask_anotated = self._labeled_mask(anotated, mask_anotated)
         d_manager.DbProvider.get_context().append_to_db(
             anotated.iloc[mask_anotated]
         )
@@ -71,3 +75,14 @@ class Processor:
             "evaluation_t": evaluation_t_d.total_seconds(),
             "train_t": train_t_d.total_seconds()
         })
+
+    def _labeled_mask(
+            self,
+            anotated: ip_flow.IPFlows,
+            mask_anotated: np.ndarray) -> np.ndarray:
+        """Convert mask or indices of anotated flows to boolean mask of
+        flows which have their label already.
+        """
+        mask = np.zeros(len(anotated), dtype=bool)
+        mask[mask_anotated] = True
+        return mask & anotated["class"].notnull().to_numpy()
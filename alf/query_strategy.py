@@ -60,7 +60,8 @@ class QueryStrategy(ABC):
             ip_flow.IPFlows: Anotated IP flows.
         """
         if self._dry_run:
-            return self._oraculum.anotate(flows), selected
+            flows["class"] = self._oraculum.anotate(flows)["class"]
+            return flows, selected
         flows["class"] = None
         anotated = self._oraculum.anotate(
             flows.iloc[selected])
@@ -0,0 +1,249 @@
+"""Publication of database and model to named shared memory, so other local
+processes (GUI, evaluators, prediction workers) can read them without
+reloading and parsing files.
+
+Every publication has header segment with given name and data segments
+named ``<name>.<version>``. Header contains sequence number (odd while
+header is written) and JSON description of the current data segment. Data
+segment of the previous version is kept, so reader which read header just
+before new publication can still attach it.
+"""
+import io
+import json
+import os
+import struct
+import sys
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import joblib
+import numpy as np
+import pandas as pd
+
+HEADER_SIZE = 65536
+_HEADER = struct.Struct("<QQ")
+# segments created by this process, stay registered in resource tracker
+_created = set()
+
+
+class SharedPublisher:
+    """Writer side of shared memory publication. Segments exist until
+    close is called.
+    """
+    def __init__(self, name: str) -> None:
+        """Create header segment, stale segment of the same name is
+        replaced.
+
+        Args:
+            name (str): Name of publication.
+        """
+        self._name = name
+        try:
+            self._header = shared_memory.SharedMemory(
+                name, create=True, size=HEADER_SIZE)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._header = shared_memory.SharedMemory(
+                name, create=True, size=HEADER_SIZE)
+        _created.add(name)
+        self._header.buf[:_HEADER.size] = _HEADER.pack(0, 0)
+        self._sequence = 0
+        self._version = 0
+        self._segments = []
+
+    def publish_frame(self, flows: pd.DataFrame, version: int = None) -> None:
+        """Publish numeric and boolean columns of flows as one float64
+        matrix stored by columns.
+
+        Args:
+            flows (pd.DataFrame): Flows to publish.
+            version (int): Version of publication, previous one + 1 by
+            default.
+        """
+        columns = [
+            column for column in flows.columns
+            if pd.api.types.is_numeric_dtype(flows[column])]
+        shape = (len(flows), len(columns))
+        segment = self._create(max(shape[0] * shape[1] * 8, 1), version)
+        matrix = np.ndarray(
+            shape, dtype=np.float64, buffer=segment.buf, order="F")
+        for i, column in enumerate(columns):
+            matrix[:, i] = flows[column].to_numpy(dtype=np.float64)
+        del matrix
+        self._write_header({
+            "kind": "frame", "segment": segment.name,
+            "columns": [str(column) for column in columns],
+            "rows": shape[0]})
+
+    def publish_bytes(self, data: bytes, version: int = None) -> None:
+        """Publish bytes, e.g. serialized model.
+
+        Args:
+            data (bytes): Data to publish.
+            version (int): Version of publication, previous one + 1 by
+            default.
+        """
+        segment = self._create(max(len(data), 1), version)
+        segment.buf[:len(data)] = data
+        self._write_header({
+            "kind": "bytes", "segment": segment.name, "size": len(data)})
+
+    def close(self) -> None:
+        """Remove all segments of publication."""
+        for segment in self._segments + [self._header]:
+            segment.close()
+            segment.unlink()
+            _created.discard(segment.name)
+        self._segments = []
+
+    def _create(
+            self,
+            size: int,
+            version: int = None) -> shared_memory.SharedMemory:
+        """Create data segment for new version, segments older than
+        previous version are removed.
+        """
+        self._version = self._version + 1 if version is None else version
+        segment = shared_memory.SharedMemory(
+            f"{self._name}.{self._version}", create=True, size=size)
+        _created.add(segment.name)
+        self._segments.append(segment)
+        while len(self._segments) > 2:
+            obsolete = self._segments.pop(0)
+            obsolete.close()
+            obsolete.unlink()
+            _created.discard(obsolete.name)
+        return segment
+
+    def _write_header(self, description: dict) -> None:
+        """Write description of current version to header segment."""
+        description["version"] = self._version
+        encoded = json.dumps(description).encode("utf8")
+        if _HEADER.size + len(encoded) > HEADER_SIZE:
+            raise ValueError("Description does not fit into header")
+        buffer = self._header.buf
+        self._sequence += 1
+        buffer[:8] = struct.pack("<Q", self._sequence)
+        buffer[_HEADER.size:_HEADER.size + len(encoded)] = encoded
+        buffer[8:16] = struct.pack("<Q", len(encoded))
+        self._sequence += 1
+        buffer[:8] = struct.pack("<Q", self._sequence)
+
+
+class SharedView:
+    """Reader side of one version of publication. Frame or data are views
+    of shared memory valid until close is called.
+    """
+    def __init__(
+            self,
+            version: int,
+            segment: shared_memory.SharedMemory,
+            description: dict) -> None:
+        self.version = version
+        self._segment = segment
+        self._description = description
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Published flows, columns share memory with publisher."""
+        if self._description["kind"] != "frame":
+            raise ValueError("Publication is not a frame")
+        columns = self._description["columns"]
+        matrix = np.ndarray(
+            (self._description["rows"], len(columns)), dtype=np.float64,
+            buffer=self._segment.buf, order="F")
+        matrix.flags.writeable = False
+        return pd.DataFrame(matrix, columns=columns, copy=False)
+
+    @property
+    def data(self) -> memoryview:
+        """Published bytes."""
+        if self._description["kind"] != "bytes":
+            raise ValueError("Publication is not bytes")
+        return self._segment.buf[:self._description["size"]].toreadonly()
+
+    def close(self) -> None:
+        """Detach from shared memory. Frames and data must be released
+        before.
+        """
+        self._segment.close()
+
+
+def attach(name: str, retries: int = 100) -> SharedView:
+    """Attach the current version of publication.
+
+    Args:
+        name (str): Name of publication.
+        retries (int): Number of attempts if publication changes while
+        attaching.
+
+    Returns:
+        SharedView: View of the current version.
+
+    Exception:
+        FileNotFoundError: If nothing is published under the name.
+        TimeoutError: If consistent version was not attached.
+    """
+    header = _open(name)
+    try:
+        for _ in range(retries):
+            sequence, size = _HEADER.unpack(
+                bytes(header.buf[:_HEADER.size]))
+            if sequence == 0 or sequence % 2 == 1:
+                continue
+            encoded = bytes(header.buf[_HEADER.size:_HEADER.size + size])
+            if _HEADER.unpack(bytes(header.buf[:_HEADER.size]))[0] \
+                    != sequence:
+                continue
+            description = json.loads(encoded)
+            try:
+                segment = _open(description["segment"])
+            except FileNotFoundError:
+                continue
+            return SharedView(description["version"], segment, description)
+    finally:
+        header.close()
+    raise TimeoutError(f"Cannot attach consistent version of {name}")
+
+
+def attach_frame(name: str) -> SharedView:
+    """Attach published flows, see attach.
+
+    Args:
+        name (str): Name of publication.
+
+    Returns:
+        SharedView: View with ``frame``.
+    """
+    return attach(name)
+
+
+def attach_model(name: str):
+    """Load model published by MLModel with ``shared_memory`` option.
+
+    Args:
+        name (str): Name of publication.
+
+    Returns:
+        tuple[int, sklearn model]: Version and classifier.
+    """
+    view = attach(name)
+    try:
+        return view.version, joblib.load(io.BytesIO(view.data))
+    finally:
+        view.close()
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    """Attach existing segment. Reader must not remove the segment on exit,
+    so it is not tracked by resource tracker.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=name in _created)
+    segment = shared_memory.SharedMemory(name)
+    if name not in _created and os.name == "posix":
+        # tracker registers POSIX names with leading slash
+        resource_tracker.unregister(f"/{segment.name}", "shared_memory")
+    return segment
@@ -72,6 +72,9 @@ parser.add_argument(
 parser.add_argument(
     "--blacklist",
     type=str, help="Blacklist of DOH servers file", required=True)
+parser.add_argument(
+    "--blacklist_reload",
+    type=float, help="Blacklist check interval in seconds", required=False)
 parser.add_argument(
     "--dpath",
     type=str, help="Path to D_0 dataset", required=True)
@@ -102,9 +105,38 @@ parser.add_argument(
 parser.add_argument(
     "--eta",
     type=float, help="Eta", required=False)
+parser.add_argument(
+    "--db",
+    type=str,
+    help="Database type (file, memory, segmented, sqlite or ring)",
+    required=False, default="file")
+parser.add_argument(
+    "--schema",
+    action="store_true",
+    help="Store only features, class and key columns in database")
+parser.add_argument(
+    "--key_columns",
+    type=str, nargs="+", help="Columns kept in database with --schema",
+    required=False, default=[])
 parser.add_argument(
     "--max_db_size",
     type=int, help="Maximum size of training database", required=True)
+parser.add_argument(
+    "--keep_models",
+    type=int, help="Number of model versions kept for rollback",
+    required=False, default=0)
+parser.add_argument(
+    "--persist_background",
+    action="store_true",
+    help="Pickle models in background thread")
+parser.add_argument(
+    "--mmap_model",
+    action="store_true",
+    help="Memory map compiled model for fast restart")
+parser.add_argument(
+    "--prediction_cache",
+    type=int, help="Number of cached predictions of feature vectors",
+    required=False, default=0)
 
 
 args = parser.parse_args()
@@ -115,24 +147,53 @@ ContextProvider.get_context().set_features(DATASET_COLUMNS)
 ContextProvider.get_context().set_experiment_id(args.id)
 ContextProvider.get_context().set_working_dir(args.workdir)
 
-DbProvider.create_context(
-    context_type="file",
-    d_0_path=args.dpath)
+if args.db == "ring":
+    DbProvider.create_context(
+        context_type=args.db,
+        d_0_path=args.dpath,
+        capacity=args.max_db_size)
+else:
+    DbProvider.create_context(
+        context_type=args.db,
+        d_0_path=args.dpath,
+        schema=args.schema,
+        key_columns=args.key_columns)
 
-anotator = alf.anotator.AnotatorDoH(blacklist_path=args.blacklist)
+anotator = alf.anotator.AnotatorDoH(
+    blacklist_path=args.blacklist,
+    reload_interval=args.blacklist_reload)
 
+model_options = {
+    "persist_background": args.persist_background,
+    "keep_versions": args.keep_models,
+    "mmap": args.mmap_model,
+    "prediction_cache": args.prediction_cache,
+}
 if args.model == "single":
     model = alf.ml_model.SupervisedMLModel(VotingClassifier([
         ("rf1", RandomForestClassifier()),
         ("rf2", RandomForestClassifier()),
         ("rf3", RandomForestClassifier(criterion="entropy"))
-    ], voting="soft"))
+    ], voting="soft"), **model_options)
 elif args.model == "committee":
     model = alf.ml_model.CommitteeMLModel(VotingClassifier([
         ("rf1", RandomForestClassifier()),
         ("rf2", RandomForestClassifier()),
         ("rf3", RandomForestClassifier(criterion="entropy"))
-    ], voting="soft"))
+    ], voting="soft"), **model_options)
+elif args.model == "sliding":
+    model = alf.ml_model.SlidingForestMLModel(
+        RandomForestClassifier(), **model_options)
+elif args.model == "cascade":
+    model = alf.ml_model.CascadeMLModel(
+        alf.ml_model.SupervisedMLModel(
+            RandomForestClassifier(n_estimators=10), name="cheap",
+            **model_options),
+        alf.ml_model.CommitteeMLModel(VotingClassifier([
+            ("rf1", RandomForestClassifier()),
+            ("rf2", RandomForestClassifier()),
+            ("rf3", RandomForestClassifier(criterion="entropy"))
+        ], voting="soft"), name="committee", **model_options))
 else:
     raise ValueError("Unknown model name")
 
@@ -193,7 +254,11 @@ else:
 input_manager = alf.input_manager.TrapcapSocketInputManager(
         definition=args.i)
 
-postprocessor = alf.postprocess.PostprocessorUndersample(args.max_db_size)
+if args.db == "ring":
+    # ring buffer is balanced and bounded by itself
+    postprocessor = alf.postprocess.PostprocessorIdentity()
+else:
+    postprocessor = alf.postprocess.PostprocessorUndersample(args.max_db_size)
 
 while True:
     engine = alf.engine.Engine(
@@ -0,0 +1,13 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def isolated_random():
+    """Restore global numpy random state after test. Some tests depend on
+    the sequence of random numbers drawn by tests run before them, so tests
+    which draw random numbers but do not care about them should use this.
+    """
+    state = np.random.get_state()
+    yield
+    np.random.set_state(state)
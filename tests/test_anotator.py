@@ -0,0 +1,260 @@
+import http.server
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from alf import anotator
+from alf import context_manager
+from alf import ip_flow
+
+IPFlowsDataFrame = ip_flow.IPFlowsDataFrame
+
+blacklist_path = "tests/test_files/test_blacklist.txt"
+
+
+def test_doh_anotation_labels_only():
+    """Anotator returns only label column aligned with flows index."""
+    anot = anotator.AnotatorDoH(blacklist_path)
+    flows = IPFlowsDataFrame({
+        "SRC_IP": ["10.0.0.1", "104.16.248.249", "10.0.0.2", "10.0.0.3"],
+        "DST_IP": ["1.1.1.1", "10.0.0.1", "10.0.0.9", "10.0.0.1"],
+        "bytes": [1, 2, 3, 4]
+    }, index=[5, 7, 9, 11])
+    result = anot.anotate(flows)
+    assert list(result.columns) == ["class"]
+    assert list(result.index) == [5, 7, 9, 11]
+    assert list(result["class"]) == [True, True, False, False]
+    assert "class" not in flows.columns
+
+
+def test_doh_anotation_ipv6_and_objects(tmp_path):
+    """IPv6 and non-string IP objects are matched, invalid IPs are not."""
+    path = tmp_path / "blacklist.txt"
+    path.write_text("2606:4700:4700::1111\n\n192.168.1.1\n")
+    anot = anotator.AnotatorDoH(str(path))
+    flows = IPFlowsDataFrame({
+        "SRC_IP": [
+            ipaddress.ip_address("2606:4700:4700::1111"),
+            ipaddress.ip_address("2606:4700:4700::1112"),
+            "not an ip",
+            None],
+        "DST_IP": ["10.0.0.1", "10.0.0.1", "10.0.0.1", "192.168.1.1"]
+    })
+    result = anot.anotate(flows)
+    assert np.array_equal(result["class"], [True, False, False, True])
+
+
+def test_doh_anotation_prefixes(tmp_path):
+    """CIDR prefixes of both IP versions cover all their addresses."""
+    path = tmp_path / "blacklist.txt"
+    path.write_text(
+        "# resolvers\n104.16.0.0/12\n104.16.248.248\n"
+        "9.9.9.9/32 # quad9\n2606:4700::/32\n")
+    anot = anotator.AnotatorDoH(str(path))
+    flows = IPFlowsDataFrame({
+        "SRC_IP": [
+            "104.16.0.0", "104.31.255.255", "104.32.0.0",
+            "9.9.9.9", "9.9.9.10", "2606:4700:ffff::1", "2606:4701::1"],
+        "DST_IP": ["10.0.0.1"] * 7
+    })
+    result = anot.anotate(flows)
+    assert list(result["class"]) == [
+        True, True, False, True, False, True, False]
+
+
+def test_ip_interval_index_merges():
+    """Overlapping and adjacent prefixes are merged, invalid entries fail."""
+    index = anotator.IPIntervalIndex([
+        "10.0.0.0/25", "10.0.0.128/25", "10.0.0.5", "10.0.1.7/16"])
+    assert len(index) == 4
+    assert len(index._v4_starts) == 1
+    ips = IPFlowsDataFrame({"ip": ["10.0.255.255", "10.1.0.0"]})["ip"]
+    assert list(index.contains(ips)) == [True, False]
+    for entry in ["10.0.0.0/33", "10.0.0", "10.0.0.0.1", "1.2.3.x"]:
+        with pytest.raises(ValueError):
+            anotator.IPIntervalIndex([entry])
+
+
+def test_ip_interval_index_speed():
+    """Lookup is not slower than plain set of blacklisted strings, with
+    and without prefixes in the index."""
+    rng = np.random.default_rng(0)
+    pool = [
+        ".".join(map(str, octets))
+        for octets in rng.integers(0, 256, size=(3000, 4))]
+    blacklist = pool[:1000]
+    ips = IPFlowsDataFrame(
+        {"ip": rng.choice(pool, size=50000)})["ip"]
+
+    def best_of(func, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    blacklist_set = set(blacklist)
+    set_time, expected = best_of(
+        lambda: np.vectorize(lambda ip: ip in blacklist_set)(ips))
+    plain = anotator.IPIntervalIndex(blacklist)
+    plain_time, found = best_of(lambda: plain.contains(ips))
+    assert (found == expected).all()
+    assert plain_time < 2 * set_time
+    prefixes = anotator.IPIntervalIndex(blacklist + ["198.18.0.0/15"])
+    prefix_time, found = best_of(lambda: prefixes.contains(ips))
+    network = ipaddress.ip_network("198.18.0.0/15")
+    in_network = ips.map(lambda ip: ipaddress.ip_address(ip) in network)
+    assert (found == expected | in_network.to_numpy(dtype=bool)).all()
+    assert prefix_time < 2 * set_time
+
+
+def test_doh_blacklist_reload(tmp_path):
+    """Changed blacklist is used after reload and reported in metrics."""
+    context_manager.ContextProvider.create_context("file")
+    path = tmp_path / "blacklist.txt"
+    path.write_text("1.1.1.1\n")
+    anot = anotator.AnotatorDoH(str(path))
+    flows = IPFlowsDataFrame({
+        "SRC_IP": ["1.1.1.1", "8.8.8.8"],
+        "DST_IP": ["10.0.0.1", "10.0.0.1"]
+    })
+    assert not anot.reload()
+    path.write_text("8.8.8.0/24\n9.9.9.9\n")
+    os.utime(path, ns=(0, 0))
+    assert anot.reload()
+    assert list(anot.anotate(flows)["class"]) == [False, True]
+    metrics = context_manager.ContextProvider.get_context().get_metrics()
+    assert metrics["blacklist_size"] == 2
+    assert metrics["blacklist_reload_t"] >= 0
+
+
+class ReputationHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in of reputation service. Marks 1.1.1.1 as DoH, 9.9.9.9
+    is unknown."""
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        flows = json.loads(self.rfile.read(length))["flows"]
+        ReputationHandler.requests.append(len(flows))
+        body = json.dumps({"labels": [
+            None if "9.9.9.9" in (flow["src_ip"], flow["dst_ip"])
+            else "1.1.1.1" in (flow["src_ip"], flow["dst_ip"])
+            for flow in flows
+        ]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_anotator_batches_and_cache():
+    """Unique IP pairs are queried in batches and cached afterwards."""
+    context_manager.ContextProvider.create_context("file")
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), ReputationHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    anot = anotator.AnotatorHTTP(
+        f"http://127.0.0.1:{server.server_port}/labels",
+        batch_size=2, max_connections=2)
+    flows = IPFlowsDataFrame({
+        "SRC_IP": ["10.0.0.1", "10.0.0.1", "10.0.0.2", "10.0.0.3", None],
+        "DST_IP": ["1.1.1.1", "1.1.1.1", "8.8.8.8", "1.1.1.1", "8.8.8.8"]
+    })
+    try:
+        result = anot.anotate(flows)
+        assert list(result["class"]) == [True, True, False, True, False]
+        assert sorted(ReputationHandler.requests) == [2, 2]
+        metrics = context_manager.ContextProvider.get_context().get_metrics()
+        assert metrics["remote_queried"] == 4
+        result = anot.anotate(flows)
+        assert list(result["class"]) == [True, True, False, True, False]
+        assert len(ReputationHandler.requests) == 2
+        metrics = context_manager.ContextProvider.get_context().get_metrics()
+        assert metrics["remote_cache_hits"] == 4
+        assert metrics["remote_queried"] == 0
+    finally:
+        anot.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_anotator_unknown_cached():
+    """Unknown label (None) is cached too, so it is not queried again."""
+    context_manager.ContextProvider.create_context("file")
+    server = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), ReputationHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    anot = anotator.AnotatorHTTP(
+        f"http://127.0.0.1:{server.server_port}/labels")
+    flows = IPFlowsDataFrame({"SRC_IP": ["10.0.0.1"], "DST_IP": ["9.9.9.9"]})
+    try:
+        assert list(anot.anotate(flows)["class"]) == [None]
+        anot.anotate(flows)
+        metrics = context_manager.ContextProvider.get_context().get_metrics()
+        assert metrics["remote_cache_hits"] == 1
+        assert metrics["remote_queried"] == 0
+    finally:
+        anot.close()
+        server.shutdown()
+        server.server_close()
+
+
+def test_http_anotator_unreachable():
+    """Flows of failed requests get default label which is not cached."""
+    context_manager.ContextProvider.create_context("file")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    anot = anotator.AnotatorHTTP(
+        f"http://127.0.0.1:{port}/", default_label=False, timeout=1.0)
+    flows = IPFlowsDataFrame({"SRC_IP": ["10.0.0.1"], "DST_IP": ["1.1.1.1"]})
+    try:
+        assert list(anot.anotate(flows)["class"]) == [False]
+        metrics = context_manager.ContextProvider.get_context().get_metrics()
+        assert metrics["remote_failed"] == 1
+        anot.anotate(flows)
+        metrics = context_manager.ContextProvider.get_context().get_metrics()
+        assert metrics["remote_cache_hits"] == 0
+    finally:
+        anot.close()
+
+
+def test_annotation_queue(tmp_path):
+    """Queued flows are resolved asynchronously and merged only once."""
+    queue = anotator.AnnotationQueue(str(tmp_path / "queue.sqlite"))
+    anot = anotator.AnotatorHumanQueue(queue)
+    flows = IPFlowsDataFrame({
+        "SRC_IP": [ipaddress.ip_address("10.0.0.1"), "10.0.0.2"],
+        "bytes": [10, 20]
+    }, index=[3, 4])
+    result = anot.anotate(flows)
+    assert result["class"].isnull().all()
+    assert queue.pending() == 2
+    pending = queue.get_pending()
+    assert list(pending["SRC_IP"]) == ["10.0.0.1", "10.0.0.2"]
+    queue.resolve(result["annotation_id"].iloc[1], True)
+    with pytest.raises(KeyError):
+        queue.resolve(result["annotation_id"].iloc[1], False)
+    ids, resolved, latency = queue.get_resolved()
+    assert list(resolved["bytes"]) == [20]
+    assert list(resolved["class"]) == [True]
+    assert latency[0] >= 0
+    queue.mark_merged(ids)
+    reopened = anotator.AnnotationQueue(str(tmp_path / "queue.sqlite"))
+    assert reopened.pending() == 1
+    assert len(reopened.get_resolved()[1]) == 0
+    # labels taken from DataFrame are NumPy scalars
+    queue.resolve(result["annotation_id"].iloc[0], np.int64(1))
+    assert list(queue.get_resolved()[1]["class"]) == [1]
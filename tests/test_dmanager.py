@@ -1,3 +1,7 @@
+import ipaddress
+import json
+
+import numpy as np
 import pytest
 
 
@@ -88,3 +92,500 @@ def test_commit():
     dm.commit()
     dm.fetch(test_size=0.5)
     assert len(dm.get_all()) == 7
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_memory_reads_file_once(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t16")
+    dm = d_manager.DManagerMemory(d_0_path)
+    dm.fetch(test_size=0.5)
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": True,
+        "bytes_rev": 44,
+        "bytes": 44,
+        "packets": 44,
+        "packets_rev": 44
+    }]))
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 7
+    assert len(dm.get_train_set()[0]) + len(dm.get_test_set()[0]) == 7
+    dm.commit()
+    dm = d_manager.DManagerMemory(d_0_path)
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 7
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_segmented_commit_appends_segments(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t17")
+    dm = d_manager.DManagerSegmented(d_0_path, max_segments=3)
+    dm.fetch(test_size=0.5)
+    for i in range(2):
+        dm.append_to_db(IPFlowsDataFrame([{
+            "class": True,
+            "bytes_rev": i,
+            "bytes": 44,
+            "packets": 44,
+            "packets_rev": 44
+        }]))
+        dm.commit()
+    assert len(dm._manifest["segments"]) == 3
+    dm = d_manager.DManagerSegmented(d_0_path)
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 8
+    assert list(dm.get_all()["bytes_rev"].iloc[-2:]) == [0, 1]
+    dm.set_all(dm.get_all().iloc[:4])
+    dm.commit()
+    assert len(dm._manifest["segments"]) == 1
+    dm = d_manager.DManagerSegmented(d_0_path)
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 4
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_segmented_compaction(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t18")
+    dm = d_manager.DManagerSegmented(d_0_path, max_segments=2)
+    dm.fetch(test_size=0.5)
+    for i in range(2):
+        dm.append_to_db(IPFlowsDataFrame([{
+            "class": False,
+            "bytes_rev": i,
+            "bytes": 44,
+            "packets": 44,
+            "packets_rev": 44
+        }]))
+        dm.commit()
+    dm._compactor.join()
+    assert len(dm._manifest["segments"]) == 1
+    dm = d_manager.DManagerSegmented(d_0_path)
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 8
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_sqlite(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t19")
+    d_manager.DbProvider.create_context("sqlite", d_0_path=d_0_path)
+    dm = d_manager.DbProvider.get_context()
+    dm.fetch(test_size=0.5)
+    assert len(dm.get_all()) == 6
+    assert dm.class_counts() == {True: 3, False: 3}
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": True,
+        "bytes_rev": 44,
+        "bytes": 44,
+        "packets": 44,
+        "packets_rev": 44,
+        "SRC_IP": ipaddress.ip_address("10.0.0.1")
+    }]))
+    dm.commit()
+    dm = d_manager.DManagerSQLite(d_0_path)
+    dm.fetch(test_size=0.5)
+    X_train, y_train = dm.get_train_set()
+    X_test, y_test = dm.get_test_set()
+    assert len(X_train) + len(X_test) == 7
+    assert set(y_train) | set(y_test) == {True, False}
+    assert dm.class_counts() == {True: 4, False: 3}
+    assert dm.get_all()["SRC_IP"].iloc[-1] == "10.0.0.1"
+    dm.fetch(test_size=0.5, sample_size=4)
+    assert len(dm.get_train_set()[0]) + len(dm.get_test_set()[0]) == 4
+    dm.fetch(test_size=0.5, window=3600)
+    assert len(dm.get_train_set()[0]) + len(dm.get_test_set()[0]) == 7
+
+
+def test_sqlite_uncommitted_is_lost(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t20")
+    dm = d_manager.DManagerSQLite(d_0_path)
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": False,
+        "bytes_rev": 1,
+        "bytes": 1,
+        "packets": 1,
+        "packets_rev": 1
+    }]))
+    dm.set_all(dm.get_all().iloc[:2])
+    del dm
+    dm = d_manager.DManagerSQLite(d_0_path)
+    assert len(dm.get_all()) == 6
+
+
+def test_ring_buffer_bounded(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t21")
+    dm = d_manager.DManagerRingBuffer(d_0_path, capacity=8, test_size=0.25)
+    dm.fetch()
+    assert dm.class_counts() == {False: 3, True: 3}
+    for i in range(5):
+        dm.append_to_db(IPFlowsDataFrame([{
+            "class": True,
+            "bytes_rev": 100 + i,
+            "bytes": 100 + i,
+            "packets": 44,
+            "packets_rev": 44
+        }]))
+    assert dm.class_counts() == {False: 3, True: 4}
+    assert len(dm.get_all()) == 7
+    assert set(dm.get_all()["bytes"]) >= {103, 104}
+    dm.commit()
+    dm = d_manager.DManagerRingBuffer(d_0_path, capacity=8, test_size=0.25)
+    dm.fetch()
+    X_train, y_train = dm.get_train_set()
+    X_test, y_test = dm.get_test_set()
+    assert list(X_train.columns) == features
+    assert len(X_train) == 6 and len(X_test) == 1
+    assert set(y_train) == {True, False}
+
+
+def test_ring_buffer_random_eviction_keeps_new_flows(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t30")
+    dm = d_manager.DManagerRingBuffer(
+        d_0_path, capacity=16, test_size=0.0, eviction="random",
+        classes=[False, True])
+    for _ in range(20):
+        dm.set_all(dm.get_all().iloc[:0])
+        dm.append_to_db(IPFlowsDataFrame({
+            "class": [True] * 6, "bytes_rev": range(6), "bytes": range(6)}))
+        # 8 slots of class True, 6 new flows overwrite 3 of 5 stored ones
+        dm.append_to_db(IPFlowsDataFrame({
+            "class": [True] * 6,
+            "bytes_rev": range(10, 16), "bytes": range(10, 16)}))
+        stored = set(dm.get_all()["bytes"])
+        assert len(stored) == 8
+        assert stored >= set(range(10, 16))
+
+
+def test_ring_buffer_layout_change(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t31")
+    dm = d_manager.DManagerRingBuffer(d_0_path, capacity=8, test_size=0.25)
+    dm.fetch()
+    test_flows = set(dm.get_test_set()[0]["bytes"])
+    dm.commit()
+    dm = d_manager.DManagerRingBuffer(d_0_path, capacity=20, test_size=0.5)
+    dm.fetch()
+    assert dm.class_counts() == {False: 3, True: 3}
+    assert set(dm.get_test_set()[0]["bytes"]) == test_flows
+    with pytest.raises(ValueError):
+        d_manager.DManagerRingBuffer(
+            d_0_path, capacity=8, classes=[True])
+
+
+def test_ring_buffer_zero_copy_views(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t22")
+    dm = d_manager.DManagerRingBuffer(
+        d_0_path, capacity=4, test_size=0.5, eviction="random")
+    dm.fetch()
+    X_train, _ = dm.get_train_set()
+    X_test, _ = dm.get_test_set()
+    assert np.shares_memory(X_train.to_numpy(), dm._X)
+    assert not np.shares_memory(X_test.to_numpy(), dm._X)
+    test_flows = X_test.to_numpy().copy()
+    # new flows overwrite test rings in place, fetched test set is kept
+    dm.append_to_db(IPFlowsDataFrame({
+        "class": [True, False] * 4, "bytes_rev": range(8),
+        "bytes": range(8)}))
+    assert (dm.get_test_set()[0].to_numpy() == test_flows).all()
+    with pytest.raises(ValueError):
+        dm.append_to_db(IPFlowsDataFrame([{
+            "class": "other",
+            "bytes_rev": 1,
+            "bytes": 1
+        }]))
+
+
+def test_hash_split_is_stable(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t23")
+    dm = d_manager.DManagerMemory(d_0_path, split="hash")
+    dm.fetch(test_size=0.5)
+    X_test, _ = dm.get_test_set()
+    dm.fetch(test_size=0.5)
+    assert dm.get_test_set()[0] is X_test
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": True,
+        "bytes_rev": 44,
+        "bytes": 44,
+        "packets": 44,
+        "packets_rev": 44
+    }]))
+    dm.fetch(test_size=0.5)
+    X_train, _ = dm.get_train_set()
+    assert len(X_train) + len(dm.get_test_set()[0]) == 7
+    assert set(X_test["bytes"]) <= set(dm.get_test_set()[0]["bytes"])
+    segmented = d_manager.DManagerSegmented(d_0_path, split="hash")
+    segmented.fetch(test_size=0.5)
+    segmented_test, _ = segmented.get_test_set()
+    segmented.fetch(test_size=0.5)
+    assert segmented.get_test_set()[0] is segmented_test
+    file_dm = d_manager.DManagerFile(d_0_path, split="hash")
+    file_dm.fetch(test_size=0.5)
+    assert list(file_dm.get_test_set()[0]["bytes"]) == list(X_test["bytes"])
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_class_counts(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t24")
+    dm = d_manager.DManagerMemory(d_0_path)
+    assert dm.class_counts() == {}
+    assert dm.prevalence() == 0.0
+    dm.fetch(test_size=0.5)
+    assert dm.class_counts() == {True: 3, False: 3}
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": True,
+        "bytes_rev": 44,
+        "bytes": 44,
+        "packets": 44,
+        "packets_rev": 44
+    }]))
+    assert dm.class_counts() == {True: 4, False: 3}
+    assert dm.prevalence() == pytest.approx(4 / 7)
+    dm.set_all(dm.get_all().iloc[:2])
+    assert dm.class_counts() == {True: 2}
+    assert dm.prevalence(False) == 0.0
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_schema_projection(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t25")
+    dm = d_manager.DManagerMemory(
+        d_0_path, schema=True, key_columns=["SRC_IP", "DST_IP"])
+    dm.fetch(test_size=0.5)
+    assert "packets" not in dm.get_all().columns
+    dm.append_to_db(IPFlowsDataFrame([{
+        "class": True,
+        "bytes_rev": 44,
+        "bytes": 44,
+        "packets": 44,
+        "SRC_IP": ipaddress.ip_address("10.0.0.1"),
+        "DST_IP": ipaddress.ip_address("10.0.0.2"),
+        "PPI_PKT_LENGTHS": [1, 2, 3]
+    }]))
+    X, _ = dm.get_last_added()
+    assert list(X.columns) == ["SRC_IP", "DST_IP"] + features
+    assert X["bytes"].dtype == np.float64
+    assert X["SRC_IP"].iloc[0] == "10.0.0.1"
+    assert "PPI_PKT_LENGTHS" not in dm.get_all().columns
+
+
+@pytest.mark.usefixtures("isolated_random")
+@pytest.mark.parametrize("context_type", ["file", "segmented", "sqlite"])
+def test_schema_projection_on_load(tmp_path, context_type):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t32")
+    d_manager.DbProvider.create_context(context_type, d_0_path=d_0_path)
+    d_manager.DbProvider.create_context(
+        context_type, d_0_path=d_0_path, schema=True)
+    dm = d_manager.DbProvider.get_context()
+    dm.fetch(test_size=0.5)
+    assert "packets" not in dm.get_all().columns
+    assert dm.get_all()["bytes"].dtype == np.float64
+    assert "packets" not in dm.get_train_set()[0].columns
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_dedup(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t26")
+    dm = d_manager.DManagerMemory(d_0_path, dedup="skip")
+    dm.fetch(test_size=0.5)
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 92, "bytes": 180},
+        {"class": False, "bytes_rev": 92, "bytes": 180},
+        {"class": False, "bytes_rev": 92, "bytes": 180},
+    ]))
+    assert len(dm.get_all()) == 7
+    assert ContextProvider.get_context().get_metrics()["dedup_hits"] == 2
+
+    ContextProvider.get_context().set_experiment_id("alf_t27")
+    dm = d_manager.DManagerSegmented(d_0_path, dedup="weight")
+    dm.fetch(test_size=0.5)
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 92, "bytes": 180},
+        {"class": True, "bytes_rev": 1, "bytes": 1},
+        {"class": True, "bytes_rev": 1, "bytes": 1},
+    ]))
+    dm.commit()
+    db = d_manager.DManagerSegmented(d_0_path, dedup="weight")
+    db.fetch(test_size=0.5)
+    weights = db.get_all().set_index("bytes")["weight"]
+    assert len(weights) == 7
+    assert weights[180] == 2
+    assert weights[1] == 2
+    assert weights[0] == 1
+
+    with open(f"{tmp_path}/db.alf_t27/manifest.json", encoding="utf8") as f:
+        segments = json.load(f)["segments"]
+    db.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 92, "bytes": 180},
+    ]))
+    db.commit()
+    with open(f"{tmp_path}/db.alf_t27/manifest.json", encoding="utf8") as f:
+        manifest = json.load(f)
+    # duplicate is appended as update, stored segments are kept
+    assert manifest["segments"] == segments
+    assert len(manifest["updates"]) == 1
+    db = d_manager.DManagerSegmented(d_0_path, dedup="weight")
+    db.fetch(test_size=0.5)
+    assert db.get_all().set_index("bytes")["weight"][180] == 3
+
+    ContextProvider.get_context().set_experiment_id("alf_t33")
+    dm = d_manager.DManagerFile(d_0_path, dedup="weight")
+    dm.fetch(test_size=0.5)
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 1, "bytes": 1},
+    ]))
+    dm.commit()
+    dm.fetch(test_size=0.5)
+    index = dm._dedup_index
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 2, "bytes": 2},
+    ]))
+    # uncommitted flow is dropped by fetch, index is kept without it
+    dm.fetch(test_size=0.5)
+    assert dm._dedup_index is index
+    assert len(index) == 7
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 1, "bytes": 1},
+        {"class": True, "bytes_rev": 2, "bytes": 2},
+    ]))
+    weights = dm.get_all().set_index("bytes")["weight"]
+    assert len(weights) == 8
+    assert weights[1] == 2
+    assert weights[2] == 1
+
+
+def test_segmented_set_column(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t34")
+    dm = d_manager.DManagerSegmented(d_0_path, schema=True, split="hash")
+    dm.fetch(test_size=0.5)
+    dm.set_column("generation", 1.0, np.array([0, 2]))
+    dm.set_column("generation", 2.0, np.array([2]))
+    dm.commit()
+    with open(f"{tmp_path}/db.alf_t34/manifest.json", encoding="utf8") as f:
+        manifest = json.load(f)
+    # column is appended as updates, stored segment is kept
+    assert len(manifest["segments"]) == 1
+    assert len(manifest["updates"]) == 2
+    db = d_manager.DManagerSegmented(d_0_path, schema=True, split="hash")
+    db.fetch(test_size=0.5)
+    # column not registered in this instance is dropped by schema
+    assert "generation" not in db.get_all().columns
+    db = d_manager.DManagerSegmented(d_0_path, schema=True, split="hash")
+    db.register_column("generation")
+    db.fetch(test_size=0.5)
+    generations = db.get_all()["generation"]
+    assert list(generations.iloc[:3].fillna(0)) == [1, 0, 2]
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_snapshot(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t28")
+    dm = d_manager.DManagerMemory(d_0_path, dedup="weight")
+    dm.fetch(test_size=0.5)
+    first = dm.snapshot()
+    assert first.version == 1
+    assert dm.snapshot() is first
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 92, "bytes": 180},
+        {"class": True, "bytes_rev": 1, "bytes": 1},
+    ]))
+    dm.set_column("generation", 1.0, np.array([0]))
+    dm.get_all()["bytes"] = 0
+    dm.commit()
+    assert len(first.flows) == 6
+    assert "weight" not in first.flows.columns
+    second = dm.snapshot()
+    assert second.version == 2
+    flows = second.flows
+    assert list(flows["weight"]) == [2, 1, 1, 1, 1, 1, 1]
+    assert flows["generation"].iloc[0] == 1
+    assert flows["bytes"].iloc[0] == 180
+    flows["bytes"] = 0
+    assert second.flows["bytes"].iloc[0] == 180
+    with pytest.raises(ValueError):
+        second.flows.loc[0, "bytes"] = 0
+    with pytest.raises(ValueError):
+        dm.get_all().loc[0, "bytes"] = 0
+    assert second.flows["bytes"].iloc[0] == 180
+
+
+@pytest.mark.parametrize("db_type, options", [
+    ("memory", {}),
+    ("sqlite", {}),
+    ("ring", {"capacity": 16, "test_size": 0.0}),
+])
+@pytest.mark.usefixtures("isolated_random")
+def test_snapshot_published_lazily(tmp_path, monkeypatch, db_type, options):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id(f"alf_t35_{db_type}")
+    d_manager.DbProvider.create_context(db_type, d_0_path=d_0_path, **options)
+    dm = d_manager.DbProvider.get_context()
+    dm.fetch(test_size=0.5)
+    assert dm.snapshot().version == 1
+    reads = []
+    read_committed = dm._read_committed
+    monkeypatch.setattr(
+        dm, "_read_committed", lambda: reads.append(1) or read_committed())
+    for bytes_ in (1, 2):
+        dm.append_to_db(IPFlowsDataFrame([
+            {"class": True, "bytes_rev": 1, "bytes": bytes_},
+        ]))
+        dm.commit()
+    assert reads == []
+    dm.append_to_db(IPFlowsDataFrame([
+        {"class": True, "bytes_rev": 1, "bytes": 3},
+    ]))
+    snapshot = dm.snapshot()
+    assert reads == [1]
+    assert snapshot.version == 2
+    # flows appended after commit are not published
+    assert sorted(snapshot.flows["bytes"])[:3] == [0, 1, 2]
+    assert len(snapshot.flows) == 8
+    assert dm.snapshot() is snapshot
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_added_since_train_only(tmp_path):
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_experiment_id("alf_t36")
+    dm = d_manager.DManagerMemory(d_0_path)
+    dm.fetch(test_size=0.5)
+    cursor = dm.get_cursor()
+    dm.append_to_db(IPFlowsDataFrame({
+        "class": [True, False] * 4,
+        "bytes_rev": np.arange(8),
+        "bytes": np.arange(8) + 1000,
+    }))
+    # positions of appended flows are shifted by eviction
+    dm.evict(np.array([0, 1, 7]))
+    dm.fetch(test_size=0.5)
+    X, y = dm.get_added_since(cursor, train_only=True)
+    X_train, _ = dm.get_train_set()
+    new = set(range(1000, 1008)) - {1001}
+    assert set(X["bytes"]) == new & set(X_train["bytes"])
+    assert len(y) == len(X)
+    assert len(dm.get_added_since(cursor)[0]) == 7
+
+
+def test_working_dir_required():
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_features(features)
+    ContextProvider.get_context().set_experiment_id("alf_t29")
+    with pytest.raises(ValueError):
+        d_manager.DManagerSegmented(d_0_path)
+    with pytest.raises(ValueError):
+        d_manager.DManagerSQLite(d_0_path)
+    with pytest.raises(ValueError):
+        d_manager.DManagerRingBuffer(d_0_path, capacity=8)
@@ -1,16 +1,28 @@
+import numpy as np
+import pandas as pd
 import pytest
 
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import VotingClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.tree import DecisionTreeClassifier
 from numpy.random import seed
 from sklearn.exceptions import NotFittedError
 
+from alf import anotator
 from alf import ml_model
 from alf import context_manager
 from alf import d_manager
+from alf import evaluator
+from alf import ip_flow
+from alf import model_store
+from alf import processor
+from alf import query_strategy
 
 SupervisedMLModel = ml_model.SupervisedMLModel
 ContextProvider = context_manager.ContextProvider
 DbProvider = d_manager.DbProvider
+IPFlowsDataFrame = ip_flow.IPFlowsDataFrame
 
 seed(13)
 
@@ -61,3 +73,432 @@ def test_pickle_no_model():
     X, _ = DbProvider.get_context().get_train_set()
     with pytest.raises(NotFittedError):
         m.predict(X)
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_incremental_trains_on_delta(tmp_path):
+    """Only appended flows are passed to partial_fit between refits."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id668")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("memory", d_0_path=d_0_path)
+    db = DbProvider.get_context()
+    db.fetch(test_size=0.5)
+    m = ml_model.SupervisedMLModelIncremental(GaussianNB(), refit_every=2)
+    m.train()
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["train_full"] and metrics["train_flows"] == 3
+    trained = 3
+    for generation in range(2):
+        db.append_to_db(IPFlowsDataFrame({
+            "class": [True, False, True, False],
+            "bytes_rev": [generation] * 4,
+            "bytes": [generation] * 4,
+        }))
+        db.fetch(test_size=0.5)
+        m.train()
+        X_train, _ = db.get_train_set()
+        new = int((X_train["bytes_rev"] == generation).sum())
+        assert not metrics["train_full"] and metrics["train_flows"] == new
+        trained += new
+    assert m._clf.class_count_.sum() == trained
+    m.train()
+    assert metrics["train_full"] and metrics["train_flows"] == 7
+    db.set_all(db.get_all())
+    db.fetch(test_size=0.5)
+    m.train()
+    assert metrics["train_full"]
+    # empty delta does not change the model
+    version = m._version
+    m.train()
+    assert metrics["train_flows"] == 0 and m._version == version
+
+
+class RecordingNB(GaussianNB):
+    """GaussianNB recording flows passed to partial_fit."""
+    recorded = []
+
+    def partial_fit(self, X, y, classes=None, sample_weight=None):
+        RecordingNB.recorded.append(X)
+        return super().partial_fit(X, y, classes, sample_weight)
+
+
+@pytest.mark.usefixtures("isolated_random")
+@pytest.mark.parametrize("db_type, options", [
+    ("memory", {}),
+    ("memory", {"split": "hash"}),
+    ("ring", {"capacity": 32}),
+])
+def test_incremental_skips_test_set(tmp_path, db_type, options):
+    """Flows of test set never reach partial_fit."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id(f"id672_{db_type}")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context(db_type, d_0_path=d_0_path, **options)
+    db = DbProvider.get_context()
+    db.fetch(test_size=0.5)
+    m = ml_model.SupervisedMLModelIncremental(RecordingNB())
+    m.train()
+    RecordingNB.recorded = []
+    for generation in range(3):
+        db.append_to_db(IPFlowsDataFrame({
+            "class": [True, False] * 5,
+            "bytes_rev": np.arange(10) + 100 * generation,
+            "bytes": np.arange(10) + 100 * generation,
+        }))
+        db.fetch(test_size=0.5)
+        m.train()
+        assert not ContextProvider.get_context().get_metrics()["train_full"]
+        X_train, _ = db.get_train_set()
+        X_test, _ = db.get_test_set()
+        trained = set(RecordingNB.recorded.pop()["bytes_rev"])
+        new = set(np.arange(10) + 100 * generation)
+        assert trained == new & set(X_train["bytes_rev"])
+        assert not trained & set(X_test["bytes_rev"])
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_sliding_forest(tmp_path):
+    """New trees are added to forest and the oldest are removed."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id669")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("memory", d_0_path=d_0_path)
+    db = DbProvider.get_context()
+    db.fetch(test_size=0.5)
+    m = ml_model.SlidingForestMLModel(
+        RandomForestClassifier(), n_new_trees=2, max_trees=5, sample_size=2)
+    m.train()
+    first = list(m._clf.estimators_)
+    assert len(first) == 5
+    db.append_to_db(IPFlowsDataFrame({
+        "class": [True, False],
+        "bytes_rev": [1, 2],
+        "bytes": [1, 2],
+    }))
+    db.fetch(test_size=0.5)
+    m.train()
+    metrics = ContextProvider.get_context().get_metrics()
+    assert not metrics["train_full"]
+    assert m._clf.estimators_[:3] == first[2:]
+    assert m.predict(db.get_all()).shape == (8, 2)
+    assert list(m.classes()) == [False, True]
+
+
+class RecordingForest(RandomForestClassifier):
+    """RandomForestClassifier recording flows passed to fit."""
+    recorded = []
+
+    def fit(self, X, y, sample_weight=None):
+        RecordingForest.recorded.append(X)
+        return super().fit(X, y, sample_weight)
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_sliding_forest_delta(tmp_path):
+    """New trees are fitted on new train set flows, each of them once."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id673")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("memory", d_0_path=d_0_path)
+    db = DbProvider.get_context()
+    db.fetch(test_size=0.5)
+    m = ml_model.SlidingForestMLModel(
+        RecordingForest(), n_new_trees=2, max_trees=5, sample_size=100)
+    m.train()
+    db.append_to_db(IPFlowsDataFrame({
+        "class": [True, False] * 5,
+        "bytes_rev": np.arange(10) + 100,
+        "bytes": np.arange(10) + 100,
+    }))
+    db.fetch(test_size=0.5)
+    RecordingForest.recorded = []
+    m.train()
+    assert not ContextProvider.get_context().get_metrics()["train_full"]
+    X_train, _ = db.get_train_set()
+    X_test, _ = db.get_test_set()
+    fitted = RecordingForest.recorded[0]["bytes_rev"]
+    # sample covers whole train set, but no flow is repeated
+    assert fitted.is_unique
+    assert set(fitted) == set(X_train["bytes_rev"])
+    assert not set(fitted) & set(X_test["bytes_rev"])
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_compiled_forest():
+    """Compiled model predicts the same probabilities as sklearn."""
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 4))
+    y = X[:, 0] + X[:, 1] ** 2 > 0.5
+    X[rng.random(X.shape) < 0.05] = np.nan
+    voting = VotingClassifier([
+        ("rf1", RandomForestClassifier(n_estimators=10)),
+        ("rf2", RandomForestClassifier(n_estimators=5, criterion="entropy")),
+        ("dt", DecisionTreeClassifier(max_depth=3))
+    ], voting="soft", weights=[1, 2, 1]).fit(X, y)
+    compiled = ml_model.CompiledForest(voting, chunk_size=64)
+    X_test = rng.normal(size=(200, 4))
+    X_test[rng.random(X_test.shape) < 0.05] = np.nan
+    assert np.allclose(
+        compiled.predict_proba(X_test), voting.predict_proba(X_test))
+    with pytest.raises(TypeError):
+        ml_model.CompiledForest(GaussianNB().fit([[0], [1]], [0, 1]))
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_compiled_model(tmp_path):
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id670")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    X = DbProvider.get_context().get_all()
+    m = ml_model.CommitteeMLModel(VotingClassifier([
+        ("rf1", RandomForestClassifier(n_estimators=5)),
+        ("rf2", RandomForestClassifier(n_estimators=5))
+    ], voting="soft"), compile=True)
+    m.train()
+    compiled = m.predict(X)
+    m._compiled = None
+    assert np.allclose(compiled, m.predict(X))
+    m = ml_model.SupervisedMLModel(None, compile=True)
+    assert m._compiled is not None
+    assert list(m.predict_hard(X)) == list(m._clf.predict(X[features]))
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_compile_max_batch_measured(tmp_path):
+    """Measured batch limit separates batches where compiled model is faster
+    from those where sklearn is faster."""
+    columns = [f"f{i}" for i in range(8)]
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id675")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(columns)
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(4000, 8)), columns=columns)
+    y = X["f0"] + X["f1"] * X["f2"] > 0
+    m = SupervisedMLModel(
+        RandomForestClassifier(n_estimators=30).fit(X, y), compile=True)
+    m._recompile()
+    limit = m._compile_max_batch
+    assert 1 < limit < len(X) // 4
+    small, large = X.iloc[:max(limit // 4, 1)], X.iloc[:4 * limit]
+    assert ml_model._best_time(m._compiled.predict_proba, small) \
+        < ml_model._best_time(m._clf.predict_proba, small)
+    assert ml_model._best_time(m._clf.predict_proba, large) \
+        < ml_model._best_time(m._compiled.predict_proba, large)
+    assert SupervisedMLModel(
+        None, compile=True, compile_max_batch=8)._compile_max_batch == 8
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_cascade(tmp_path):
+    """Only uncertain flows are predicted by committee."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id671")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    X = DbProvider.get_context().get_all()
+    committee = ml_model.CommitteeMLModel(VotingClassifier([
+        ("rf1", RandomForestClassifier(n_estimators=5)),
+        ("rf2", RandomForestClassifier(n_estimators=5)),
+        ("rf3", RandomForestClassifier(n_estimators=5))
+    ], voting="soft"), name="expensive")
+    cascade = ml_model.CascadeMLModel(
+        SupervisedMLModel(GaussianNB(), name="cheap"), committee)
+    cascade.train()
+    cheap = cascade._cheap.predict(X)
+    # escalate all flows except the most certain ones
+    cascade._threshold = cheap.max(axis=1).max()
+    escalated = cheap.max(axis=1) < cascade._threshold
+    assert escalated.any()
+    proba = cascade.predict(X)
+    assert proba.shape == (6, 3, 2)
+    assert np.array_equal(proba[~escalated, 0], cheap[~escalated])
+    assert np.array_equal(
+        proba[escalated], committee.predict(X.iloc[escalated]))
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["cascade_escalated"] == escalated.mean()
+    flow_t = cascade._flow_t
+    # evaluation does not change metrics of stream
+    assert cascade.predict_hard(X.iloc[:1]).shape == (1,)
+    assert ContextProvider.get_context().get_metrics() == metrics
+    assert cascade._flow_t == flow_t
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_cascade_rollback(tmp_path):
+    """Cascade delegates versions to both models."""
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id676")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    cascade = ml_model.CascadeMLModel(
+        SupervisedMLModel(GaussianNB(), name="cheap", keep_versions=2),
+        SupervisedMLModel(
+            DecisionTreeClassifier(), name="expensive", keep_versions=2))
+    for _ in range(2):
+        cascade.train()
+        cascade.pickle()
+    assert cascade._clf is cascade._expensive._clf
+    cascade.rollback()
+    assert cascade._cheap._version == cascade._expensive._version == 1
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_model_versions(tmp_path):
+    """Trained versions are kept, unchanged model is not pickled again and
+    older version can be restored.
+    """
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id672")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    m = SupervisedMLModel(
+        DecisionTreeClassifier(), keep_versions=3, persist_background=True)
+    m.train()
+    first = m._clf.tree_.node_count
+    m.train()
+    m.pickle()
+    m._store.wait()
+    assert m._store.versions() == [1, 2]
+    m.rollback()
+    assert m._version == 1
+    assert m._clf.tree_.node_count == first
+    assert SupervisedMLModel(DecisionTreeClassifier())._version == 1
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_mmap_model(tmp_path):
+    """Restarted model memory maps compiled model and unpickles classifier
+    only when needed.
+    """
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id673")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    X = DbProvider.get_context().get_all()
+    m = ml_model.CommitteeMLModel(VotingClassifier([
+        ("rf1", RandomForestClassifier(n_estimators=5)),
+        ("rf2", RandomForestClassifier(n_estimators=5))
+    ], voting="soft"), mmap=True, persist_background=True)
+    m.train()
+    expected = m.predict(X)
+    m._store.wait()
+
+    restarted = ml_model.CommitteeMLModel(VotingClassifier([]), mmap=True)
+    assert restarted._lazy
+    assert np.array_equal(restarted.classes(), m.classes())
+    assert isinstance(restarted._compiled[0].value.base, np.memmap)
+    assert restarted._compile_max_batch == m._compile_max_batch
+    assert np.allclose(restarted.predict(X), expected)
+    assert restarted._lazy
+    assert len(restarted._clf.estimators_) == 2
+    assert not restarted._lazy
+
+    # compiled model of other classifier version is not used
+    model_store.ModelStore(m._path()).save(m._clf, 2)
+    assert not ml_model.CommitteeMLModel(
+        VotingClassifier([]), mmap=True)._lazy
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_mmap_model_process(tmp_path, monkeypatch):
+    """Restarted model predicts large batch and is trained by processor
+    without unpickling classifier.
+    """
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id677")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    X = DbProvider.get_context().get_all()
+    SupervisedMLModel(
+        RandomForestClassifier(n_estimators=5), mmap=True).train()
+
+    restarted = SupervisedMLModel(
+        RandomForestClassifier(n_estimators=5), mmap=True,
+        compile_max_batch=8)
+    assert restarted._lazy
+
+    def load():
+        raise AssertionError("Classifier was unpickled")
+    monkeypatch.setattr(restarted._store, "load", load)
+    large = pd.concat([X] * 1000, ignore_index=True)
+    assert len(large) > restarted._compile_max_batch
+    assert restarted.predict(large).shape == (len(large), 2)
+    processor.Processor(
+        restarted,
+        query_strategy.RandomQueryStrategy(
+            anotator.AnotatorMiners(), dry_run=True, max_samples=2),
+        evaluator.EvaluatorTestAnotatedAndAllPredicted()).process(X.copy())
+    assert not restarted._lazy
+
+
+@pytest.mark.usefixtures("isolated_random")
+def test_prediction_cache(tmp_path):
+    """Repeated feature vectors are predicted once, cache is bounded and
+    cleared by training.
+    """
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("id674")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    X = DbProvider.get_context().get_all()
+    m = ml_model.CommitteeMLModel(VotingClassifier([
+        ("rf1", RandomForestClassifier(n_estimators=5)),
+        ("rf2", RandomForestClassifier(n_estimators=5))
+    ], voting="soft"), prediction_cache=4)
+    m.train()
+    repeated = X.iloc[[0, 1, 0, 1]]
+    expected = m._predict_proba(repeated[features])
+    assert np.array_equal(m.predict(repeated), expected)
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["prediction_cache_hit_rate"] == 0.5
+    assert np.array_equal(m.predict(repeated), expected)
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["prediction_cache_hit_rate"] == 1.0
+    assert np.array_equal(m.predict(X), m._predict_proba(X[features]))
+    assert len(m._cache) == 4
+    # evaluation does not fill cache nor change hit rate of stream
+    single = SupervisedMLModel(
+        RandomForestClassifier(n_estimators=5), prediction_cache=4)
+    single.train()
+    single.predict(repeated)
+    metrics = ContextProvider.get_context().get_metrics()
+    assert len(single.predict_hard(X)) == 6 and len(single._cache) == 2
+    assert ContextProvider.get_context().get_metrics() == metrics
+
+    m.train()
+    m.predict(repeated)
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["prediction_cache_hit_rate"] == 0.5
+    assert len(m._cache) == 2
@@ -0,0 +1,44 @@
+import os
+
+import joblib
+import pytest
+
+from sklearn.tree import DecisionTreeClassifier
+
+from alf import model_store
+
+
+def test_save_skips_stored_version(tmp_path):
+    """Model is stored only when its version changes.
+    """
+    path = str(tmp_path / "store_skip.bin")
+    store = model_store.ModelStore(path)
+    assert store.save(DecisionTreeClassifier(max_depth=1), 1)
+    assert not store.save(DecisionTreeClassifier(max_depth=2), 1)
+    assert store.load().max_depth == 1
+    assert not os.path.exists(f"{path}.tmp")
+
+
+def test_background_versions_and_rollback(tmp_path):
+    """Background store keeps the last versions and rolls back to them.
+    """
+    path = str(tmp_path / "store_versions.bin")
+    saved = []
+    store = model_store.ModelStore(
+        path, compress=3, keep=2, background=True,
+        on_save=lambda data, version: saved.append(version))
+    for version in range(1, 4):
+        store.save(DecisionTreeClassifier(max_depth=version), version)
+    store.wait()
+    assert saved == [1, 2, 3]
+    assert store.versions() == [2, 3]
+    assert joblib.load(path).max_depth == 3
+    assert model_store.ModelStore(path).latest() == 3
+
+    version, model = store.rollback()
+    assert version == 2
+    assert model.max_depth == 2
+    assert store.versions() == [2]
+    with pytest.raises(ValueError):
+        store.rollback()
+    store.close()
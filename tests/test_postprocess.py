@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+import pytest
+
+from alf import anotator
+from alf import context_manager
+from alf import d_manager
+from alf import ip_flow
+from alf import ml_model
+from alf import postprocess
+
+ContextProvider = context_manager.ContextProvider
+DbProvider = d_manager.DbProvider
+IPFlowsDataFrame = ip_flow.IPFlowsDataFrame
+
+d_0_path = "tests/test_files/test.csv"
+features = [
+    'bytes_rev',
+    'bytes'
+]
+
+pytestmark = pytest.mark.usefixtures("isolated_random")
+
+
+def create_db(exp_id: str, wd: str) -> d_manager.DManager:
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id(exp_id)
+    ContextProvider.get_context().set_working_dir(wd)
+    ContextProvider.get_context().set_features(features)
+    DbProvider.create_context("file", d_0_path=d_0_path)
+    DbProvider.get_context().fetch(test_size=0.5)
+    return DbProvider.get_context()
+
+
+def test_annotation_queue_merge(tmp_path):
+    """Resolved labels are merged into db, pending are reported."""
+    db = create_db("pp_queue", str(tmp_path))
+    queue = anotator.AnnotationQueue(str(tmp_path / "queue.sqlite"))
+    flows = IPFlowsDataFrame({
+        "bytes_rev": [1, 2, 3],
+        "bytes": [4, 5, 6],
+    })
+    ids = anotator.AnotatorHumanQueue(queue).anotate(flows)["annotation_id"]
+    queue.resolve(ids.iloc[0], False)
+    postprocessor = postprocess.PostprocessorAnnotationQueue(queue)
+    postprocessor.postprocess()
+    assert len(db.get_all()) == 7
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["annotation_pending"] == 2
+    assert metrics["annotation_merged"] == 1
+    postprocessor.postprocess()
+    assert len(db.get_all()) == 7
+    db.fetch(test_size=0.5)
+    assert len(db.get_all()) == 7
+
+
+def test_reservoir(tmp_path):
+    """Reservoirs are bounded and old flows are only evicted."""
+    db = create_db("pp_reservoir", str(tmp_path))
+    postprocessor = postprocess.PostprocessorReservoir(4)
+    postprocessor.postprocess()
+    assert db.class_counts() == {True: 2, False: 2}
+    old = db.get_all().copy()
+    for generation in range(5):
+        db.append_to_db(IPFlowsDataFrame({
+            "class": [True, True, False],
+            "bytes_rev": [generation] * 3,
+            "bytes": [generation] * 3,
+        }))
+        postprocessor.postprocess()
+        assert db.class_counts() == {True: 2, False: 2}
+    stored = db.get_all()
+    kept = stored[stored["bytes_rev"] > 4]
+    assert set(kept["bytes"]) <= set(old["bytes"])
+    metrics = ContextProvider.get_context().get_metrics()
+    assert metrics["reservoir_evicted"] == 3
+    db.fetch(test_size=0.5)
+    assert len(db.get_all()) == 4
+
+
+def test_retention(tmp_path):
+    """Flows older than window are evicted, decay follows age."""
+    db = create_db("pp_retention", str(tmp_path))
+    postprocessor = postprocess.PostprocessorRetention(2, half_life=1)
+    postprocessor.postprocess()
+    assert list(db.get_all()["decay"]) == [1.0] * 6
+    db.append_to_db(IPFlowsDataFrame({
+        "class": [True, False],
+        "bytes_rev": [1, 2],
+        "bytes": [1, 2],
+    }))
+    postprocessor.postprocess()
+    assert list(db.get_all()["decay"]) == [0.5] * 6 + [1.0] * 2
+    postprocessor.postprocess()
+    flows = db.get_all()
+    assert list(flows["bytes"]) == [1, 2]
+    assert list(flows["generation"]) == [1, 1]
+    assert ContextProvider.get_context().get_metrics()[
+        "retention_evicted"] == 6
+    db.fetch(test_size=0.5)
+    assert list(db.get_all()["decay"]) == [0.5, 0.5]
+    # models train with decay as sample weight
+    X_train, _ = db.get_train_set()
+    assert list(ml_model._fit_params(X_train)["sample_weight"]) == [0.5]
+
+
+def test_retention_ring_buffer(tmp_path):
+    """Ring buffer does not store generation of flows."""
+    create_db("pp_retention_ring", str(tmp_path))
+    DbProvider.create_context("ring", d_0_path=d_0_path, capacity=8)
+    with pytest.raises(TypeError):
+        postprocess.PostprocessorRetention(2).postprocess()
+
+
+def test_condense(tmp_path):
+    """Condensed database keeps spread of every class."""
+    db = create_db("pp_condense", str(tmp_path))
+    db.append_to_db(IPFlowsDataFrame({
+        "class": [True] * 4,
+        "bytes_rev": [100, 101, 102, 103],
+        "bytes": [100, 101, 102, 103],
+    }))
+    postprocess.PostprocessorCondense(6).postprocess()
+    assert db.class_counts() == {True: 3, False: 3}
+    kept = set(db.get_all()["bytes"])
+    # only one of near duplicate flows is kept
+    assert len(kept & {100, 101, 102, 103}) == 1
+    postprocess.PostprocessorCondense(6).postprocess()
+    assert len(db.get_all()) == 6
+
+
+def test_condense_warm_start(tmp_path):
+    """Second run continues from stored centers and only new far flows
+    replace them, much faster than selection from scratch."""
+    db = create_db("pp_condense_warm", str(tmp_path))
+    postprocessor = postprocess.PostprocessorCondense(4)
+    postprocessor.postprocess()
+    assert not db.get_all()["condense_radius"].isna().any()
+    db.append_to_db(IPFlowsDataFrame({
+        "class": [True, True],
+        "bytes_rev": [10 ** 6, 10 ** 6],
+        "bytes": [10 ** 6, 10 ** 6 + 1],
+    }))
+    postprocessor.postprocess()
+    assert db.class_counts() == {True: 2, False: 2}
+    # one of near duplicate new flows replaces stored center
+    assert len(set(db.get_all()["bytes"]) & {10 ** 6, 10 ** 6 + 1}) == 1
+
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(5000, 24))
+    start = time.perf_counter()
+    selected, radii = postprocess._k_center(X, None, 3000)
+    cold = time.perf_counter() - start
+    X = np.vstack([X[selected], rng.normal(size=(50, 24))])
+    radii = np.concatenate([radii, np.full(50, np.nan)])
+    start = time.perf_counter()
+    selected, _ = postprocess._k_center(X, None, 3000, radii)
+    warm = time.perf_counter() - start
+    assert len(np.unique(selected)) == 3000
+    assert warm < cold / 5
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from alf import context_manager
+from alf import d_manager
+from alf import ip_flow
+from alf import ml_model
+from alf import shared_view
+
+ContextProvider = context_manager.ContextProvider
+DbProvider = d_manager.DbProvider
+IPFlowsDataFrame = ip_flow.IPFlowsDataFrame
+
+d_0_path = "tests/test_files/test.csv"
+features = [
+    'bytes_rev',
+    'bytes'
+]
+
+pytestmark = pytest.mark.usefixtures("isolated_random")
+
+
+def test_publish_frame_and_model(tmp_path):
+    name = f"alf_test_{os.getpid()}"
+    ContextProvider.create_context("file")
+    ContextProvider.get_context().set_experiment_id("sv_1")
+    ContextProvider.get_context().set_working_dir(str(tmp_path))
+    ContextProvider.get_context().set_features(features)
+    DbProvider.create_context(
+        "memory", d_0_path=d_0_path, shared_memory=f"{name}_db")
+    db = DbProvider.get_context()
+    db.fetch(test_size=0.5)
+    db.commit()
+    view = shared_view.attach_frame(f"{name}_db")
+    assert view.version == 1
+    frame = view.frame
+    assert list(frame.columns) == ["class"] + features + [
+        "packets", "packets_rev"]
+    assert np.array_equal(frame["bytes"], db.get_all()["bytes"])
+    db.append_to_db(IPFlowsDataFrame([{"class": True, "bytes_rev": 1,
+                                       "bytes": 2}]))
+    db.commit()
+    assert len(frame) == 6
+    del frame
+    view.close()
+    view = shared_view.attach_frame(f"{name}_db")
+    assert view.version == 2
+    assert view.frame["bytes"].iloc[-1] == 2
+    view.close()
+
+    model = ml_model.SupervisedMLModel(
+        DecisionTreeClassifier(), shared_memory=f"{name}_model")
+    model.train()
+    version, clf = shared_view.attach_model(f"{name}_model")
+    assert version == 1
+    X = db.get_all()[features]
+    assert np.array_equal(clf.predict(X), model.predict_hard(X))
+    model._shared.close()
+    db._shared.close()
+    with pytest.raises(FileNotFoundError):
+        shared_view.attach(f"{name}_db")
@@ -35,7 +35,8 @@ def test_anotation():
         assert flows.shape[1] == 34
 
         result = anot.anotate(flows)
-        assert result.shape[1] == flows.shape[1] + 1
+        assert list(result.columns) == ["class"]
+        assert len(result) == len(flows)
         break
 
 def test_preprocess():
@@ -56,8 +57,8 @@ def test_preprocess():
         preprocessed = preprocess.PreprocessorDoH().preprocess(flows)
         assert preprocessed.shape[1] == 60
         result = anot.anotate(preprocessed)
-        assert result.shape[1] == preprocessed.shape[1] + 1
-        assert result.shape == (3341, 61)
+        assert result.index.equals(preprocessed.index)
+        assert result.shape == (3341, 1)
 
         break
 